@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Category, News, Tag, User
+from .models import Category, DailyDigest, News, Tag, User
 
 # Register your models here.
 
@@ -8,3 +8,4 @@ admin.site.register(User)
 admin.site.register(Category)
 admin.site.register(Tag)
 admin.site.register(News)
+admin.site.register(DailyDigest)
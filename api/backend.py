@@ -0,0 +1,83 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+from . import complexity, db_router, feed_cache
+
+
+def _execute(schema, document_ast, validation_errors, *args, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+    kwargs.pop('validate', None)
+    variables = kwargs.get('variable_values')
+    operation_name = kwargs.get('operation_name')
+
+    # 件数が変数で指定されることがあるため、コストは実行のたびに見積もる
+    cost = complexity.calculate_cost(schema, document_ast, variables, operation_name)
+    if cost is not None:
+        errors = complexity.check_cost(cost)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True, extensions={'cost': cost})
+
+    # 日付単位のニュース一覧は、実行結果のデータ全体をキャッシュする
+    key, timeout = feed_cache.make_key(document_ast, variables, operation_name)
+    result = None
+    if key is not None:
+        data = feed_cache.get_result(key)
+        if data is not None:
+            result = ExecutionResult(data=data)
+    if result is None:
+        # キャッシュするものは、無効化の直後にレプリカの古いデータを新しいキーで保存しないよう、
+        # プライマリから読む
+        with db_router.route_operation(kwargs.get('context_value'), document_ast, operation_name,
+                                       primary=key is not None):
+            result = execute(schema, document_ast, *args, **kwargs)
+        if key is not None and isinstance(result, ExecutionResult) and not (
+                result.errors or result.invalid):
+            feed_cache.set_result(key, result.data, timeout)
+    if cost is not None and isinstance(result, ExecutionResult):
+        result.extensions['cost'] = cost
+    return result
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    """パースと検証を済ませたドキュメントを、件数の上限つきで保持するバックエンド"""
+
+    def __init__(self, max_size=500, executor=None):
+        self.max_size = max_size
+        self.execute_params = {'executor': executor}
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_document(self, schema, document_string):
+        document_ast = parse(document_string)
+        # 検証結果も含めてキャッシュし、実行時には検証しない
+        validation_errors = validate(schema, document_ast)
+        return GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(_execute, schema, document_ast, validation_errors,
+                            **self.execute_params),
+        )
+
+    def document_from_string(self, schema, document_string):
+        key = (id(schema), hashlib.sha256(document_string.encode('utf-8')).digest())
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        document = self._make_document(schema, document_string)
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
@@ -0,0 +1,208 @@
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARK_URL_PREFIX = 'https://bench.example.com/news/'
+BENCHMARK_EMAIL_DOMAIN = 'bench.example.com'
+BENCHMARK_PASSWORD = 'benchmark-password'
+# createNewsで登録される、ローカルのHTTPサーバーを指すURLに含まれる文字列
+FIXTURE_PATH = '/bench-article/'
+
+FIXTURE_HTML = ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+                '<title>ベンチマーク用の記事</title>'
+                '<meta property="og:title" content="ベンチマーク用の記事 {path}">'
+                '<meta property="og:description" content="ベンチマーク用の記事の概要です。">'
+                '<meta property="og:image" content="https://bench.example.com/images/1.png">'
+                '</head><body>{body}</body></html>')
+
+FEED_QUERY = '''
+query Feed($first: Int) {
+  allNews(first: $first) {
+    edges { node { id url title summary imagePath createdAt contributorName
+      selectCategory { id categoryName }
+      tags { edges { node { id tagName } } } } }
+  }
+}'''
+
+# 一覧の画面全体（ニュースと、絞り込み用のカテゴリー・タグの一覧）
+FEED_FULL_QUERY = '''
+query FeedFull($first: Int) {
+  allNews(first: $first) {
+    edges { node { id url title summary imagePath createdAt contributorName
+      selectCategory { id categoryName }
+      tags { edges { node { id tagName } } } } }
+  }
+  allCategories { edges { node { id categoryName } } }
+  allTags { edges { node { id tagName } } }
+}'''
+
+TODAY_QUERY = '''
+query Today {
+  todayNews {
+    edges { node { id url title summary imagePath createdAt contributorName
+      selectCategory { id categoryName }
+      tags { edges { node { id tagName } } } } }
+  }
+}'''
+
+SPECIFIC_DAY_QUERY = '''
+query SpecificDay($year: Int!, $month: Int!, $day: Int!) {
+  specificDayNews(year: $year, month: $month, day: $day) {
+    edges { node { id url title summary imagePath createdAt
+      selectCategory { id categoryName }
+      tags { edges { node { id tagName } } } } }
+  }
+}'''
+
+# 無限スクロールのアーカイブ（ページの深さによらず同じ時間になるか比べる）
+ARCHIVE_PAGE_SIZE = 20
+ARCHIVE_QUERY = '''
+query Archive($first: Int, $after: String, $offset: Int) {
+  allNews(first: $first, after: $after, offset: $offset) {
+    edges { node { id url title imagePath createdAt } }
+    pageInfo { hasNextPage endCursor }
+  }
+}'''
+
+SEARCH_QUERY = '''
+query Search($query: String!) {
+  searchNews(query: $query, first: 20) {
+    edges { node { id url title summary createdAt } }
+  }
+}'''
+
+CREATE_NEWS_MUTATION = '''
+mutation CreateNews($url: String!, $createdAt: Int!) {
+  createNews(input: {url: $url, createdAt: $createdAt}) {
+    news { id metadataStatus }
+  }
+}'''
+
+TOKEN_AUTH_MUTATION = '''
+mutation TokenAuth($email: String!, $password: String!) {
+  tokenAuth(email: $email, password: $password) { token }
+}'''
+
+SEARCH_WORDS = ['python', 'django', 'リリース', '記事', 'graphql', 'セキュリティ', 'ai']
+
+TITLE_WORDS = ['Python', 'Django', 'GraphQL', 'React', 'TypeScript', 'Rust', 'AI',
+               'リリース', 'セキュリティ', '新機能', '入門', '記事', 'まとめ', 'アップデート']
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    body_size = 200 * 1024
+    # 遅いサイトの再現。レスポンスを返し始めるまでの秒数
+    delay = 0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        content = FIXTURE_HTML.format(path=self.path, body='x' * self.body_size).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        try:
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # 取得する側がタイムアウトで切断した
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(delay=0):
+    """OGPの取得先として使う、ローカルのHTTPサーバーを起動してベースURLを返す
+
+    delayを指定すると、レスポンスを返すまでその秒数待つ遅いサイトになる。
+    """
+    handler = type('FixtureHandler', (_FixtureHandler,), {'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://localhost:%d' % server.server_port
+
+
+def make_title(rng):
+    return ' '.join(rng.sample(TITLE_WORDS, 3))
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(ratio * len(values)) - 1))
+    return values[index]
+
+
+class Operations:
+    """操作ごとに、実行するクエリと変数を作る"""
+
+    def __init__(self, fixture_url, days, user_emails, seed=None, tokens=(),
+                 deep_cursor=None, deep_offset=0):
+        self.fixture_url = fixture_url
+        self.days = days
+        self.user_emails = user_emails
+        self.tokens = list(tokens)
+        # 深いページの先頭（カーソルと、同じ位置のoffset）
+        self.deep_cursor = deep_cursor
+        self.deep_offset = deep_offset
+        self.rng = random.Random(seed)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def feed(self):
+        return FEED_QUERY, {'first': 20}
+
+    def feed_full(self):
+        return FEED_FULL_QUERY, {'first': 20}
+
+    def feed_authed(self):
+        # feedとの差が、JWTでの認証にかかる時間とクエリ数になる
+        return self.feed()
+
+    def today(self):
+        return TODAY_QUERY, {}
+
+    def specific_day(self):
+        day = self.rng.choice(self.days)
+        return SPECIFIC_DAY_QUERY, {'year': day.year, 'month': day.month, 'day': day.day}
+
+    def archive_first(self):
+        return ARCHIVE_QUERY, {'first': ARCHIVE_PAGE_SIZE}
+
+    def archive_deep(self):
+        return ARCHIVE_QUERY, {'first': ARCHIVE_PAGE_SIZE, 'after': self.deep_cursor}
+
+    def archive_deep_offset(self):
+        # キーセットを使わない、以前のOFFSETでのページング
+        return ARCHIVE_QUERY, {'first': ARCHIVE_PAGE_SIZE, 'offset': self.deep_offset}
+
+    def search(self):
+        return SEARCH_QUERY, {'query': self.rng.choice(SEARCH_WORDS)}
+
+    def create(self):
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        url = '%s%s%d-%d' % (self.fixture_url, FIXTURE_PATH, int(time.time() * 1000), counter)
+        return CREATE_NEWS_MUTATION, {'url': url, 'createdAt': int(time.time())}
+
+    def auth(self):
+        return TOKEN_AUTH_MUTATION, {'email': self.rng.choice(self.user_emails),
+                                     'password': BENCHMARK_PASSWORD}
+
+    def get(self, name):
+        return getattr(self, name)()
+
+    def headers(self, name):
+        if name in self.authenticated_names:
+            return {'HTTP_AUTHORIZATION': 'JWT ' + self.rng.choice(self.tokens)}
+        return {}
+
+    names = ('feed', 'feed_full', 'feed_authed', 'today', 'specific_day', 'archive_first',
+             'archive_deep', 'archive_deep_offset', 'search', 'create', 'auth')
+    authenticated_names = ('feed_authed',)
@@ -0,0 +1,103 @@
+import threading
+from collections.abc import Mapping
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+
+from .models import CatalogVersion, Category, Tag
+
+VERSION_ID = 1
+
+_lock = threading.Lock()
+_catalog = None
+
+
+def _field_names(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+class Catalog:
+    """ある版の、すべてのタグとカテゴリー
+
+    ワーカーのすべてのリクエスト（スレッド）で共有するため、モデルのインスタンスではなく、
+    主キーごとの値のタプルで持つ。
+    """
+
+    def __init__(self, version, tag_rows, category_rows):
+        self.version = version
+        self.tag_rows = {row[0]: row for row in tag_rows}
+        self.category_rows = {row[0]: row for row in category_rows}
+
+
+class _Instances(Mapping):
+    """共有する値から、リクエストごとに別のモデルのインスタンスを作る辞書（主キーからインスタンス）"""
+
+    def __init__(self, model, rows):
+        self.model = model
+        self.field_names = _field_names(model)
+        self.rows = rows
+        self._instances = {}
+
+    def __getitem__(self, pk):
+        instance = self._instances.get(pk)
+        if instance is None:
+            instance = self._instances[pk] = self.model.from_db(
+                DEFAULT_DB_ALIAS, self.field_names, self.rows[pk])
+        return instance
+
+    def __contains__(self, pk):
+        return pk in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class RequestCatalog:
+    """1つのリクエストで使うカタログ。tagsとcategoriesは主キーからインスタンスへの辞書"""
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.tags = _Instances(Tag, catalog.tag_rows)
+        self.categories = _Instances(Category, catalog.category_rows)
+
+
+def get_version():
+    return CatalogVersion.objects.filter(pk=VERSION_ID).values_list('version', flat=True).first() or 0
+
+
+def bump_version():
+    """タグかカテゴリーを変更したトランザクションで版を上げ、各ワーカーのカタログを読み直させる"""
+    if not CatalogVersion.objects.filter(pk=VERSION_ID).update(version=F('version') + 1):
+        CatalogVersion.objects.get_or_create(pk=VERSION_ID, defaults={'version': 1})
+
+
+def load():
+    """版を確認し、変わっていればタグとカテゴリーを読み直す
+
+    版を先に読むため、読み込み中に変更されても、次の確認で読み直される。
+    """
+    global _catalog
+    version = get_version()
+    with _lock:
+        if _catalog is None or _catalog.version != version:
+            _catalog = Catalog(
+                version,
+                list(Tag.objects.order_by('id').values_list(*_field_names(Tag))),
+                list(Category.objects.order_by('id').values_list(*_field_names(Category))))
+        return _catalog
+
+
+def get_catalog(request=None):
+    """このワーカーのカタログを返す。版の確認はリクエストごとに1回だけ行う
+
+    返したインスタンスを変更しても、他のリクエストには影響しない。
+    """
+    if request is None:
+        return RequestCatalog(load())
+    catalog = getattr(request, '_catalog', None)
+    if catalog is None:
+        catalog = request._catalog = RequestCatalog(load())
+    return catalog
@@ -0,0 +1,125 @@
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import GraphQLEnumType, GraphQLScalarType, get_named_type
+
+
+class QueryTooComplex(GraphQLError):
+    pass
+
+
+def _argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        return variables.get(value.name.value)
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    return None
+
+
+def _multiplier(field_ast, field_def, variables, default_count=None):
+    # first/lastを取るフィールド（コネクション）は、取得する件数を掛ける
+    if 'first' not in field_def.args and 'last' not in field_def.args:
+        return 1
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    counts = [_argument_value(argument.value, variables) for argument in field_ast.arguments
+              if argument.name.value in ('first', 'last')]
+    counts = [count for count in counts if isinstance(count, int)]
+    # 件数の指定がない場合は、DEFAULT_COUNTSの件数か、上限の件数を返すものとして数える
+    count = min(counts) if counts else (default_count or max_limit)
+    return max(0, min(count, max_limit) if max_limit is not None else count)
+
+
+class _CostCalculator:
+    def __init__(self, schema, fragments, variables):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+        self.weights = settings.GRAPHQL_QUERY_COST['FIELD_WEIGHTS']
+        self.default_counts = settings.GRAPHQL_QUERY_COST['DEFAULT_COUNTS']
+
+    def _iter_fields(self, parent_type, selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield parent_type, selection
+                continue
+            if isinstance(selection, ast.FragmentSpread):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is None:
+                    continue
+                type_condition, selection_set = fragment.type_condition, fragment.selection_set
+            else:
+                type_condition, selection_set = selection.type_condition, selection.selection_set
+            fragment_type = parent_type
+            if type_condition is not None:
+                fragment_type = self.schema.get_type(type_condition.name.value) or parent_type
+            yield from self._iter_fields(fragment_type, selection_set)
+
+    def selection_cost(self, parent_type, selection_set, depth):
+        """選択セットのコストと深さを返す"""
+        cost, max_depth = 0, depth
+        for field_type, field_ast in self._iter_fields(parent_type, selection_set):
+            name = field_ast.name.value
+            # __typenameやイントロスペクションは数えない
+            if name.startswith('__'):
+                continue
+            field_def = getattr(field_type, 'fields', {}).get(name)
+            if field_def is None:
+                continue
+            return_type = get_named_type(field_def.type)
+            leaf = isinstance(return_type, (GraphQLScalarType, GraphQLEnumType))
+            key = '%s.%s' % (field_type.name, name)
+            weight = self.weights.get(key, 0 if leaf else 1)
+
+            child_cost, child_depth = 0, depth + 1
+            if field_ast.selection_set is not None and not leaf:
+                child_cost, child_depth = self.selection_cost(
+                    return_type, field_ast.selection_set, depth + 1)
+            multiplier = _multiplier(field_ast, field_def, self.variables, self.default_counts.get(key))
+            cost += weight + multiplier * child_cost
+            max_depth = max(max_depth, child_depth)
+        return cost, max_depth
+
+
+def _get_operation(document_ast, operation_name):
+    operations = [definition for definition in document_ast.definitions
+                  if isinstance(definition, ast.OperationDefinition)]
+    if operation_name:
+        operations = [operation for operation in operations
+                      if operation.name and operation.name.value == operation_name]
+    return operations[0] if len(operations) == 1 else None
+
+
+def calculate_cost(schema, document_ast, variables=None, operation_name=None):
+    """実行前に、クエリのコストと深さを見積もる
+
+    フィールドごとの重み（オブジェクトは1、スカラーは0、FIELD_WEIGHTSで変更できる）に、
+    コネクションの子のコストとfirst/lastの件数（指定がなければDEFAULT_COUNTSか上限の件数）を
+    掛けたものを足し合わせる。
+    """
+    operation = _get_operation(document_ast, operation_name)
+    if operation is None:
+        return None
+    root_type = {
+        'query': schema.get_query_type(),
+        'mutation': schema.get_mutation_type(),
+        'subscription': schema.get_subscription_type(),
+    }[operation.operation]
+    fragments = {definition.name.value: definition for definition in document_ast.definitions
+                 if isinstance(definition, ast.FragmentDefinition)}
+    calculator = _CostCalculator(schema, fragments, variables or {})
+    cost, depth = calculator.selection_cost(root_type, operation.selection_set, 0)
+    return {'cost': cost, 'depth': depth}
+
+
+def check_cost(cost):
+    """上限を超えるクエリのエラーを返す"""
+    options = settings.GRAPHQL_QUERY_COST
+    errors = []
+    if options['MAX_DEPTH'] and cost['depth'] > options['MAX_DEPTH']:
+        errors.append(QueryTooComplex('Query depth %d exceeds the maximum of %d.' % (
+            cost['depth'], options['MAX_DEPTH'])))
+    if options['MAX_COST'] and cost['cost'] > options['MAX_COST']:
+        errors.append(QueryTooComplex('Query cost %d exceeds the maximum of %d.' % (
+            cost['cost'], options['MAX_COST'])))
+    return errors
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+@receiver(connection_created)
+def count_opened(sender, connection, **kwargs):
+    _count('opened')
+
+
+def _needs_check(connection, now):
+    # 直前のリクエストで使った接続は切れていることがほとんどないため、しばらく使われていなかったものと、
+    # エラーが起きたものだけを確かめる
+    last_used_at = getattr(connection, 'last_used_at', None)
+    return (connection.errors_occurred or last_used_at is None
+            or now - last_used_at >= settings.DB_CONNECTIONS['HEALTH_CHECK_IDLE'])
+
+
+def check_connections():
+    """使い回す接続が切れていないか確認し、使えない接続は閉じて次の利用時に接続し直す
+
+    確認（SELECT 1）は、HEALTH_CHECK_IDLE秒以上使われていなかった接続と、エラーが起きた接続だけ行う。
+    CONN_MAX_AGEを超えた接続は、この前にDjangoのclose_old_connectionsで閉じられている。
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        if settings.DB_CONNECTIONS['HEALTH_CHECKS'] and _needs_check(connection, now):
+            _count('checked')
+            if not connection.is_usable():
+                _count('failed')
+                connection.close()
+                continue
+        _count('reused')
+
+
+def mark_connections_used():
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used_at = now
+
+
+@receiver(request_started)
+def check_connections_on_request(sender, **kwargs):
+    check_connections()
+
+
+@receiver(request_finished)
+def mark_connections_used_on_request(sender, **kwargs):
+    mark_connections_used()
+
+
+def get_stats():
+    with _stats_lock:
+        return {name: _stats[name] for name in ('opened', 'reused', 'checked', 'failed')}
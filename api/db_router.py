@@ -0,0 +1,97 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from .ratelimit import get_client_ip
+
+PRIMARY = 'default'
+
+# 読み取りに使うレプリカ（Noneの場合はプライマリ）。スレッドや非同期のタスクごとに持つ
+_replica = ContextVar('replica', default=None)
+
+
+class ReplicaRouter:
+    """GraphQLのqueryを実行している間の読み取りを、レプリカに振り分けるルーター
+
+    それ以外（mutation、管理画面、ワーカー、コマンドなど）は、すべてプライマリを使う。
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリと同じデータを持つ
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # どのデータベースでもTrueを返す。manage.py migrateは--databaseで指定したもの
+        # （デフォルトはプライマリ）にだけ実行され、レプリカへはプライマリから複製される。
+        # テストでは、レプリカのテスト用データベースにもこれでテーブルを作る
+        return True
+
+
+@contextmanager
+def use_replica(alias):
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def use_primary():
+    return use_replica(None)
+
+
+def _get_cache():
+    return caches[settings.DB_REPLICAS['CACHE_ALIAS']]
+
+
+def _make_key(request):
+    # JWTの認証はクエリの実行中に行われるため、クライアントはIPアドレスで見分ける
+    return 'db-replica-sticky:' + get_client_ip(request)
+
+
+def is_sticky(request):
+    return _get_cache().get(_make_key(request)) is not None
+
+
+def mark_written(request):
+    """書き込んだクライアントの読み取りを、レプリカに反映されるまでプライマリに固定する"""
+    timeout = settings.DB_REPLICAS['STICKY_SECONDS']
+    if timeout:
+        _get_cache().set(_make_key(request), True, timeout)
+
+
+def choose_replica(request, operation_type):
+    aliases = settings.DB_REPLICAS['ALIASES']
+    if operation_type != 'query' or not aliases:
+        return None
+    if isinstance(request, HttpRequest) and is_sticky(request):
+        return None
+    return random.choice(aliases)
+
+
+@contextmanager
+def route_operation(request, document_ast, operation_name, primary=False):
+    """GraphQLの操作に合わせて、読み取りに使うデータベースを決める
+
+    queryはレプリカから読み、mutation（tokenAuthを含む）と、その直後の同じクライアントの
+    queryはプライマリを使う。primaryを指定すると、queryもプライマリを使う。
+    """
+    operation = get_operation_ast(document_ast, operation_name)
+    operation_type = operation.operation if operation is not None else None
+    try:
+        with use_replica(None if primary else choose_replica(request, operation_type)):
+            yield
+    finally:
+        if operation_type == 'mutation' and isinstance(request, HttpRequest):
+            mark_written(request)
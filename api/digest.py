@@ -0,0 +1,58 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from graphql_relay import to_global_id
+
+from .models import DailyDigest, News
+
+
+def serialize_news(news):
+    """ダイジェストに保存する、ニュース1件分の内容"""
+    return {
+        'id': to_global_id('NewsNode', news.pk),
+        'url': news.url,
+        'title': news.title,
+        'summary': news.summary,
+        'image_path': news.image_path,
+        'contributor_name': news.contributor_name,
+        'created_at': news.created_at.isoformat(),
+        'category_name': news.select_category.category_name if news.select_category_id else None,
+        'tag_names': [tag.tag_name for tag in news.tags.all()],
+    }
+
+
+def build_items(queryset):
+    news = queryset.select_related('select_category').prefetch_related('tags').order_by('created_at', 'id')
+    return [serialize_news(item) for item in news]
+
+
+def refresh_days(days):
+    """指定された日付のダイジェストを作り直す。ニュースがない日のダイジェストは削除する"""
+    for day in sorted({day for day in days if day is not None}):
+        items = build_items(News.objects.on_day(day))
+        if items:
+            _save(day, items)
+        else:
+            DailyDigest.objects.filter(day=day).delete()
+
+
+def _save(day, items):
+    # update_or_createは読んでから書くため、SQLiteでは同じ日付を同時に更新するとロックで失敗する
+    digests = DailyDigest.objects.filter(day=day)
+    if digests.update(items=items, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            DailyDigest.objects.create(day=day, items=items)
+    except IntegrityError:
+        digests.update(items=items, updated_at=timezone.now())
+
+
+def refresh_all():
+    days = {value.date() for value in News.objects.datetimes('created_at', 'day')}
+    DailyDigest.objects.exclude(day__in=days).delete()
+    refresh_days(days)
+    return len(days)
+
+
+def get_digest(day):
+    return DailyDigest.objects.filter(day=day).first()
@@ -0,0 +1,148 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+from graphql.language import ast
+from graphql.language.printer import print_ast
+
+# 実行結果をまとめてキャッシュできる、日付単位のフィールド
+FEED_FIELDS = {'todayNews', 'yesterdayNews', 'specificDayNews'}
+GLOBAL_VERSION = 'global'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _get_cache():
+    return caches[settings.FEED_CACHE['CACHE_ALIAS']]
+
+
+def is_shared():
+    """無効化をすべてのワーカーで共有できるキャッシュか（ワーカーごとのメモリでないか）"""
+    return not isinstance(_get_cache(), LocMemCache)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _version_key(name):
+    return 'feed-version:' + name
+
+
+def _argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        return variables.get(value.name.value)
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    return None
+
+
+def _field_day(field, variables):
+    name = field.name.value
+    today = timezone.localdate()
+    if name == 'todayNews':
+        return today
+    if name == 'yesterdayNews':
+        return today - datetime.timedelta(days=1)
+    arguments = {argument.name.value: _argument_value(argument.value, variables)
+                 for argument in field.arguments}
+    try:
+        return datetime.date(arguments['year'], arguments['month'], arguments['day'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_feed_days(document, variables, operation_name):
+    """日付単位のフィールドだけを読むクエリなら、その日付のリストを返す"""
+    operations = [definition for definition in document.definitions
+                  if isinstance(definition, ast.OperationDefinition)]
+    if operation_name:
+        operations = [operation for operation in operations
+                      if operation.name and operation.name.value == operation_name]
+    if len(operations) != 1 or operations[0].operation != 'query':
+        return None
+
+    days = set()
+    for selection in operations[0].selection_set.selections:
+        if not isinstance(selection, ast.Field):
+            return None
+        if selection.name.value == '__typename':
+            continue
+        if selection.name.value not in FEED_FIELDS:
+            return None
+        day = _field_day(selection, variables)
+        if day is None:
+            return None
+        days.add(day)
+    return sorted(days) or None
+
+
+def _get_versions(names):
+    cache = _get_cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # キャッシュから消えたバージョンは、過去と重ならない値で作り直す
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def make_key(document, variables, operation_name):
+    """キャッシュできるクエリであれば、キャッシュキーと有効期限を返す"""
+    variables = variables or {}
+    days = get_feed_days(document, variables, operation_name)
+    if days is None:
+        return None, None
+
+    names = [GLOBAL_VERSION] + [day.isoformat() for day in days]
+    source = json.dumps([
+        print_ast(document), variables, operation_name, names, _get_versions(names),
+    ], sort_keys=True, default=str)
+    key = 'feed-result:' + hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    # 過去の日付はほとんど変わらないので長めにキャッシュする。ただし、ワーカーごとのメモリでは
+    # 他のワーカーの無効化が届かないため、短い有効期限で古いレスポンスを返す時間を抑える
+    if is_shared() and min(days) < timezone.localdate() - datetime.timedelta(days=1):
+        return key, settings.FEED_CACHE['HISTORICAL_TTL']
+    return key, settings.FEED_CACHE['TTL']
+
+
+def get_result(key):
+    """キャッシュした実行結果のdata"""
+    data = _get_cache().get(key)
+    _count('misses' if data is None else 'hits')
+    return data
+
+
+def set_result(key, data, timeout):
+    _get_cache().set(key, data, timeout)
+
+
+def invalidate_days(days):
+    """指定された日付のキャッシュを無効にする"""
+    names = {day.isoformat() for day in days if day is not None}
+    if names:
+        _get_cache().set_many({_version_key(name): time.time_ns() for name in names}, None)
+
+
+def invalidate_all():
+    _get_cache().set(_version_key(GLOBAL_VERSION), time.time_ns(), None)
+
+
+def get_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0,
+            'shared': is_shared()}
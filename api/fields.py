@@ -0,0 +1,173 @@
+import json
+
+import graphene
+from django.db.models import Manager, Q, QuerySet
+from graphene import relay
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql_relay.utils import base64, unbase64
+
+
+def _iter_fields(selection_set, info):
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            yield selection
+        elif isinstance(selection, ast.FragmentSpread):
+            yield from _iter_fields(info.fragments[selection.name.value].selection_set, info)
+        else:
+            yield from _iter_fields(selection.selection_set, info)
+
+
+def get_node_field_names(info):
+    """コネクションの edges { node { ... } } で要求されているフィールド名を返す"""
+    names = set()
+    for field_ast in info.field_asts:
+        for edges in _iter_fields(field_ast.selection_set, info):
+            if edges.name.value != 'edges':
+                continue
+            for node in _iter_fields(edges.selection_set, info):
+                if node.name.value == 'node':
+                    names.update(field.name.value for field in _iter_fields(node.selection_set, info))
+    return names
+
+
+class PrefetchedFilterConnectionField(DjangoFilterConnectionField):
+    """prefetch_relatedで取得済みの関連オブジェクトや、リゾルバが返したリストがあれば、
+    絞り込みの指定がない限りクエリを発行せずにそれを使う"""
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if isinstance(iterable, list):
+            if not any(key in filtering_args for key in args):
+                return iterable
+            # 絞り込む場合は、リストの要素に限ったクエリにする
+            model = connection._meta.node._meta.model
+            iterable = model.objects.filter(pk__in=[node.pk for node in iterable])
+        if isinstance(iterable, Manager) and not any(key in filtering_args for key in args):
+            prefetched = getattr(iterable.instance, '_prefetched_objects_cache', {})
+            if iterable.prefetch_cache_name in prefetched:
+                return list(iterable.all())
+        return super(PrefetchedFilterConnectionField, cls).resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class)
+
+
+class CountableConnection(relay.Connection):
+    """totalCountが要求されたときだけCOUNTクエリを発行するコネクション"""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(self, info, **kwargs):
+        if isinstance(self.iterable, QuerySet):
+            return self.iterable.count()
+        return len(self.iterable)
+
+
+class KeysetConnectionField(PrefetchedFilterConnectionField):
+    """OFFSETではなく、orderingの値をカーソルにしてページングするコネクション
+
+    orderingの最後のフィールドは一意である必要がある。'-'を付けたフィールドは降順に並べる。
+    offsetが指定された場合は、通常のページングを行う。
+    """
+
+    ordering = ('id',)
+    cursor_prefix = 'keyset:'
+
+    @classmethod
+    def get_field_names(cls):
+        return [field.lstrip('-') for field in cls.ordering]
+
+    @classmethod
+    def encode_cursor(cls, node):
+        values = [getattr(node, field) for field in cls.get_field_names()]
+        # マイクロ秒まで含めないと同じ値で比較できないため、isoformat()をそのまま使う
+        return base64(cls.cursor_prefix + json.dumps(values, default=lambda value: value.isoformat()))
+
+    @classmethod
+    def decode_cursor(cls, model, cursor):
+        try:
+            value = unbase64(cursor)
+            if not value.startswith(cls.cursor_prefix):
+                raise ValueError(cursor)
+            values = json.loads(value[len(cls.cursor_prefix):])
+            return [model._meta.get_field(field).to_python(value)
+                    for field, value in zip(cls.get_field_names(), values)]
+        except Exception:
+            raise GraphQLError('Invalid cursor: {}'.format(cursor))
+
+    @classmethod
+    def keyset_filter(cls, values, after):
+        """カーソルより後（afterがFalseの場合は前）の行に絞り込む条件
+
+        (a, b) > (x, y) を (a > x) OR (a = x AND b > y) に展開する。降順のフィールドは大小を逆にする。
+        ORのままではインデックスをカーソルの位置から読めないため、a >= x も加える。
+        """
+        names = cls.get_field_names()
+        lookups = ['gt' if after != field.startswith('-') else 'lt' for field in cls.ordering]
+        condition = Q()
+        for index, lookup in enumerate(lookups):
+            term = Q(**{'{}__{}'.format(names[index], lookup): values[index]})
+            for previous, value in zip(names[:index], values):
+                term &= Q(**{previous: value})
+            condition |= term
+        return Q(**{'{}__{}e'.format(names[0], lookups[0]): values[0]}) & condition
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        if isinstance(iterable, QuerySet):
+            # offsetでのページングでも、同じ順に並べる
+            iterable = iterable.order_by(*cls.ordering)
+        if args.get('offset') or not isinstance(iterable, QuerySet):
+            return super(KeysetConnectionField, cls).resolve_connection(
+                connection, args, iterable, max_limit=max_limit)
+
+        first = args.get('first')
+        last = args.get('last')
+        after = args.get('after')
+        before = args.get('before')
+        model = iterable.model
+
+        queryset = iterable
+        if after:
+            queryset = queryset.filter(cls.keyset_filter(cls.decode_cursor(model, after), True))
+        if before:
+            queryset = queryset.filter(cls.keyset_filter(cls.decode_cursor(model, before), False))
+
+        if last is not None and first is None:
+            # 後ろから数える場合は逆順に取得して並べ直す
+            reverse = [field[1:] if field.startswith('-') else '-' + field for field in cls.ordering]
+            nodes = list(queryset.order_by(*reverse)[:last + 1])
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+            has_next_page = bool(before)
+        else:
+            limit = first if first is not None else max_limit
+            if limit is not None:
+                nodes = list(queryset[:limit + 1])
+                has_next_page = len(nodes) > limit
+                nodes = nodes[:limit]
+            else:
+                nodes = list(queryset)
+                has_next_page = False
+            has_previous_page = bool(after)
+            if last is not None:
+                has_previous_page = has_previous_page or len(nodes) > last
+                nodes = nodes[-last:] if last else []
+
+        edges = [connection.Edge(node=node, cursor=cls.encode_cursor(node)) for node in nodes]
+        page_info = relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        )
+        connection = connection(edges=edges, page_info=page_info)
+        connection.iterable = iterable
+        return connection
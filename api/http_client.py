@@ -0,0 +1,231 @@
+import contextlib
+import http.client
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# OGPを取り出せる形式のページだけを読む
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+
+_session = None
+_session_lock = threading.Lock()
+# ホストごとの集計。最近使ったSTATS_MAX_HOSTS件だけを残す
+STATS_MAX_HOSTS = 256
+_stats = OrderedDict()
+_stats_lock = threading.Lock()
+
+# 取得を打ち切る時刻（time.monotonic()）。再試行の判断と待ち時間に使う
+_deadline = ContextVar('http_deadline', default=None)
+
+
+class UnsupportedContentType(requests.RequestException):
+    """想定していない形式のレスポンス"""
+
+
+class ContentTooLarge(requests.RequestException):
+    """サイズが上限を超えるレスポンス"""
+
+
+class DeadlineExceeded(requests.Timeout):
+    """再試行と本文の読み込みを含めて、取得時間の上限を超えた"""
+
+
+def _remaining():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class JitterRetry(Retry):
+    """待ち時間にばらつきを持たせ、Retry-Afterの待ち時間に上限を設けたRetry"""
+
+    def _within_deadline(self, seconds):
+        remaining = _remaining()
+        return seconds if remaining is None else max(0, min(seconds, remaining))
+
+    def get_backoff_time(self):
+        # 同じサイトへの再試行が同時に集中しないよう、待ち時間をランダムにする
+        return self._within_deadline(random.uniform(0, super().get_backoff_time()))
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return self._within_deadline(min(retry_after, settings.NEWS_METADATA['RETRY_AFTER_MAX']))
+
+    def is_exhausted(self):
+        # 取得時間の上限を過ぎたら、残りの回数があっても再試行しない
+        remaining = _remaining()
+        return (remaining is not None and remaining <= 0) or super().is_exhausted()
+
+
+def _create_session():
+    options = settings.NEWS_METADATA
+    retry = JitterRetry(
+        total=options['RETRIES'],
+        # リダイレクトの回数はSessionのmax_redirectsで制限する
+        redirect=False,
+        backoff_factor=options['RETRY_BACKOFF'],
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # 接続はホストごとにプールして使い回す。pool_blockで同じホストへの接続数を制限する
+    adapter = HTTPAdapter(
+        pool_connections=options['POOL_HOSTS'],
+        pool_maxsize=options['PER_HOST_LIMIT'],
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.max_redirects = options['MAX_REDIRECTS']
+    session.headers.update({
+        'User-Agent': options['USER_AGENT'],
+        'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.1',
+        # 本文を受信した分ずつ読むため、圧縮しないよう求める（圧縮された場合はrequestsで展開する）
+        'Accept-Encoding': 'identity',
+    })
+    return session
+
+
+def get_session():
+    """プロセス全体で共有するSessionを返す"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        return _session
+
+
+def _record(url, duration, error):
+    host = urlsplit(url).hostname or ''
+    with _stats_lock:
+        stats = _stats.get(host)
+        if stats is None:
+            stats = _stats[host] = {'requests': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0}
+            if len(_stats) > STATS_MAX_HOSTS:
+                _stats.popitem(last=False)
+        else:
+            _stats.move_to_end(host)
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['total_time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+
+
+@contextlib.contextmanager
+def open_url(url, content_types, timeout=None):
+    """URLを本文を読まずに開き、レスポンスを返す
+
+    content_typesにない形式はUnsupportedContentTypeを送出する。本文はiter_contentで必要な分だけ読む。
+    timeout（省略時はNEWS_METADATA['TIMEOUT']）秒を過ぎたら、再試行や本文の読み込みの途中でも
+    DeadlineExceededを送出する。接続とヘッダーの受信は、urllib3のタイムアウト（CONNECT_TIMEOUT・
+    READ_TIMEOUTと残り時間の短い方）で制限する。
+    """
+    options = settings.NEWS_METADATA
+    timeout = options['TIMEOUT'] if timeout is None else timeout
+    started_at = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    token = _deadline.set(deadline)
+    error = True
+    try:
+        with get_session().get(
+                url, timeout=(min(options['CONNECT_TIMEOUT'], timeout),
+                              min(options['READ_TIMEOUT'], timeout)),
+                stream=True) as response:
+            response.deadline = deadline
+            if time.monotonic() >= deadline:
+                raise DeadlineExceeded(url, response=response)
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if content_type.split(';')[0].strip().lower() not in content_types:
+                raise UnsupportedContentType(content_type, response=response)
+            yield response
+            error = False
+    except requests.RequestException as e:
+        # 残り時間に縮めたタイムアウトでの読み込みエラーは、上限を超えたものとして扱う
+        if time.monotonic() >= deadline and not isinstance(e, DeadlineExceeded):
+            raise DeadlineExceeded(url) from e
+        raise
+    finally:
+        _deadline.reset(token)
+        _record(url, time.perf_counter() - started_at, error)
+
+
+def get_html(url):
+    return open_url(url, HTML_CONTENT_TYPES)
+
+
+def _read1(response, chunk_size):
+    # 受信のタイムアウトを残り時間までに縮め、1回の受信で読める分だけを読む
+    # （urllib3のreadはchunk_sizeまでたまるのを待つため、少しずつ送られると上限を過ぎても返らない）
+    sock = getattr(response.raw.connection, 'sock', None)
+    if sock is not None:
+        remaining = max(0.001, response.deadline - time.monotonic())
+        sock.settimeout(min(settings.NEWS_METADATA['READ_TIMEOUT'], remaining))
+    try:
+        return response.raw._fp.read1(chunk_size)
+    except socket.timeout as e:
+        raise requests.ReadTimeout(e, response=response)
+    except (OSError, http.client.HTTPException) as e:
+        raise requests.ConnectionError(e, response=response)
+
+
+def iter_content(response, chunk_size):
+    """open_urlで開いたレスポンスの本文を少しずつ返す。取得時間の上限を過ぎたらDeadlineExceededを送出する"""
+    if response.headers.get('Content-Encoding', 'identity').strip().lower() != 'identity':
+        # 圧縮されている場合は、requestsで展開しながら読む（1回の読み込みの間は上限を確かめない）
+        chunks = response.iter_content(chunk_size=chunk_size)
+    else:
+        chunks = iter(lambda: _read1(response, chunk_size), b'')
+    while True:
+        if time.monotonic() >= response.deadline:
+            raise DeadlineExceeded(response.url, response=response)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        except requests.ReadTimeout as e:
+            if time.monotonic() >= response.deadline:
+                raise DeadlineExceeded(response.url, response=response) from e
+            raise
+        yield chunk
+
+
+def read_limited(response, max_bytes, chunk_size=64 * 1024):
+    """本文を読み込む。max_bytesを超える場合はContentTooLargeを送出する"""
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ContentTooLarge(length, response=response)
+    data = bytearray()
+    for chunk in iter_content(response, chunk_size):
+        data += chunk
+        if len(data) > max_bytes:
+            raise ContentTooLarge(len(data), response=response)
+    return bytes(data)
+
+
+def get_stats():
+    """ホストごとのリクエスト数・エラー数・処理時間（ミリ秒）を返す"""
+    with _stats_lock:
+        return {
+            host: {
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total_time'] * 1000 / stats['requests'], 1),
+                'max_ms': round(stats['max_time'] * 1000, 1),
+            }
+            for host, stats in _stats.items()
+        }
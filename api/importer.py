@@ -0,0 +1,130 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from . import catalog, news_events
+from .models import News
+from .signals import invalidate_days_on_commit, local_day
+from .url_utils import canonicalize_url
+
+
+class InvalidItem(Exception):
+    pass
+
+
+def _parse_ids(item):
+    try:
+        category_id = item.get('select_category_id')
+        category_id = int(category_id) if category_id is not None else None
+        tag_ids = {int(tag_id) for tag_id in item.get('tag_ids') or []}
+    except (TypeError, ValueError):
+        raise InvalidItem('invalid id')
+    return category_id, tag_ids
+
+
+def _build(item, category_id, tag_ids, seen_urls, existing_urls, category_ids, all_tag_ids):
+    news = News(
+        url=item.get('url'),
+        contributor_name=item.get('contributor_name'),
+        created_at=item.get('created_at'),
+        select_category_id=category_id,
+        metadata_status=News.MetadataStatus.PENDING,
+    )
+    try:
+        news.clean_fields(exclude=['select_category'])
+    except ValidationError as e:
+        raise InvalidItem('; '.join('%s: %s' % (field, ' '.join(messages))
+                                     for field, messages in e.message_dict.items()))
+    # bulk_createではsave()が呼ばれないため、ここで設定する
+    try:
+        news.normalized_url = canonicalize_url(news.url)
+    except ValueError:
+        raise InvalidItem('url: invalid')
+    if news.normalized_url in seen_urls or news.normalized_url in existing_urls:
+        raise InvalidItem('already exists')
+    if category_id is not None and category_id not in category_ids:
+        raise InvalidItem('category does not exist')
+    if tag_ids - all_tag_ids:
+        raise InvalidItem('tags do not exist: %s' % ', '.join(
+            str(tag_id) for tag_id in sorted(tag_ids - all_tag_ids)))
+    return news
+
+
+def _insert(created):
+    News.objects.bulk_create([result['news'] for result in created])
+    # bulk_createで主キーが返らないデータベース（SQLiteなど）では取得し直す
+    if any(result['news'].pk is None for result in created):
+        news_ids = dict(News.objects.filter(
+            url__in=[result['news'].url for result in created]).values_list('url', 'id'))
+        for result in created:
+            result['news'].pk = news_ids[result['news'].url]
+
+    News.tags.through.objects.bulk_create([
+        News.tags.through(news_id=result['news'].pk, tag_id=tag_id)
+        for result in created for tag_id in result['tag_ids']
+    ])
+    # bulk_createではシグナルが送られないため、キャッシュはここで無効にする
+    invalidate_days_on_commit(local_day(result['news'].created_at) for result in created)
+    for result in created:
+        news_events.publish_on_commit(result['news'], 'created')
+
+
+def import_news(items):
+    """ニュースをまとめて登録し、入力と同じ順番で結果（url, news, error）を返す
+
+    itemsの各要素はurl, created_at, contributor_name, select_category_id, tag_idsを持つ。
+    URLの重複確認、ニュースとタグの登録はそれぞれ1回のクエリで行う（同時に同じURLが登録された
+    場合だけ、1件ずつ登録し直す）。
+    """
+    parsed = []
+    for item in items:
+        try:
+            parsed.append(_parse_ids(item))
+        except InvalidItem as e:
+            parsed.append(e)
+
+    normalized_urls = set()
+    for item in items:
+        try:
+            normalized_urls.add(canonicalize_url(str(item.get('url') or '')))
+        except ValueError:
+            pass
+    existing_urls = set(News.objects.filter(
+        normalized_url__in=normalized_urls).values_list('normalized_url', flat=True))
+    # カテゴリーとタグの存在はカタログで確認する
+    current = catalog.get_catalog()
+    category_ids = set(current.categories)
+    all_tag_ids = set(current.tags)
+
+    results = []
+    seen_urls = set()
+    for item, ids in zip(items, parsed):
+        result = {'url': item.get('url'), 'news': None, 'error': None, 'tag_ids': set()}
+        try:
+            if isinstance(ids, Exception):
+                raise ids
+            category_id, result['tag_ids'] = ids
+            result['news'] = _build(item, category_id, result['tag_ids'],
+                                    seen_urls, existing_urls, category_ids, all_tag_ids)
+            seen_urls.add(result['news'].normalized_url)
+        except InvalidItem as e:
+            result['error'] = str(e)
+        results.append(result)
+
+    created = [result for result in results if result['news'] is not None]
+    try:
+        with transaction.atomic():
+            _insert(created)
+    except IntegrityError:
+        # 重複の確認から登録までの間に、他のリクエストが同じURLを登録した。
+        # まとめての登録は取り消されるため、1件ずつ登録し直して重複したものだけを失敗にする
+        for result in created:
+            result['news'].pk = None
+            try:
+                with transaction.atomic():
+                    _insert([result])
+            except IntegrityError:
+                result['news'] = None
+                result['error'] = 'already exists'
+
+    return [{'url': result['url'], 'news': result['news'], 'error': result['error']}
+            for result in results]
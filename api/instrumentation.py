@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger('api.performance')
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """1リクエスト分の計測結果"""
+
+    def __init__(self, record_resolvers):
+        self.started_at = time.perf_counter()
+        self.operation_name = None
+        self.db_count = 0
+        self.db_time = 0.0
+        self.record_resolvers = record_resolvers
+        # (パス, 秒)のリスト。record_resolversがFalseの場合はルートのフィールドだけ
+        self.resolvers = []
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        metrics = [
+            'total;dur=%.1f' % (self.elapsed * 1000),
+            'db;dur=%.1f;desc="%d queries"' % (self.db_time * 1000, self.db_count),
+        ]
+        for path, duration in self.resolvers:
+            if len(path) == 1:
+                metrics.append('%s;dur=%.1f' % (path[0], duration * 1000))
+        return ', '.join(metrics)
+
+    def as_dict(self, request, response):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'operation': self.operation_name,
+            'total_ms': round(self.elapsed * 1000, 1),
+            'db_queries': self.db_count,
+            'db_ms': round(self.db_time * 1000, 1),
+            'resolvers': {path[0]: round(duration * 1000, 1)
+                          for path, duration in self.resolvers if len(path) == 1},
+        }
+
+
+def _record_query(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db_count += 1
+        timing.db_time += time.perf_counter() - started_at
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    # ASGIではSQLが別スレッドの接続で実行されるため、すべての接続に計測用のラッパーを付けておく
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    """リクエストごとの処理時間・SQLを計測し、ログとServer-Timingヘッダーに出す
+
+    OGPやサムネイルの取得はバックグラウンドのワーカーで行うため、外部へのHTTPリクエストは
+    リクエストの計測に含まれない（ホストごとの件数と時間は/stats/で見る）。
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.PERFORMANCE['ENABLED']:
+            return self.get_response(request)
+
+        timing = self._start()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing)
+
+    async def __acall__(self, request):
+        if not settings.PERFORMANCE['ENABLED']:
+            return await self.get_response(request)
+
+        timing = self._start()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing)
+
+    def _start(self):
+        return RequestTiming(record_resolvers=bool(settings.PERFORMANCE['SLOW_REQUEST_THRESHOLD']))
+
+    def _finish(self, request, response, timing):
+        response['Server-Timing'] = timing.server_timing()
+        data = timing.as_dict(request, response)
+        logger.info(json.dumps(data, ensure_ascii=False))
+
+        threshold = settings.PERFORMANCE['SLOW_REQUEST_THRESHOLD']
+        if threshold and timing.elapsed * 1000 >= threshold:
+            data['resolver_tree'] = [
+                {'path': '.'.join(str(key) for key in path), 'ms': round(duration * 1000, 2)}
+                for path, duration in timing.resolvers]
+            logger.warning('slow request: %s', json.dumps(data, ensure_ascii=False))
+        return response
+
+
+class ResolverTimingMiddleware:
+    """GraphQLのリゾルバごとの処理時間を計測するgrapheneのミドルウェア"""
+
+    def resolve(self, next, root, info, **args):
+        timing = _current.get()
+        if timing is None:
+            return next(root, info, **args)
+
+        path = info.path
+        if len(path) == 1:
+            timing.operation_name = info.operation.name.value if info.operation.name else None
+        elif not timing.record_resolvers:
+            return next(root, info, **args)
+
+        started_at = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            timing.resolvers.append((path, time.perf_counter() - started_at))
@@ -0,0 +1,64 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from graphql_jwt import utils
+
+from . import db_router
+
+# キャッシュする内容を変えたら上げる（古い形式のキャッシュは読まない）
+ENTRY_VERSION = 2
+
+
+def _get_cache():
+    return caches[settings.JWT_USER_CACHE['CACHE_ALIAS']]
+
+
+def _make_key(username):
+    digest = hashlib.sha256(str(username).encode('utf-8')).hexdigest()
+    return 'jwt-user:' + digest
+
+
+def check_cache(workers):
+    """複数のワーカーで動かす場合に、無効化を共有できないキャッシュを使っていないか確認する"""
+    if workers > 1 and isinstance(_get_cache(), LocMemCache):
+        raise ImproperlyConfigured(
+            'JWT_USER_CACHE_BACKEND must be shared between workers (e.g. memcached) '
+            'when running %d workers; a per-process cache keeps deactivated users '
+            'authenticated in the other workers.' % workers)
+
+
+def _to_user(username, entry):
+    # パスワードなどはキャッシュせず、使われたときにデータベースから読み込む
+    User = get_user_model()
+    values = {User._meta.pk.attname: entry['pk'], User.USERNAME_FIELD: username,
+              'is_active': entry['is_active']}
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(None, field_names, [values[name] for name in field_names])
+
+
+def get_user_by_natural_key(username):
+    """JWTのユーザー名（メールアドレス）からユーザーを取得する。主キーと有効かどうかだけをキャッシュする
+
+    GRAPHQL_JWTのJWT_GET_USER_BY_NATURAL_KEY_HANDLERに指定する。
+    """
+    cache = _get_cache()
+    key = _make_key(username)
+    entry = cache.get(key, version=ENTRY_VERSION)
+    if entry is not None:
+        return _to_user(username, entry)
+    # レプリカから読むと、キャッシュを消した直後に変更前のユーザーをキャッシュし直すことがある
+    with db_router.use_primary():
+        user = utils.get_user_by_natural_key(username)
+    if user is not None:
+        cache.set(key, {'pk': user.pk, 'is_active': user.is_active},
+                  settings.JWT_USER_CACHE['TTL'], version=ENTRY_VERSION)
+    return user
+
+
+def invalidate(*usernames):
+    _get_cache().delete_many([_make_key(username) for username in usernames if username],
+                             version=ENTRY_VERSION)
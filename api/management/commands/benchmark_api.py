@@ -0,0 +1,187 @@
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from graphql_jwt.shortcuts import get_token
+
+from api.benchmark import (ARCHIVE_PAGE_SIZE, BENCHMARK_EMAIL_DOMAIN, Operations,
+                           percentile, start_fixture_server)
+from api.models import News, User
+from api.schema import NewsConnectionField
+
+DEFAULT_MIX = 'feed=30,feed_authed=10,today=20,specific_day=10,search=15,create=5,auth=10'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in Operations.names:
+            raise CommandError('unknown operation: %s (%s)' % (name, ', '.join(Operations.names)))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def get_deep_page(page):
+    """アーカイブのpageページ目（ニュースが足りなければ最後のページ）の、カーソルとoffset"""
+    last_page = max(0, (News.objects.count() - 1) // ARCHIVE_PAGE_SIZE)
+    offset = min(page - 1, last_page) * ARCHIVE_PAGE_SIZE
+    if not offset:
+        return None, 0
+    node = News.objects.order_by(*NewsConnectionField.ordering)[offset - 1]
+    return NewsConnectionField.encode_cursor(node), offset
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('GraphQL APIに実際のクエリを流し、操作ごとのレイテンシ・スループット・'
+            'クエリ数をJSONで出力する（事前に seed_benchmark_data でデータを作成する）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help='操作と重みのリスト（例: %s）' % DEFAULT_MIX)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--deep-page', type=int, default=500,
+                            help='archive_deep・archive_deep_offsetで読むアーカイブのページ')
+        parser.add_argument('--url', help='起動済みのサーバーのURL（例: http://localhost:8000）。'
+                                          '指定するとHTTPで送る（クエリ数は計測しない）')
+        parser.add_argument('--upstream-delay', type=float, default=0,
+                            help='OGPの取得先が、レスポンスを返すまでに待つ秒数')
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def _run(self, operations, name):
+        if self.url:
+            return self._run_http(operations, name)
+        client = Client(HTTP_HOST='localhost')
+        query, variables = operations.get(name)
+        headers = operations.headers(name)
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.perf_counter()
+            response = client.post('/graphql/', json.dumps({'query': query, 'variables': variables}),
+                                   content_type='application/json', **headers)
+            elapsed = time.perf_counter() - started_at
+        failed = response.status_code != 200 or 'errors' in response.json()
+        return name, elapsed, len(queries), failed
+
+    def _run_http(self, operations, name):
+        # スレッドごとに接続を使い回す
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        query, variables = operations.get(name)
+        headers = {key[len('HTTP_'):].replace('_', '-'): value
+                   for key, value in operations.headers(name).items()}
+        started_at = time.perf_counter()
+        response = session.post(self.url + '/graphql/', json={'query': query, 'variables': variables},
+                                headers=headers)
+        elapsed = time.perf_counter() - started_at
+        failed = response.status_code != 200 or 'errors' in response.json()
+        return name, elapsed, None, failed
+
+    def _run_batch(self, operations, names):
+        try:
+            return [self._run(operations, name) for name in names]
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        self.url = (options['url'] or '').rstrip('/')
+        self._local = threading.local()
+        days = list(News.objects.dates('created_at', 'day'))
+        user_emails = list(User.objects.filter(
+            email__endswith='@' + BENCHMARK_EMAIL_DOMAIN).values_list('email', flat=True))
+        if not days or ({'auth', 'feed_authed'} & set(mix) and not user_emails):
+            raise CommandError('benchmark data not found; run seed_benchmark_data first')
+
+        server, fixture_url = start_fixture_server(delay=options['upstream_delay'])
+        # 同じIPアドレスから大量に送るため、実行回数の制限は外す
+        # （--urlの場合は、サーバーをRATE_LIMIT_ENABLED=Falseで起動する）
+        without_rate_limit = override_settings(RATE_LIMIT=dict(settings.RATE_LIMIT, ENABLED=False))
+        without_rate_limit.enable()
+        tokens = [get_token(user) for user in User.objects.filter(email__in=user_emails[:10])]
+        deep_cursor, deep_offset = get_deep_page(options['deep_page'])
+        operations = Operations(fixture_url, days, user_emails, seed=options['seed'], tokens=tokens,
+                                deep_cursor=deep_cursor, deep_offset=deep_offset)
+        rng = random.Random(options['seed'])
+        names = rng.choices(list(mix), weights=list(mix.values()), k=options['requests'])
+
+        try:
+            for name in list(mix) * max(1, options['warmup'] // len(mix)):
+                self._run(operations, name)
+
+            threads = max(1, options['threads'])
+            batches = [names[index::threads] for index in range(threads)]
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = [result for batch in executor.map(
+                    lambda batch: self._run_batch(operations, batch), batches) for result in batch]
+            duration = time.perf_counter() - started_at
+        finally:
+            without_rate_limit.disable()
+            server.shutdown()
+
+        timings = defaultdict(list)
+        query_counts = defaultdict(list)
+        errors = defaultdict(int)
+        for name, elapsed, query_count, failed in results:
+            timings[name].append(elapsed * 1000)
+            query_counts[name].append(query_count)
+            errors[name] += failed
+
+        report = {
+            'commit': get_commit(),
+            'database': connection.vendor,
+            'server': self.url or 'in-process',
+            'upstream_delay_s': options['upstream_delay'],
+            'news_count': News.objects.count(),
+            'requests': len(results),
+            'threads': options['threads'],
+            'deep_page_offset': deep_offset,
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(results) / duration, 1),
+            'operations': {
+                name: {
+                    'count': len(values),
+                    'errors': errors[name],
+                    'mean_ms': round(statistics.mean(values), 2),
+                    'p50_ms': round(percentile(values, 0.5), 2),
+                    'p95_ms': round(percentile(values, 0.95), 2),
+                    'p99_ms': round(percentile(values, 0.99), 2),
+                    'throughput_rps': round(len(values) / duration, 1),
+                    **({} if self.url else {
+                        'queries_mean': round(statistics.mean(query_counts[name]), 2),
+                        'queries_max': max(query_counts[name]),
+                    }),
+                }
+                for name, values in sorted(timings.items())
+            },
+        }
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
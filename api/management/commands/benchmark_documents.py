@@ -0,0 +1,89 @@
+import json
+import statistics
+import sys
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from api.backend import CachedDocumentBackend
+from api.benchmark import FEED_FULL_QUERY, FEED_QUERY, SEARCH_QUERY, percentile
+from api.management.commands.benchmark_api import get_commit
+from project.schema import schema
+
+# 日付単位の一覧は実行結果がキャッシュされるため、毎回実行するクエリで比べる
+QUERIES = {
+    'feed': (FEED_QUERY, {'first': 20}),
+    'feed_full': (FEED_FULL_QUERY, {'first': 20}),
+    'search': (SEARCH_QUERY, {'query': 'python'}),
+}
+
+
+def _measure(backend, query, variables, runs, execute):
+    request = RequestFactory().post('/graphql/')
+    request.user = AnonymousUser()
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        document = backend.document_from_string(schema, query)
+        if execute:
+            result = document.execute(context_value=request, variable_values=variables)
+            if result.errors:
+                raise result.errors[0]
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = ('GraphQLのクエリを毎回パース・検証する場合（cold）と、パース・検証済みのドキュメントを'
+            '使う場合（cached）の、ドキュメントの取得と実行までのレイテンシをJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=200)
+        parser.add_argument('--queries', default=','.join(QUERIES),
+                            help='比べるクエリ（%s）' % ', '.join(QUERIES))
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        names = [name for name in options['queries'].split(',') if name]
+        unknown = set(names) - set(QUERIES)
+        if unknown:
+            raise CommandError('unknown query: %s' % ', '.join(sorted(unknown)))
+        results = {}
+        for name in names:
+            query, variables = QUERIES[name]
+            # 保持する件数が0なら、毎回パース・検証する（実行の処理は同じ）
+            cold_backend = CachedDocumentBackend(max_size=0)
+            cached_backend = CachedDocumentBackend()
+            # 最初の1回でパース・検証し、以降はキャッシュしたドキュメントを使う
+            cached_backend.document_from_string(schema, query)
+            results[name] = {
+                'query_bytes': len(query.encode('utf-8')),
+                'document': {
+                    'cold': _measure(cold_backend, query, variables, runs, execute=False),
+                    'cached': _measure(cached_backend, query, variables, runs, execute=False),
+                },
+                'document_and_execute': {
+                    'cold': _measure(cold_backend, query, variables, runs, execute=True),
+                    'cached': _measure(cached_backend, query, variables, runs, execute=True),
+                },
+            }
+
+        report = {
+            'commit': get_commit(),
+            'python': sys.version.split()[0],
+            'runs': runs,
+            'queries': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
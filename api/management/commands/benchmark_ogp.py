@@ -0,0 +1,130 @@
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import percentile
+from api.management.commands.benchmark_api import get_commit
+from api.ogp import extract_metadata
+from api.scraper import CHUNK_SIZE
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                            'benchmark_fixtures', 'ogp')
+PARSERS = ('ogp', 'beautifulsoup')
+
+# 本文の水増しに使う、記事のページによくあるマークアップ（ASCIIのみ）
+PADDING = ('<div class="paragraph"><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>'
+           '<a href="/articles/related">related</a></div>\n'
+           '<script>window.dataLayer.push({"event": "impression", "slot": "article"});</script>\n')
+
+
+def pad_body(data, body_kb):
+    """ページが大きい場合を再現するため、</body>の前に本文を足す"""
+    padding = (PADDING * (body_kb * 1024 // len(PADDING) + 1)).encode('ascii')[:body_kb * 1024]
+    index = data.lower().rfind(b'</body>')
+    if index < 0:
+        return data + padding
+    return data[:index] + padding + data[index:]
+
+
+def parse_streaming(data):
+    chunks = (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+    return extract_metadata(chunks, content_type='text/html',
+                            max_bytes=settings.NEWS_METADATA['MAX_BYTES'])
+
+
+def parse_beautifulsoup(data):
+    # ogp.pyを導入する前の方法（ページ全体からツリーを作り、og:*と<title>を探す）
+    from bs4 import BeautifulSoup
+
+    parsed_html = BeautifulSoup(data, 'html.parser')
+    metadata = {}
+    og_title_tag = parsed_html.find('meta', attrs={'property': 'og:title', 'content': True})
+    if og_title_tag is not None:
+        metadata['title'] = og_title_tag.get('content')
+    elif parsed_html.find('title') is not None:
+        metadata['title'] = parsed_html.find('title').text
+    for key, name in (('summary', 'og:description'), ('image_path', 'og:image')):
+        tag = parsed_html.find('meta', attrs={'property': name, 'content': True})
+        if tag is not None:
+            metadata[key] = tag.get('content')
+    return metadata
+
+
+def _measure(parse, data, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        metadata = parse(data)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    # tracemalloc は実行を遅くするため、時間とは別に計測する
+    tracemalloc.start()
+    try:
+        parse(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'parse_p50_ms': round(statistics.median(timings), 2),
+        'parse_p95_ms': round(percentile(timings, 0.95), 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'title': metadata.get('title'),
+    }
+
+
+class Command(BaseCommand):
+    help = ('保存したHTMLのページで、OGPの取り出し（api.ogp）と以前のBeautifulSoupでの方法の'
+            'パースの時間とピークのメモリを比べてJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', default=FIXTURES_DIR, help='HTMLのファイルを置いたディレクトリ')
+        parser.add_argument('--body-kb', type=int, default=1024,
+                            help='各ページの本文に足すサイズ（KB）。ニュースのページは1〜5MBのことが多い')
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--parsers', default=','.join(PARSERS), help='比べる方法（%s）' % ', '.join(PARSERS))
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def handle(self, *args, **options):
+        parsers = [name for name in options['parsers'].split(',') if name]
+        unknown = set(parsers) - set(PARSERS)
+        if unknown:
+            raise CommandError('unknown parser: %s' % ', '.join(sorted(unknown)))
+        if 'beautifulsoup' in parsers:
+            try:
+                import bs4  # noqa: F401
+            except ImportError:
+                raise CommandError('beautifulsoup4 is not installed; '
+                                   'pip install beautifulsoup4 or use --parsers ogp')
+
+        names = sorted(name for name in os.listdir(options['fixtures']) if name.endswith('.html'))
+        if not names:
+            raise CommandError('no .html files in %s' % options['fixtures'])
+
+        parse_functions = {'ogp': parse_streaming, 'beautifulsoup': parse_beautifulsoup}
+        results = {}
+        for name in names:
+            with open(os.path.join(options['fixtures'], name), 'rb') as f:
+                data = pad_body(f.read(), options['body_kb'])
+            results[name] = {'size_kb': len(data) // 1024}
+            for parser in parsers:
+                results[name][parser] = _measure(parse_functions[parser], data, max(1, options['runs']))
+
+        report = {
+            'commit': get_commit(),
+            'python': sys.version.split()[0],
+            'body_kb': options['body_kb'],
+            'chunk_size': CHUNK_SIZE,
+            'max_bytes': settings.NEWS_METADATA['MAX_BYTES'],
+            'fixtures': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,138 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import FEED_QUERY
+from api.management.commands.benchmark_api import get_commit
+
+# 新しいプロセスで、起動から最初のレスポンスまでを計測する
+FIRST_RESPONSE_SCRIPT = '''
+import json, sys, time
+started_at = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+application = get_wsgi_application()
+# 準備しない場合は、DjangoがURL（とスキーマ）を最初のリクエストで読み込む
+if sys.argv[1] == "1":
+    from api.warmup import warm_up
+    warm_up()
+booted_at = time.perf_counter()
+from api.benchmark import FEED_QUERY
+response = Client(HTTP_HOST="localhost").post(
+    "/graphql/", json.dumps({"query": FEED_QUERY, "variables": {"first": 20}}),
+    content_type="application/json")
+finished_at = time.perf_counter()
+print(json.dumps({"status": response.status_code,
+                  "boot_ms": (booted_at - started_at) * 1000,
+                  "first_request_ms": (finished_at - booted_at) * 1000}))
+'''
+
+IMPORT_SCRIPT = 'import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns'
+
+
+def parse_importtime(output):
+    """python -X importtime の出力から、(モジュール名, 自身の時間, 累計の時間, 深さ)を返す"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('新しいプロセスでの起動時間（python -X importtime）と、最初のレスポンスまでの時間を'
+            'JSONで出力する（上限を指定した場合は、超えると失敗する）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help='出力する、読み込みに時間のかかったモジュールの数')
+        parser.add_argument('--max-import-ms', type=float, help='importの時間の上限（中央値）')
+        parser.add_argument('--max-first-response-ms', type=float,
+                            help='準備なしでの、起動から最初のレスポンスまでの時間の上限（中央値）')
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def _run(self, args, **env):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'project.settings'), **env)
+        result = subprocess.run([sys.executable] + args, cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(result.stderr)
+        return result
+
+    def _measure_imports(self, runs, top):
+        totals, modules = [], None
+        for _ in range(runs):
+            modules = parse_importtime(self._run(['-X', 'importtime', '-c', IMPORT_SCRIPT]).stderr)
+            totals.append(sum(self_us for _, self_us, _, _ in modules) / 1000)
+        top_level = sorted((module for module in modules if module[3] == 0),
+                           key=lambda module: module[2], reverse=True)
+        return {
+            'total_ms': round(statistics.median(totals), 1),
+            'modules': len(modules),
+            'top': [{'module': name, 'cumulative_ms': round(cumulative_us / 1000, 1)}
+                    for name, _, cumulative_us, _ in top_level[:top]],
+        }
+
+    def _measure_first_response(self, runs, warm_up, queries_path=''):
+        results = []
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            result = json.loads(self._run(
+                ['-c', FIRST_RESPONSE_SCRIPT, '1' if warm_up else '0'],
+                GRAPHQL_WARM_UP_QUERIES=queries_path).stdout.splitlines()[-1])
+            result['total_ms'] = (time.perf_counter() - started_at) * 1000
+            if result['status'] != 200:
+                raise CommandError('first request failed: %d' % result['status'])
+            results.append(result)
+        return {key: round(statistics.median(result[key] for result in results), 1)
+                for key in ('boot_ms', 'first_request_ms', 'total_ms')}
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        # 準備する場合は、計測するクエリもパース・検証しておく
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as queries_file:
+            json.dump([FEED_QUERY], queries_file)
+            queries_file.flush()
+            warm = self._measure_first_response(runs, warm_up=True, queries_path=queries_file.name)
+
+        report = {
+            'commit': get_commit(),
+            'python': sys.version.split()[0],
+            'runs': runs,
+            'imports': self._measure_imports(runs, options['top']),
+            # 準備なし（最初のリクエストが、URLとスキーマの読み込みやクエリの検証を払う）
+            'cold': self._measure_first_response(runs, warm_up=False),
+            # gunicorn.conf.pyのフックで準備した場合
+            'warm': warm,
+        }
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        failures = []
+        if options['max_import_ms'] and report['imports']['total_ms'] > options['max_import_ms']:
+            failures.append('import time %.1f ms exceeds %.1f ms' % (
+                report['imports']['total_ms'], options['max_import_ms']))
+        if (options['max_first_response_ms']
+                and report['cold']['total_ms'] > options['max_first_response_ms']):
+            failures.append('time to first response %.1f ms exceeds %.1f ms' % (
+                report['cold']['total_ms'], options['max_first_response_ms']))
+        if failures:
+            raise CommandError('; '.join(failures))
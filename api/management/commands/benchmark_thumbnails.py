@@ -0,0 +1,110 @@
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from api import thumbnails
+from api.benchmark import percentile
+from api.management.commands.benchmark_api import get_commit
+
+POOLS = ('serial', 'thread', 'process')
+
+
+def make_image(width, height, format_name, seed):
+    """写真に近い（グラデーションとノイズのある）og:imageの画像を作る"""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L').resize((width, height)).rotate(rng.randrange(360))
+    noise = Image.effect_noise((width, height), rng.randrange(20, 60))
+    image = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    output = io.BytesIO()
+    image.save(output, format_name)
+    return output.getvalue()
+
+
+def _run(executor, args_list):
+    started_at = time.perf_counter()
+    latencies = []
+
+    def submit(args):
+        submitted_at = time.perf_counter()
+        future = executor.submit(thumbnails.resize, *args)
+        future.add_done_callback(lambda _: latencies.append(time.perf_counter() - submitted_at))
+        return future
+
+    for future in [submit(args) for args in args_list]:
+        future.result()
+    return time.perf_counter() - started_at, latencies
+
+
+class Command(BaseCommand):
+    help = ('サムネイルの縮小（api.thumbnails.resize）のスループットを、'
+            'スレッドプールとプロセスプールで比べてJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAILS['WORKERS'])
+        parser.add_argument('--width', type=int, default=1200)
+        parser.add_argument('--height', type=int, default=630)
+        parser.add_argument('--source-format', default='PNG', help='元の画像の形式（PNGまたはJPEG）')
+        parser.add_argument('--pools', default=','.join(POOLS), help='比べるプール（%s）' % ', '.join(POOLS))
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def _executor(self, pool, workers):
+        if pool == 'thread':
+            return ThreadPoolExecutor(max_workers=workers)
+        if pool == 'process':
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=1)
+
+    def handle(self, *args, **options):
+        pools = [pool for pool in options['pools'].split(',') if pool]
+        unknown = set(pools) - set(POOLS)
+        if unknown:
+            raise CommandError('unknown pool: %s' % ', '.join(sorted(unknown)))
+
+        images = [make_image(options['width'], options['height'], options['source_format'], seed)
+                  for seed in range(min(options['images'], 8))]
+        args_list = [thumbnails.get_resize_args(images[i % len(images)])
+                     for i in range(options['images'])]
+
+        results = {}
+        for pool in pools:
+            workers = 1 if pool == 'serial' else options['workers']
+            with self._executor(pool, workers) as executor:
+                # プロセスの起動や、Pillowの読み込みは計測に含めない
+                _run(executor, args_list[:workers])
+                elapsed, latencies = _run(executor, args_list)
+            # レイテンシは、まとめて登録してから縮小が終わるまで（待ち時間を含む）
+            results[pool] = {
+                'workers': workers,
+                'images_per_s': round(len(args_list) / elapsed, 1),
+                'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+                'latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            }
+
+        report = {
+            'commit': get_commit(),
+            'python': sys.version.split()[0],
+            'cpus': os.cpu_count(),
+            'images': len(args_list),
+            'source': '%dx%d %s (%d KB)' % (options['width'], options['height'],
+                                              options['source_format'],
+                                              sum(map(len, images)) // len(images) // 1024),
+            'widths': settings.THUMBNAILS['WIDTHS'],
+            'format': thumbnails.get_format(),
+            'pools': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,29 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api import workers
+from api.models import News
+
+
+class Command(BaseCommand):
+    help = '画像があるニュースについて、サムネイルをまとめて作る'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='サムネイルがあるニュースも作り直す')
+
+    def handle(self, *args, **options):
+        news = News.objects.exclude(image_path__isnull=True).exclude(image_path='')
+        if not options['all']:
+            news = news.filter(thumbnails=[])
+        news = list(news)
+
+        async def create_all():
+            return await asyncio.gather(*(workers.create_thumbnails(item) for item in news))
+
+        results = asyncio.run(create_all())
+        created = sum(1 for result in results if result is not None)
+        self.stdout.write(self.style.SUCCESS(
+            '%d件のニュースのサムネイルを作りました（失敗: %d件）' % (created, len(news) - created)))
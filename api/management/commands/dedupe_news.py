@@ -0,0 +1,65 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from api.models import News
+
+# 残すニュースが空の場合に、重複しているニュースから引き継ぐフィールド
+MERGED_FIELDS = ('title', 'summary', 'image_path', 'contributor_name', 'select_category_id',
+                 'thumbnails')
+
+
+def merge(keeper, duplicates):
+    """重複しているニュースのタグと内容を、残すニュースにまとめて削除する"""
+    update_fields = []
+    for duplicate in duplicates:
+        for field in MERGED_FIELDS:
+            if not getattr(keeper, field) and getattr(duplicate, field):
+                setattr(keeper, field, getattr(duplicate, field))
+                update_fields.append(field)
+        if (keeper.metadata_status != News.MetadataStatus.DONE
+                and duplicate.metadata_status == News.MetadataStatus.DONE):
+            keeper.metadata_status = News.MetadataStatus.DONE
+            update_fields.append('metadata_status')
+
+    with transaction.atomic():
+        if update_fields:
+            keeper.save(update_fields=sorted(set(update_fields)))
+        tag_ids = {tag.id for duplicate in duplicates for tag in duplicate.tags.all()}
+        tag_ids -= {tag.id for tag in keeper.tags.all()}
+        if tag_ids:
+            keeper.tags.add(*tag_ids)
+        News.objects.filter(id__in=[duplicate.id for duplicate in duplicates]).delete()
+
+
+class Command(BaseCommand):
+    help = '正規化したURLが同じニュースを、最初にシェアされたものにまとめる'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='まとめる対象を表示するだけにする')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # normalized_urlのインデックスを使って、重複しているURLだけを1回で集計する
+        normalized_urls = list(News.objects.values('normalized_url').annotate(
+            count=Count('id')).filter(count__gt=1).values_list('normalized_url', flat=True))
+
+        merged = 0
+        batch_size = options['batch_size']
+        for offset in range(0, len(normalized_urls), batch_size):
+            news = (News.objects.filter(normalized_url__in=normalized_urls[offset:offset + batch_size])
+                    .prefetch_related('tags').order_by('normalized_url', 'created_at', 'id'))
+            for normalized_url, group in groupby(news, key=lambda item: item.normalized_url):
+                keeper, *duplicates = group
+                self.stdout.write('%s: %s <- %s' % (normalized_url, keeper.url,
+                                                    ', '.join(item.url for item in duplicates)))
+                if not options['dry_run']:
+                    merge(keeper, duplicates)
+                merged += len(duplicates)
+
+        message = '%d件のニュースを%d件にまとめました' % (merged, len(normalized_urls))
+        if options['dry_run']:
+            message = '%d件のニュースを%d件にまとめます（--dry-run）' % (merged, len(normalized_urls))
+        self.stdout.write(self.style.SUCCESS(message))
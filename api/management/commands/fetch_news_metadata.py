@@ -0,0 +1,32 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api import http_client, workers
+from api.models import News
+
+
+class Command(BaseCommand):
+    help = 'OGPが未取得のニュースについて、タイトル・概要・画像をまとめて取得する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='取得に失敗したニュースも再取得する')
+
+    def handle(self, *args, **options):
+        statuses = [News.MetadataStatus.PENDING]
+        if options['retry_failed']:
+            statuses.append(News.MetadataStatus.FAILED)
+        news_ids = list(News.objects.filter(
+            metadata_status__in=statuses).values_list('id', flat=True))
+
+        results = asyncio.run(workers.enrich_many(news_ids))
+        failed = sum(1 for news in results
+                     if news is not None and news.metadata_status == News.MetadataStatus.FAILED)
+        self.stdout.write(self.style.SUCCESS(
+            '%d件のニュースを処理しました（失敗: %d件）' % (len(news_ids), failed)))
+        if options['verbosity'] >= 2:
+            for host, stats in sorted(http_client.get_stats().items()):
+                self.stdout.write('%s: %d件（エラー: %d件） 平均 %.1fms 最大 %.1fms' % (
+                    host, stats['requests'], stats['errors'], stats['avg_ms'], stats['max_ms']))
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import importer, workers
+from api.models import Category, Tag
+
+
+class Command(BaseCommand):
+    help = ('JSONLファイルからニュースをまとめて登録する'
+            '（1行に url, category, tags, contributor_name, created_at を持つJSON）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONLファイルのパス（-で標準入力）')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--skip-metadata', action='store_true',
+                            help='OGPを取得せずに登録だけ行う')
+
+    def _parse_created_at(self, value):
+        if value is None:
+            return timezone.now()
+        if isinstance(value, (int, float)):
+            return datetime.datetime.fromtimestamp(value, tz=timezone.utc)
+        created_at = parse_datetime(value)
+        if created_at is None:
+            raise CommandError('invalid created_at: %s' % value)
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return created_at
+
+    def _read(self, path):
+        if path == '-':
+            return [json.loads(line) for line in sys.stdin if line.strip()]
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _to_items(self, rows):
+        # カテゴリーとタグは名前で指定し、なければ作成する
+        category_names = {row['category'] for row in rows if row.get('category')}
+        tag_names = {tag for row in rows for tag in row.get('tags') or []}
+        for name in category_names:
+            Category.objects.get_or_create(category_name=name)
+        for name in tag_names:
+            Tag.objects.get_or_create(tag_name=name)
+        category_ids = dict(Category.objects.filter(
+            category_name__in=category_names).values_list('category_name', 'id'))
+        tag_ids = dict(Tag.objects.filter(tag_name__in=tag_names).values_list('tag_name', 'id'))
+
+        return [{
+            'url': row.get('url'),
+            'contributor_name': row.get('contributor_name'),
+            'created_at': self._parse_created_at(row.get('created_at')),
+            'select_category_id': category_ids.get(row.get('category')),
+            'tag_ids': [tag_ids[tag] for tag in row.get('tags') or []],
+        } for row in rows]
+
+    def handle(self, *args, **options):
+        rows = self._read(options['path'])
+        batch_size = options['batch_size']
+
+        created_ids = []
+        failed = 0
+        for start in range(0, len(rows), batch_size):
+            items = self._to_items(rows[start:start + batch_size])
+            for result in importer.import_news(items):
+                if result['error'] is None:
+                    created_ids.append(result['news'].id)
+                else:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (result['url'], result['error']))
+
+        if created_ids and not options['skip_metadata']:
+            asyncio.run(workers.enrich_many(created_ids))
+
+        self.stdout.write(self.style.SUCCESS(
+            '%d件のニュースを登録しました（失敗: %d件）' % (len(created_ids), failed)))
@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import digest
+
+
+class Command(BaseCommand):
+    help = '日付ごとのニュースのダイジェストを作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'days', nargs='*',
+            help='作り直す日付（YYYY-MM-DD）。省略した場合はすべての日付')
+
+    def handle(self, *args, **options):
+        if not options['days']:
+            count = digest.refresh_all()
+        else:
+            try:
+                days = [datetime.date.fromisoformat(day) for day in options['days']]
+            except ValueError as e:
+                raise CommandError(e)
+            digest.refresh_days(days)
+            count = len(set(days))
+        self.stdout.write(self.style.SUCCESS('%d日分のダイジェストを作り直しました' % count))
@@ -0,0 +1,91 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.benchmark import (BENCHMARK_EMAIL_DOMAIN, BENCHMARK_PASSWORD,
+                           BENCHMARK_URL_PREFIX, FIXTURE_PATH, make_title)
+from api.models import Category, News, Tag, User
+from api.search import make_search_ngrams, normalize_search_text
+from api.url_utils import canonicalize_url
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+
+class Command(BaseCommand):
+    help = 'ベンチマーク用のニュース・タグ・カテゴリー・ユーザーを作成する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='10k',
+                            help='作成するニュースの件数')
+        parser.add_argument('--news', type=int, help='ニュースの件数（--scaleより優先）')
+        parser.add_argument('--days', type=int, default=365, help='ニュースを散らばらせる日数')
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--tags-per-news', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true',
+                            help='以前に作成したベンチマーク用のデータを削除してから作成する')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        news_count = options['news'] or SCALES[options['scale']]
+
+        if options['clear']:
+            News.objects.filter(url__startswith=BENCHMARK_URL_PREFIX).delete()
+            News.objects.filter(url__contains=FIXTURE_PATH).delete()
+            User.objects.filter(email__endswith='@' + BENCHMARK_EMAIL_DOMAIN).delete()
+
+        categories = [Category.objects.get_or_create(category_name='bench-category-%d' % i)[0]
+                      for i in range(options['categories'])]
+        tags = [Tag.objects.get_or_create(tag_name='bench-tag-%d' % i)[0]
+                for i in range(options['tags'])]
+
+        # パスワードのハッシュ化は遅いので、全員同じハッシュを使う
+        password = make_password(BENCHMARK_PASSWORD)
+        User.objects.bulk_create([
+            User(email='user-%d@%s' % (i, BENCHMARK_EMAIL_DOMAIN), password=password)
+            for i in range(options['users'])
+        ], ignore_conflicts=True)
+
+        now = timezone.now()
+        start = News.objects.filter(url__startswith=BENCHMARK_URL_PREFIX).count()
+        seconds = options['days'] * 24 * 60 * 60
+        batch_size = options['batch_size']
+        for offset in range(start, start + news_count, batch_size):
+            size = min(batch_size, start + news_count - offset)
+            news_list = []
+            for i in range(offset, offset + size):
+                title = make_title(rng)
+                summary = 'ベンチマーク用のニュース %d の概要' % i
+                url = '%s%d' % (BENCHMARK_URL_PREFIX, i)
+                search_text = normalize_search_text(title, summary)
+                news_list.append(News(
+                    url=url,
+                    normalized_url=canonicalize_url(url),
+                    title=title,
+                    summary=summary,
+                    image_path='https://bench.example.com/images/%d.png' % i,
+                    created_at=now - datetime.timedelta(seconds=rng.randrange(seconds)),
+                    contributor_name='bench-user-%d' % rng.randrange(options['users'] or 1),
+                    select_category=rng.choice(categories) if categories else None,
+                    search_text=search_text,
+                    search_ngrams=make_search_ngrams(search_text),
+                ))
+            with transaction.atomic():
+                News.objects.bulk_create(news_list)
+                ids = News.objects.filter(
+                    url__in=[news.url for news in news_list]).values_list('id', flat=True)
+                News.tags.through.objects.bulk_create([
+                    News.tags.through(news_id=news_id, tag_id=tag.id)
+                    for news_id in ids
+                    for tag in rng.sample(tags, min(options['tags_per_news'], len(tags)))
+                ])
+            self.stdout.write('%d / %d' % (offset + size - start, news_count))
+
+        self.stdout.write(self.style.SUCCESS('%d件のニュースを作成しました' % news_count))
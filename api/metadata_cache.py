@@ -0,0 +1,57 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .url_utils import normalize_url
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _get_cache():
+    return caches[settings.NEWS_METADATA['CACHE_ALIAS']]
+
+
+def _make_key(url):
+    # URLは長くなることがあるので、キャッシュキーにはハッシュを使う
+    digest = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+    return 'news-metadata:' + digest
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get(url):
+    """キャッシュされたOGPを返す。キャッシュがない場合はNoneを返す"""
+    entry = _get_cache().get(_make_key(url))
+    if entry is None:
+        _count('misses')
+    elif entry.get('failed'):
+        _count('negative_hits')
+    else:
+        _count('hits')
+    return entry
+
+
+def set(url, metadata):
+    entry = dict(metadata, fetched_at=time.time())
+    _get_cache().set(_make_key(url), entry, settings.NEWS_METADATA['CACHE_TTL'])
+    return entry
+
+
+def set_failed(url):
+    # 取得に失敗したURLも短い間だけ覚えておき、落ちているサイトへの再アクセスを避ける
+    entry = {'failed': True, 'fetched_at': time.time()}
+    _get_cache().set(_make_key(url), entry, settings.NEWS_METADATA['NEGATIVE_CACHE_TTL'])
+    return entry
+
+
+def get_stats():
+    with _stats_lock:
+        return {name: _stats[name] for name in ('hits', 'negative_hits', 'misses')}
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_auto_20210815_1549'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='metadata_status',
+            field=models.CharField(choices=[('pending', '取得待ち'), ('done', '取得済み'), ('failed', '取得失敗')], default='done', max_length=10),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_news_metadata_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['created_at'], name='api_news_created_3389d1_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+def fill_search_text(apps, schema_editor):
+    from api.search import normalize_search_text
+
+    News = apps.get_model('api', 'News')
+    batch = []
+    for news in News.objects.only('id', 'title', 'summary').iterator(chunk_size=1000):
+        news.search_text = normalize_search_text(news.title, news.summary)
+        batch.append(news)
+        if len(batch) >= 1000:
+            News.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        News.objects.bulk_update(batch, ['search_text'])
+
+
+def create_trigram_index(apps, schema_editor):
+    # 日本語は単語に区切れないため、全文検索ではなくpg_trgmで部分一致を高速化する
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS api_news_search_text_trgm '
+        'ON api_news USING gin (search_text gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS api_news_search_text_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_news_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
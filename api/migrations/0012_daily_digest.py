@@ -0,0 +1,38 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:10
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_daily_digests(apps, schema_editor):
+    from api.digest import build_items
+
+    News = apps.get_model('api', 'News')
+    DailyDigest = apps.get_model('api', 'DailyDigest')
+    for start in News.objects.datetimes('created_at', 'day'):
+        end = timezone.make_aware(datetime.datetime.combine(
+            start.date() + datetime.timedelta(days=1), datetime.time.min))
+        items = build_items(News.objects.filter(created_at__gte=start, created_at__lt=end))
+        DailyDigest.objects.create(day=start.date(), items=items)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_news_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDigest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('items', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_daily_digests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_daily_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+def fill_normalized_url(apps, schema_editor):
+    from api.url_utils import get_duplicate_key
+
+    News = apps.get_model('api', 'News')
+    batch = []
+    for news in News.objects.only('id', 'url').iterator(chunk_size=1000):
+        news.normalized_url = get_duplicate_key(news.url)
+        batch.append(news)
+        if len(batch) >= 1000:
+            News.objects.bulk_update(batch, ['normalized_url'])
+            batch = []
+    if batch:
+        News.objects.bulk_update(batch, ['normalized_url'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_news_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='normalized_url',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_normalized_url, migrations.RunPython.noop),
+    ]
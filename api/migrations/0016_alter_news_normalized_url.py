@@ -0,0 +1,37 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+def refill_normalized_url(apps, schema_editor):
+    # クエリ文字列をエンコードし直さない形に、保存済みの値をそろえる
+    from api.url_utils import get_duplicate_key
+
+    News = apps.get_model('api', 'News')
+    batch = []
+    for news in News.objects.only('id', 'url', 'normalized_url').iterator(chunk_size=1000):
+        normalized_url = get_duplicate_key(news.url)
+        if news.normalized_url != normalized_url:
+            news.normalized_url = normalized_url
+            batch.append(news)
+        if len(batch) >= 1000:
+            News.objects.bulk_update(batch, ['normalized_url'])
+            batch = []
+    if batch:
+        News.objects.bulk_update(batch, ['normalized_url'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='news',
+            name='normalized_url',
+            field=models.TextField(db_index=True, default='', editable=False),
+        ),
+        migrations.RunPython(refill_normalized_url, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.5 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+def fill_search_ngrams(apps, schema_editor):
+    from api.search import make_search_ngrams
+
+    News = apps.get_model('api', 'News')
+    batch = []
+    for news in News.objects.only('id', 'search_text').iterator(chunk_size=1000):
+        news.search_ngrams = make_search_ngrams(news.search_text)
+        batch.append(news)
+        if len(batch) >= 1000:
+            News.objects.bulk_update(batch, ['search_ngrams'])
+            batch = []
+    if batch:
+        News.objects.bulk_update(batch, ['search_ngrams'])
+
+
+def create_ngram_index(apps, schema_editor):
+    # 「記事」「速報」のような2文字以下の検索語は、配列の包含（@>）でこのインデックスを使う
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS api_news_search_ngrams_gin "
+        "ON api_news USING gin (string_to_array(search_ngrams, ' '))")
+
+
+def drop_ngram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS api_news_search_ngrams_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_alter_news_normalized_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='search_ngrams',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_ngrams, migrations.RunPython.noop),
+        migrations.RunPython(create_ngram_index, drop_ngram_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-18 09:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_news_search_ngrams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='news',
+            name='metadata_requested_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(condition=models.Q(('metadata_status', 'pending')), fields=['metadata_requested_at'], name='api_news_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.5 on 2026-10-18 09:40
+
+from django.db import migrations
+
+
+def create_event_id_sequence(apps, schema_editor):
+    # PostgresBackendで、すべてのプロセスに共通のイベントのIDを振る
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE SEQUENCE IF NOT EXISTS api_news_event_id_seq')
+
+
+def drop_event_id_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP SEQUENCE IF EXISTS api_news_event_id_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_news_metadata_requested_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_event_id_sequence, drop_event_id_sequence),
+    ]
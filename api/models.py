@@ -1,7 +1,13 @@
+import datetime
+
 from django.conf import settings
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
 from django.db import models
+from django.utils import timezone
+
+from .search import make_search_ngrams, normalize_search_text
+from .url_utils import get_duplicate_key
 
 # Create your models here.
 
@@ -56,10 +62,72 @@ class Tag(models.Model):
         return self.tag_name
 
 
+class CatalogVersion(models.Model):
+    """タグとカテゴリーの版（1行だけのカウンターで、変更のたびに上げる）"""
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+
+class NewsQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tag_instances = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._tag_instances = self._tag_instances
+        return clone
+
+    def prefetch_tags(self, tag_instances):
+        """prefetch_related('tags')の代わりに、中間テーブルだけを読んでタグを設定する
+
+        タグはtag_instances（主キーからTagへの辞書。カタログ）から取り出し、ないものだけを読む。
+        """
+        clone = self._chain()
+        clone._tag_instances = tag_instances
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super()._fetch_all()
+        if (fetched and self._tag_instances is not None
+                and self._iterable_class is models.query.ModelIterable):
+            _set_prefetched_tags(self._result_cache, self._tag_instances)
+
+    def on_day(self, day):
+        # created_at__dayなどはタイムゾーン変換が行ごとに走りインデックスが使えないため、
+        # その日の始まりから翌日の始まりまでの範囲で絞り込む
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time.min))
+        return self.filter(created_at__gte=start, created_at__lt=end)
+
+    def claim_stale_pending(self, seconds, limit=500):
+        """OGPの取得を依頼してからseconds秒を過ぎても、取得待ちで残っているニュースの主キーを返す
+
+        複数のワーカーが同時に呼んでも同じニュースを返さないよう、依頼した日時を更新できたものだけを返す。
+        """
+        now = timezone.now()
+        pending = self.filter(metadata_status=News.MetadataStatus.PENDING,
+                              metadata_requested_at__lt=now - datetime.timedelta(seconds=seconds))
+        news_ids = pending.order_by('metadata_requested_at').values_list('id', flat=True)[:limit]
+        return [news_id for news_id in news_ids
+                if pending.filter(id=news_id).update(metadata_requested_at=now)]
+
+
 class News(models.Model):
+    class MetadataStatus(models.TextChoices):
+        PENDING = 'pending', '取得待ち'
+        DONE = 'done', '取得済み'
+        FAILED = 'failed', '取得失敗'
+
     select_category = models.ForeignKey(
         to=Category, related_name='select_category', on_delete=models.PROTECT, blank=True, null=True)
     url = models.URLField(unique=True)
+    # 重複の判定用に正規化したURL（保存時に更新する）。正規化で長さが変わることがあるため、長さは制限しない
+    normalized_url = models.TextField(db_index=True, editable=False, default='')
     title = models.CharField(max_length=500, blank=True, null=True, default='')
     summary = models.CharField(max_length=500, blank=True, null=True, default='')
     image_path = models.CharField(
@@ -70,6 +138,73 @@ class News(models.Model):
         to=Tag, related_name='tags', default=[], blank=True)
     contributor_name = models.CharField(
         max_length=50, default='', blank=True, null=True)
+    # OGPの取得状態（取得はバックグラウンドで行う）
+    metadata_status = models.CharField(
+        max_length=10, choices=MetadataStatus.choices, default=MetadataStatus.DONE)
+    # OGPの取得を依頼した日時（取得待ちのまま残ったものを、ワーカーの起動時に取得し直す）
+    metadata_requested_at = models.DateTimeField(default=timezone.now, editable=False)
+    # タイトルと概要を検索用に正規化したもの（保存時に更新する）
+    search_text = models.TextField(blank=True, default='', editable=False)
+    # 3文字未満の検索語のための、search_textの1文字と2文字の並び（空白区切り）
+    search_ngrams = models.TextField(blank=True, default='', editable=False)
+    # image_pathから作ったサムネイル（ストレージ上の名前・幅・高さ・形式）
+    thumbnails = models.JSONField(default=list, blank=True, editable=False)
+    objects = NewsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['metadata_requested_at'], name='api_news_pending_idx',
+                         condition=models.Q(metadata_status='pending')),
+        ]
 
     def __str__(self):
         return str(self.title) + ' : ' + str(self.url)
+
+    def save(self, *args, **kwargs):
+        self.search_text = normalize_search_text(self.title, self.summary)
+        self.search_ngrams = make_search_ngrams(self.search_text)
+        self.normalized_url = get_duplicate_key(self.url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = list(update_fields)
+            if {'title', 'summary'} & set(update_fields):
+                update_fields += ['search_text', 'search_ngrams']
+            if 'url' in update_fields:
+                update_fields.append('normalized_url')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+
+def _set_prefetched_tags(news_list, tag_instances):
+    news_list = [news for news in news_list
+                 if 'tags' not in getattr(news, '_prefetched_objects_cache', {})]
+    if not news_list:
+        return
+    rows = list(News.tags.through.objects.filter(news_id__in=[news.pk for news in news_list])
+                .order_by('id').values_list('news_id', 'tag_id'))
+    # カタログを読み込んだ後に作られたタグ
+    missing = Tag.objects.in_bulk({tag_id for _, tag_id in rows if tag_id not in tag_instances})
+    tags = {news.pk: [] for news in news_list}
+    for news_id, tag_id in rows:
+        tag = tag_instances[tag_id] if tag_id in tag_instances else missing.get(tag_id)
+        if tag is not None:
+            tags[news_id].append(tag)
+    for news in news_list:
+        # prefetch_relatedと同じく、結果を持たせたQuerySetをキャッシュに置く
+        queryset = news.tags.all()
+        queryset._result_cache = tags[news.pk]
+        queryset._prefetch_done = True
+        if not hasattr(news, '_prefetched_objects_cache'):
+            news._prefetched_objects_cache = {}
+        news._prefetched_objects_cache['tags'] = queryset
+
+
+class DailyDigest(models.Model):
+    """日付ごとのニュースの一覧（カテゴリー名・タグ名を含めて、表示順に保存しておく）"""
+    day = models.DateField(unique=True)
+    items = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.day)
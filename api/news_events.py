@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from graphql_relay import to_global_id
+
+logger = logging.getLogger(__name__)
+
+# PostgresBackendでイベントのIDを振るシーケンス（0019_news_event_id_sequenceで作る）
+EVENT_ID_SEQUENCE = 'api_news_event_id_seq'
+
+_lock = threading.Lock()
+_broadcaster = None
+_backend = None
+
+
+def serialize_news(news, event_type):
+    """イベントで送る、ニュース1件分の最小限の内容（一覧の更新に足りない場合はnewsで取得し直す）"""
+    data = {'id': to_global_id('NewsNode', news.pk)}
+    if event_type != 'deleted':
+        created_at = news.created_at
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        data.update({
+            'url': news.url,
+            'title': news.title,
+            'imagePath': news.image_path,
+            'createdAt': created_at.isoformat(),
+            'metadataStatus': news.metadata_status,
+        })
+    return data
+
+
+class Subscription:
+    """1つのクライアントに送るイベントのキュー"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        # キューがあふれた場合は接続を切り、Last-Event-IDから再開してもらう
+        self.overflowed = False
+
+    def put(self, event):
+        # 別のスレッドから呼ばれるため、クライアントのイベントループで追加する
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # イベントループが終了している
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broadcaster:
+    """プロセス内で、購読中のクライアントにイベントを配る
+
+    再開できるよう、最近のイベントをHISTORY_SIZE件まで残しておく。イベントのIDはバックエンドが
+    発行順に振り、このプロセスに届く順もIDの順になる。
+    """
+
+    def __init__(self, history_size, queue_size):
+        self.queue_size = queue_size
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscriptions = set()
+        # このIDより後のイベントは、すべて履歴に残っている（Noneの場合はまだ分からない）
+        self._complete_since = None
+
+    def deliver(self, event):
+        with self._lock:
+            if len(self._history) == self._history.maxlen:
+                self._complete_since = max(self._complete_since or 0, self._history[0]['id'])
+            self._history.append(event)
+            subscriptions = list(self._subscriptions)
+            self.stats['events'] += 1
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def reset(self, complete_since):
+        """complete_sinceより後のイベントだけを受け取れるようになった場合に、購読中のクライアントに
+        取得し直してもらう（resetのIDから再開すれば、その後のイベントを受け取れる）"""
+        with self._lock:
+            self._complete_since = complete_since
+            self._history.clear()
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put({'id': complete_since, 'type': 'reset', 'data': {}})
+
+    def subscribe(self, last_event_id=None):
+        """購読を始め、last_event_idより後のイベントも返す
+
+        取りこぼしたイベントがもう残っていない場合は、代わりにresetのイベントを返す。
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if last_event_id is None or self._complete_since is None:
+                # まだ分からない場合は、バックエンドの準備ができたときのresetで取得し直してもらう
+                missed = []
+            elif last_event_id < self._complete_since:
+                missed = [{'id': self._complete_since, 'type': 'reset', 'data': {}}]
+            else:
+                missed = [event for event in self._history if event['id'] > last_event_id]
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            if subscription.overflowed:
+                self.stats['overflows'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscriptions),
+                'events': self.stats['events'],
+                'overflows': self.stats['overflows'],
+            }
+
+
+class LocalBackend:
+    """同じプロセスで購読中のクライアントにだけ配る
+
+    再起動しても前のプロセスのIDより大きくなるよう、マイクロ秒単位の時刻をIDにする。
+    """
+
+    def __init__(self, broadcaster, options):
+        self.broadcaster = broadcaster
+        self._lock = threading.Lock()
+        self._last_id = 0
+        # 起動する前のイベントは残っていない
+        broadcaster.reset(self._next_id())
+
+    def _next_id(self):
+        self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+        return self._last_id
+
+    def start(self):
+        pass
+
+    def publish(self, event_type, data):
+        # IDの順に届くよう、IDを振ってから配るまでをまとめて行う
+        with self._lock:
+            self.broadcaster.deliver({'id': self._next_id(), 'type': event_type, 'data': data})
+
+
+class PostgresBackend:
+    """PostgreSQLのLISTEN/NOTIFYで、すべてのプロセスで購読中のクライアントに配る
+
+    IDはシーケンス（マイグレーションで作る）から振り、すべてのプロセスで同じIDになる。
+    IDの取得から通知までを同じロックの中で行うため、コミット順に届く通知もIDの順になる。
+    LISTENはセッションを使い続けるため、pgbouncerのtransaction poolingを経由しない
+    データベースを指定する。
+    """
+
+    def __init__(self, broadcaster, options):
+        self.broadcaster = broadcaster
+        self.database = options['DATABASE']
+        self.channel = options['CHANNEL']
+        self.reconnect_delay = options['RECONNECT_DELAY']
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # 購読するクライアントのいるプロセスだけでLISTENする
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._listen, name='news-events-listener', daemon=True)
+                self._thread.start()
+
+    def publish(self, event_type, data):
+        # 自分のプロセスにもLISTENで届く
+        with transaction.atomic(using=self.database), connections[self.database].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [EVENT_ID_SEQUENCE])
+            cursor.execute('SELECT nextval(%s)', [EVENT_ID_SEQUENCE])
+            event = {'id': cursor.fetchone()[0], 'type': event_type, 'data': data}
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def _connect(self):
+        wrapper = connections[self.database]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN %s' % wrapper.ops.quote_name(self.channel))
+            # LISTENの後に発行されたIDのイベントはすべて届く。ロックを待って、発行中のものも含める
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [EVENT_ID_SEQUENCE])
+            cursor.execute('SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM %s'
+                           % wrapper.ops.quote_name(EVENT_ID_SEQUENCE))
+            last_id = cursor.fetchone()[0]
+            cursor.execute('COMMIT')
+        return connection, last_id
+
+    def _listen(self):
+        while True:
+            try:
+                connection, last_id = self._connect()
+                try:
+                    # 接続していない間のイベントは届かない
+                    self.broadcaster.reset(last_id)
+                    while True:
+                        if select.select([connection], [], [], 60) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            notify = connection.notifies.pop(0)
+                            self.broadcaster.deliver(json.loads(notify.payload))
+                finally:
+                    connection.close()
+            except Exception:
+                logger.warning('news events listener disconnected', exc_info=True)
+                time.sleep(self.reconnect_delay)
+
+
+def _get_backend():
+    global _broadcaster, _backend
+    with _lock:
+        if _backend is None:
+            options = settings.NEWS_EVENTS
+            _broadcaster = Broadcaster(options['HISTORY_SIZE'], options['QUEUE_SIZE'])
+            _backend = import_string(options['BACKEND'])(_broadcaster, options)
+        return _backend
+
+
+def publish(event_type, data):
+    backend = _get_backend()
+    try:
+        backend.publish(event_type, data)
+    except Exception:
+        # 配信に失敗しても、ニュースの保存は失敗にしない
+        logger.warning('failed to publish news event', exc_info=True)
+
+
+def publish_on_commit(news, event_type):
+    """コミット後に、ニュースの作成・更新・削除を購読中のクライアントに知らせる"""
+    # 削除後は主キーが消えるため、内容はここで作っておく
+    data = serialize_news(news, event_type)
+    transaction.on_commit(lambda: publish(event_type, data))
+
+
+def subscribe(last_event_id=None):
+    backend = _get_backend()
+    backend.start()
+    return _broadcaster.subscribe(last_event_id)
+
+
+def unsubscribe(subscription):
+    _broadcaster.unsubscribe(subscription)
+
+
+def get_stats():
+    if _broadcaster is None:
+        return {'subscribers': 0, 'events': 0, 'overflows': 0}
+    return _broadcaster.get_stats()
@@ -0,0 +1,132 @@
+import codecs
+import re
+from html.parser import HTMLParser
+
+CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+HEAD_END_RE = re.compile(rb'</head|<body', re.IGNORECASE)
+# 文字コードの宣言を探す、ページの先頭からのバイト数
+SNIFF_BYTES = 64 * 1024
+
+
+class OGPParser(HTMLParser):
+    """<head>内のmetaタグだけを読み、</head>を見つけた時点で読み込みを止めるパーサー"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.properties = {}
+        self.canonical = None
+        self.title = None
+        self.done = False
+        self._in_title = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self.done = True
+            return
+        attrs = dict(attrs)
+        if tag == 'meta':
+            key = attrs.get('property') or attrs.get('name')
+            content = attrs.get('content')
+            if key and content:
+                self.properties.setdefault(key.lower(), content.strip())
+        elif tag == 'link':
+            if 'canonical' in (attrs.get('rel') or '').lower().split() and attrs.get('href'):
+                self.canonical = attrs['href']
+        elif tag == 'title' and self.title is None:
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._in_title:
+            self._in_title = False
+            self.title = ''.join(self._title_parts).strip()
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+    def _first(self, *keys):
+        for key in keys:
+            if self.properties.get(key):
+                return self.properties[key]
+        return None
+
+    @property
+    def metadata(self):
+        metadata = {
+            'title': self._first('og:title', 'twitter:title') or self.title,
+            'summary': self._first('og:description', 'twitter:description', 'description'),
+            'image_path': self._first('og:image', 'og:image:url', 'twitter:image', 'twitter:image:src'),
+            'url': self._first('og:url') or self.canonical,
+        }
+        return {key: value for key, value in metadata.items() if value}
+
+
+def detect_charset(head, content_type=''):
+    """Content-Typeヘッダーか<meta charset>で宣言された文字コード。宣言がなければNone"""
+    match = re.search(r'charset=["\']?([\w-]+)', content_type or '', re.IGNORECASE)
+    if match is None:
+        match = CHARSET_RE.search(head)
+    if match is not None:
+        charset = match.group(1)
+        if isinstance(charset, bytes):
+            charset = charset.decode('ascii')
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            pass
+    return None
+
+
+def guess_charset(head):
+    """文字コードの宣言がないページの文字コードを、先頭のバイト列から推定する"""
+    try:
+        # 末尾で文字が途中で切れていても、UTF-8として読めればUTF-8とする
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    import chardet
+
+    encoding = chardet.detect(head)['encoding']
+    try:
+        return codecs.lookup(encoding).name if encoding else 'utf-8'
+    except LookupError:
+        return 'utf-8'
+
+
+def extract_metadata(chunks, content_type='', max_bytes=None):
+    """バイト列のチャンクを順に読み、OGPのタイトル・概要・画像などを取り出す"""
+    parser = OGPParser()
+    decoder = None
+    # 文字コードが決まるまで読んだバイト列
+    head = b''
+    read_bytes = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        read_bytes += len(chunk)
+        reached_limit = max_bytes is not None and read_bytes >= max_bytes
+        if decoder is None:
+            # <meta charset>が長いscriptの後にあることもあるため、</head>かSNIFF_BYTESまで探す
+            head += chunk
+            charset = detect_charset(head, content_type)
+            head_end = HEAD_END_RE.search(head)
+            if charset is None:
+                if not (reached_limit or len(head) >= SNIFF_BYTES or head_end):
+                    continue
+                # 本文は推定に使わない（chardetは読んだ量に比例して遅くなる）
+                charset = guess_charset(head[:head_end.start()] if head_end else head)
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            chunk, head = head, b''
+        parser.feed(decoder.decode(chunk))
+        if parser.done or reached_limit:
+            break
+    else:
+        if head:
+            # </head>を見つける前にページが終わった
+            parser.feed(head.decode(guess_charset(head), errors='replace'))
+    parser.close()
+    return parser.metadata
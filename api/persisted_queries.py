@@ -0,0 +1,82 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest
+from graphene_django.views import HttpError
+
+_allowlist = None
+
+
+class PersistedQueryError(HttpError):
+    """GraphQLのerrors（extensions.codeつき）で返すエラー
+
+    PersistedQueryNotFoundは、Apolloのクライアントがクエリ全体を付けて送り直せるよう200で返す。
+    """
+
+    def __init__(self, message, code, status=400):
+        super().__init__(HttpResponse(status=status), message)
+        self.code = code
+
+
+def get_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_allowlist():
+    """許可リストのファイル（クエリ文字列のJSON配列）を読み込み、ハッシュで引けるようにする"""
+    global _allowlist
+    if _allowlist is None:
+        with open(settings.GRAPHQL_PERSISTED_QUERIES['ALLOWLIST_PATH'], encoding='utf-8') as f:
+            _allowlist = {get_hash(query): query for query in json.load(f)}
+    return _allowlist
+
+
+def _get_cache():
+    return caches[settings.GRAPHQL_PERSISTED_QUERIES['CACHE_ALIAS']]
+
+
+def _get_persisted_hash(request, data):
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('Invalid extensions.'), 'Invalid extensions.')
+    if not isinstance(extensions, dict):
+        return None
+    persisted_query = extensions.get('persistedQuery')
+    if not isinstance(persisted_query, dict):
+        return None
+    return persisted_query.get('sha256Hash')
+
+
+def resolve_query(request, data, query):
+    """Automatic Persisted Queriesのハッシュから、実行するクエリを決める"""
+    query_hash = _get_persisted_hash(request, data)
+
+    if settings.GRAPHQL_PERSISTED_QUERIES['ALLOWLIST_PATH']:
+        # 許可リストのモードでは、登録済みのクエリだけを実行する
+        allowlist = get_allowlist()
+        if query_hash is None and query:
+            query_hash = get_hash(query)
+        if query_hash not in allowlist:
+            raise PersistedQueryError('PersistedQueryNotAllowed', 'PERSISTED_QUERY_NOT_ALLOWED')
+        return allowlist[query_hash]
+
+    if query_hash is None:
+        return query
+
+    cache = _get_cache()
+    key = 'persisted-query:' + query_hash
+    if not query:
+        query = cache.get(key)
+        if query is None:
+            raise PersistedQueryError('PersistedQueryNotFound', 'PERSISTED_QUERY_NOT_FOUND', status=200)
+        return query
+
+    if get_hash(query) != query_hash:
+        raise PersistedQueryError('provided sha does not match query', 'INVALID_PERSISTED_QUERY')
+    cache.set(key, query, settings.GRAPHQL_PERSISTED_QUERIES['TTL'])
+    return query
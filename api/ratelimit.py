@@ -0,0 +1,87 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import GraphQLError
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+_lock = threading.Lock()
+
+
+class RateLimited(GraphQLError):
+    pass
+
+
+def parse_rate(rate):
+    """'10/m'のような指定を、(バケットの容量, 1秒あたりの補充数)にする"""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / RATE_PERIODS[period[0]]
+
+
+def _get_cache():
+    return caches[settings.RATE_LIMIT['CACHE_ALIAS']]
+
+
+def take(key, rate, now=None):
+    """トークンバケットから1つ取り出す。取り出せない場合は、次に取り出せるまでの秒数を返す
+
+    状態はキャッシュに保存するため、複数のワーカーで共有するキャッシュを使えば全体で制限できる
+    （ワーカー間では読み書きが競合しうるため、おおよその制限になる）。
+    """
+    capacity, refill_rate = parse_rate(rate)
+    now = time.time() if now is None else now
+    cache = _get_cache()
+    key = 'ratelimit:' + key
+    with _lock:
+        tokens, updated_at = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + max(0, now - updated_at) * refill_rate)
+        retry_after = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_rate
+        # 満タンに戻った後は状態を持っておく必要がない
+        cache.set(key, (tokens, now), math.ceil((capacity - tokens) / refill_rate) + 1)
+    return retry_after
+
+
+def get_client_ip(request):
+    proxy_count = settings.RATE_LIMIT['PROXY_COUNT']
+    forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxy_count and forwarded_for:
+        # 信頼できるプロキシが末尾に追加したアドレスを使う
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        return addresses[-min(proxy_count, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_identity(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user:%s' % user.pk
+    return 'ip:%s' % get_client_ip(request)
+
+
+class RateLimitMiddleware:
+    """操作（ルートのフィールド）ごとに、ユーザーまたはIPアドレス単位で実行回数を制限するgrapheneのミドルウェア
+
+    JWTでの認証後に判定するため、MIDDLEWAREではJSONWebTokenMiddlewareより前に置く。
+    """
+
+    def resolve(self, next, root, info, **args):
+        options = settings.RATE_LIMIT
+        rate = options['RATES'].get(info.field_name)
+        if not options['ENABLED'] or rate is None or len(info.path) != 1:
+            return next(root, info, **args)
+
+        retry_after = take('%s:%s' % (info.field_name, get_identity(info.context)), rate)
+        if retry_after:
+            retry_after = math.ceil(retry_after)
+            raise RateLimited(
+                'Rate limit exceeded for %s. Retry after %d seconds.' % (info.field_name, retry_after),
+                extensions={'code': 'RATE_LIMITED', 'retryAfter': retry_after})
+        return next(root, info, **args)
@@ -2,18 +2,25 @@ import datetime
 
 import graphene
 import graphql_jwt
-import requests
-from bs4 import BeautifulSoup
 from decouple import config
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
 from graphene import relay
 from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.types import DjangoObjectType
 from graphene_file_upload.scalars import Upload
+from graphql import GraphQLError
 from graphql_jwt.decorators import login_required
-from graphql_relay import from_global_id
+from graphql_relay import from_global_id, to_global_id
 
-from .models import Category, News, Tag, User
+from . import catalog, digest, importer, search
+from .fields import (CountableConnection, KeysetConnectionField,
+                     PrefetchedFilterConnectionField, get_node_field_names)
+from .models import Category, DailyDigest, News, Tag, User
+from .url_utils import canonicalize_url
 
 
 class UserNode(DjangoObjectType):
@@ -89,16 +96,96 @@ class CreateTagMutation(relay.ClientIDMutation):
         return CreateTagMutation(tag=tag)
 
 
+class ThumbnailType(graphene.ObjectType):
+    url = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
+    format = graphene.String()
+
+    def resolve_url(parent, info):
+        return default_storage.url(parent['name'])
+
+
 class NewsNode(DjangoObjectType):
     class Meta:
         model = News
         filter_fields = {
             'url': ['exact'],
-            'title': ['exact', 'icontains'],
-            'summary': ['exact', 'icontains'],
+            # 部分一致はインデックスを使えないため、searchNewsで検索する
+            'title': ['exact'],
+            'summary': ['exact'],
             'created_at': ['exact', 'icontains'],
         }
         interfaces = (relay.Node,)
+        connection_class = CountableConnection
+
+    tags = PrefetchedFilterConnectionField(TagNode)
+    # 幅の小さい順
+    thumbnails = graphene.List(graphene.NonNull(ThumbnailType))
+
+    def resolve_select_category(parent, info):
+        # select_relatedで取得済みでなければ、クエリを発行せずにカタログから返す
+        if parent.select_category_id is None or News.select_category.is_cached(parent):
+            return parent.select_category
+        category = catalog.get_catalog(info.context).categories.get(parent.select_category_id)
+        return category if category is not None else parent.select_category
+
+
+class NewsConnectionField(KeysetConnectionField):
+    # 無限スクロールで最新のものから読むため新しい順に並べ、(created_at, id)をカーソルにする
+    ordering = ('-created_at', '-id')
+
+
+def prefetch_news(queryset, info):
+    """要求されたフィールドに合わせて、タグをまとめて取得する
+
+    カテゴリーとタグの内容はカタログから返し、JOINしない（タグは中間テーブルだけを読む）。
+    """
+    if 'tags' in get_node_field_names(info):
+        queryset = queryset.prefetch_tags(catalog.get_catalog(info.context).tags)
+    return queryset
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _node_pk(value, type_name):
+    """グローバルID（type_nameのもの）の主キーを返す。以前のクライアントのため、主キーの数値も受け付ける"""
+    pk = _to_int(value)
+    if pk is not None:
+        return pk
+    try:
+        value_type, pk = from_global_id(value)
+    except Exception:
+        return None
+    return _to_int(pk) if value_type == type_name else None
+
+
+class DigestItemType(graphene.ObjectType):
+    id = graphene.ID()
+    url = graphene.String()
+    title = graphene.String()
+    summary = graphene.String()
+    image_path = graphene.String()
+    contributor_name = graphene.String()
+    created_at = graphene.DateTime()
+    category_name = graphene.String()
+    tag_names = graphene.List(graphene.String)
+
+    def resolve_created_at(parent, info):
+        return datetime.datetime.fromisoformat(parent['created_at'])
+
+
+class DailyDigestType(DjangoObjectType):
+    class Meta:
+        model = DailyDigest
+        fields = ('day', 'items', 'updated_at')
+
+    items = graphene.List(DigestItemType)
 
 
 class CreateNewsMutation(relay.ClientIDMutation):
@@ -112,9 +199,34 @@ class CreateNewsMutation(relay.ClientIDMutation):
     news = graphene.Field(NewsNode)
 
     def mutate_and_get_payload(root, info, **input):
+        # 同じ記事がすでにシェアされていれば、保存やOGPの取得をせずにエラーにする
+        try:
+            normalized_url = canonicalize_url(input.get('url'))
+        except ValueError:
+            raise GraphQLError('Invalid URL.')
+        duplicate_id = News.objects.filter(
+            normalized_url=normalized_url).values_list('id', flat=True).first()
+        if duplicate_id is not None:
+            raise GraphQLError('This news has already been shared.', extensions={
+                'code': 'DUPLICATE_URL', 'newsId': to_global_id('NewsNode', duplicate_id)})
+
+        # カテゴリーとタグの存在は、クエリを発行せずにカタログで確認する
+        current = catalog.get_catalog(info.context)
+        category_id = None
+        if input.get('select_category_id') is not None:
+            category_id = _node_pk(input.get('select_category_id'), 'CategoryNode')
+            if category_id not in current.categories:
+                raise GraphQLError('Category does not exist.')
+        tag_ids = [_node_pk(tag_id, 'TagNode') for tag_id in input.get('tag_ids') or []]
+        missing_tag_ids = [tag_id for tag_id, pk in zip(input.get('tag_ids') or [], tag_ids)
+                           if pk not in current.tags]
+        if missing_tag_ids:
+            raise GraphQLError('Tags do not exist: %s' % ', '.join(missing_tag_ids))
+
         news = News(
             url=input.get('url'),
             contributor_name=input.get('contributor_name'),
+            metadata_status=News.MetadataStatus.PENDING,
         )
 
         # 作成日時をタイムUNIXタイムスタンプ形式で受け取り設定
@@ -122,46 +234,63 @@ class CreateNewsMutation(relay.ClientIDMutation):
             now = datetime.datetime.fromtimestamp(input.get('created_at'))
             news.created_at = now
 
-        # スクレイピングでOGPの内容を取得
-        html = requests.get(input.get('url'))
-        # HTMLをパース
-        parsed_html = BeautifulSoup(html.content, 'html.parser')
-        if parsed_html is not None:
-            # OGPのタイトルがある場合
-            og_title_tag = parsed_html.find(
-                'meta', attrs={'property': 'og:title', 'content': True})
-            if og_title_tag is not None:
-                og_title = og_title_tag.get('content')
-                news.title = og_title
-            else:
-                news.title = parsed_html.find('title').text
-
-            # OGPのディスクリプションがある場合
-            og_description_tag = parsed_html.find(
-                'meta', attrs={'property': 'og:description', 'content': True})
-            if og_description_tag is not None:
-                og_description = og_description_tag.get('content')
-                news.summary = og_description
-            # OGPの画像がある場合
-            og_image_tag = parsed_html.find(
-                'meta', attrs={'property': 'og:image', 'content': True})
-            if og_image_tag is not None:
-                og_image = og_image_tag.get('content')
-                news.image_path = og_image
-
-            news.save()
-
-            if input.get('select_category_id') is not None:
-                news.select_category_id = from_global_id(
-                    input.get('select_category_id'))[1],
-
-            tag_set = []
-            if input.get('tag_ids') is not None:
-                for tag_id in input.get('tag_ids'):
-                    tag_set.append(tag_id)
-                news.tags = tag_set
-            news.save()
-            return CreateNewsMutation(news=news)
+        news.select_category_id = category_id
+
+        news.save()
+
+        if tag_ids:
+            news.tags.set(tag_ids)
+
+        # OGPの取得はバックグラウンドで行い、すぐにレスポンスを返す
+        # （requestsやPillowを起動時に読み込まないよう、登録するときに初めてimportする）
+        from . import workers
+        transaction.on_commit(lambda: workers.enqueue(news.id))
+        return CreateNewsMutation(news=news)
+
+
+class NewsInput(graphene.InputObjectType):
+    select_category_id = graphene.ID(required=False)
+    url = graphene.String(required=True)
+    tag_ids = graphene.List(graphene.ID)
+    contributor_name = graphene.String(required=False)
+    created_at = graphene.Int(required=True)
+
+
+class BulkCreateNewsResult(graphene.ObjectType):
+    url = graphene.String()
+    news = graphene.Field(NewsNode)
+    error = graphene.String()
+
+
+class BulkCreateNewsMutation(relay.ClientIDMutation):
+    class Input:
+        news = graphene.List(graphene.NonNull(NewsInput), required=True)
+
+    results = graphene.List(BulkCreateNewsResult)
+
+    def mutate_and_get_payload(root, info, **input):
+        # 1回のリクエストでの登録とOGPの取得の件数を制限する
+        max_items = settings.BULK_CREATE_NEWS['MAX_ITEMS']
+        if max_items and len(input.get('news')) > max_items:
+            raise GraphQLError('Too many news: %d (max %d).' % (len(input.get('news')), max_items))
+        items = []
+        for news_input in input.get('news'):
+            item = dict(news_input)
+            item['created_at'] = datetime.datetime.fromtimestamp(news_input.created_at)
+            # 主キーにできないIDはそのまま渡し、importerで項目ごとのエラーにする
+            if news_input.select_category_id is not None:
+                category_id = news_input.select_category_id
+                item['select_category_id'] = _node_pk(category_id, 'CategoryNode') or category_id
+            item['tag_ids'] = [_node_pk(tag_id, 'TagNode') or tag_id for tag_id in news_input.tag_ids or []]
+            items.append(item)
+
+        results = importer.import_news(items)
+
+        # OGPの取得は登録後にまとめてバックグラウンドで行う
+        news_ids = [result['news'].id for result in results if result['news'] is not None]
+        from . import workers
+        transaction.on_commit(lambda: [workers.enqueue(news_id) for news_id in news_ids])
+        return BulkCreateNewsMutation(results=[BulkCreateNewsResult(**result) for result in results])
 
 
 class UpdateNewsMutation(relay.ClientIDMutation):
@@ -187,6 +316,7 @@ class Mutation(graphene.ObjectType):
     create_category = CreateCategoryMutation().Field()
     create_tag = CreateTagMutation().Field()
     create_news = CreateNewsMutation().Field()
+    bulk_create_news = BulkCreateNewsMutation().Field()
     update_news = UpdateNewsMutation().Field()
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
     refresh_token = graphql_jwt.Refresh.Field()
@@ -197,17 +327,22 @@ class Query(graphene.ObjectType):
     user = graphene.Field(UserNode, id=graphene.NonNull(graphene.ID))
     all_users = DjangoFilterConnectionField(UserNode)
     category = graphene.Field(CategoryNode, id=graphene.NonNull(graphene.ID))
-    all_categories = DjangoFilterConnectionField(CategoryNode)
+    all_categories = PrefetchedFilterConnectionField(CategoryNode)
     tag = graphene.Field(TagNode, id=graphene.NonNull(graphene.ID))
-    all_tags = DjangoFilterConnectionField(TagNode)
+    all_tags = PrefetchedFilterConnectionField(TagNode)
     news = graphene.Field(NewsNode, id=graphene.NonNull(graphene.ID))
-    all_news = DjangoFilterConnectionField(NewsNode)
-    today_news = DjangoFilterConnectionField(NewsNode)
-    yesterday_news = DjangoFilterConnectionField(NewsNode)
-    specific_day_news = DjangoFilterConnectionField(NewsNode, 
-                                                    year=graphene.Int(required=True),
-                                                    month=graphene.Int(required=True),
-                                                    day=graphene.Int(required=True))
+    all_news = NewsConnectionField(NewsNode)
+    today_news = NewsConnectionField(NewsNode)
+    yesterday_news = NewsConnectionField(NewsNode)
+    search_news = DjangoFilterConnectionField(NewsNode, query=graphene.String(required=True))
+    specific_day_news = NewsConnectionField(NewsNode,
+                                            year=graphene.Int(required=True),
+                                            month=graphene.Int(required=True),
+                                            day=graphene.Int(required=True))
+    daily_digest = graphene.Field(DailyDigestType,
+                                  year=graphene.Int(required=True),
+                                  month=graphene.Int(required=True),
+                                  day=graphene.Int(required=True))
 
     @ login_required
     def resolve_user(self, info, **kwargs):
@@ -220,17 +355,23 @@ class Query(graphene.ObjectType):
 
     def resolve_category(self, info, **kwargs):
         id = kwargs.get('id')
-        return Category.objects.get(id=from_global_id(id)[1])
+        category = catalog.get_catalog(info.context).categories.get(_to_int(from_global_id(id)[1]))
+        if category is None:
+            raise Category.DoesNotExist('Category matching query does not exist.')
+        return category
 
     def resolve_all_categories(self, info, **kwargs):
-        return Category.objects.all()
+        return list(catalog.get_catalog(info.context).categories.values())
 
     def resolve_tag(self, info, **kwargs):
         id = kwargs.get('id')
-        return Tag.objects.get(id=from_global_id(id)[1])
+        tag = catalog.get_catalog(info.context).tags.get(_to_int(from_global_id(id)[1]))
+        if tag is None:
+            raise Tag.DoesNotExist('Tag matching query does not exist.')
+        return tag
 
     def resolve_all_tags(self, info, **kwargs):
-        return Tag.objects.all()
+        return list(catalog.get_catalog(info.context).tags.values())
 
     def resolve_news(self, info, **kwargs):
         id = kwargs.get('id')
@@ -238,25 +379,28 @@ class Query(graphene.ObjectType):
 
     # 全てのニュースを取得
     def resolve_all_news(self, info, **kwargs):
-        return News.objects.all()
+        return prefetch_news(News.objects.all(), info)
+
+    # タイトルと概要からニュースを検索
+    def resolve_search_news(self, info, **kwargs):
+        return prefetch_news(search.search_news(News.objects.all(), kwargs.get('query')), info)
 
     # 今日のニュースを取得
     def resolve_today_news(self, info, **kwargs):
-        today = datetime.datetime.today()
-        return News.objects.filter(created_at__year=today.year, created_at__month=today.month, created_at__day=today.day)
+        today = timezone.localdate()
+        return prefetch_news(News.objects.on_day(today), info)
 
     # 昨日のニュースを取得
     def resolve_yesterday_news(self, info, **kwargs):
-        today = datetime.datetime.today()
-        oneday=datetime.timedelta(days=1) 
-        yesterday = today-oneday
-        print(yesterday)
-        return News.objects.filter(created_at__year=yesterday.year, created_at__month=yesterday.month, created_at__day=yesterday.day)
-
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        return prefetch_news(News.objects.on_day(yesterday), info)
 
     # 指定された日付のニュースを取得
     def resolve_specific_day_news(self, info, **kwargs):
-        year=kwargs.get('year')
-        month=kwargs.get('month')
-        day=kwargs.get('day')
-        return News.objects.filter(created_at__year=year, created_at__month=month, created_at__day=day)
+        day = datetime.date(kwargs.get('year'), kwargs.get('month'), kwargs.get('day'))
+        return prefetch_news(News.objects.on_day(day), info)
+
+    # 指定された日付のニュースを、ダイジェストから1行で取得（ニュースがない日はnull）
+    def resolve_daily_digest(self, info, **kwargs):
+        day = datetime.date(kwargs.get('year'), kwargs.get('month'), kwargs.get('day'))
+        return digest.get_digest(day)
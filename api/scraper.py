@@ -0,0 +1,36 @@
+import requests
+from django.conf import settings
+
+from . import http_client, metadata_cache
+from .ogp import extract_metadata
+
+CHUNK_SIZE = 16 * 1024
+
+
+class MetadataUnavailable(Exception):
+    """直近で取得に失敗しているURL"""
+
+
+def fetch_metadata(url):
+    """URLのページを取得し、OGPからタイトル・概要・画像を取り出す"""
+    cached = metadata_cache.get(url)
+    if cached is not None:
+        if cached.get('failed'):
+            raise MetadataUnavailable(url)
+        return cached
+
+    try:
+        metadata = _fetch(url)
+    except requests.RequestException:
+        metadata_cache.set_failed(url)
+        raise
+    return metadata_cache.set(url, metadata)
+
+
+def _fetch(url):
+    # ページ全体はダウンロードせず、</head>までを少しずつ読む
+    with http_client.get_html(url) as response:
+        return extract_metadata(
+            http_client.iter_content(response, CHUNK_SIZE),
+            content_type=response.headers.get('Content-Type', ''),
+            max_bytes=settings.NEWS_METADATA['MAX_BYTES'])
@@ -0,0 +1,53 @@
+import unicodedata
+
+from django.db import connection
+
+# pg_trgmは3文字未満の部分一致にインデックスを使えないため、それより短い検索語は文字のN-gramで探す
+SHORT_QUERY_LENGTH = 3
+
+
+def normalize_search_text(*values):
+    """全角・半角や大文字・小文字の違いをそろえた検索用の文字列"""
+    text = ' '.join(value for value in values if value)
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def make_search_ngrams(search_text):
+    """検索用の文字列に含まれる1文字と2文字の並びを、空白区切りにしたもの"""
+    ngrams = set()
+    for word in search_text.split():
+        ngrams.update(word)
+        ngrams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return ' '.join(sorted(ngrams))
+
+
+def _filter_short_query(queryset, query):
+    if connection.vendor != 'postgresql':
+        return queryset.filter(search_text__contains=query)
+    from django.contrib.postgres.fields import ArrayField
+    from django.db.models import F, Func, TextField, Value
+
+    # マイグレーションで作ったGINの式インデックスと同じ式にする
+    ngrams = Func(F('search_ngrams'), Value(' '), function='string_to_array',
+                  output_field=ArrayField(TextField()))
+    return queryset.alias(search_ngram_list=ngrams).filter(search_ngram_list__contains=[query])
+
+
+def search_news(queryset, query):
+    """タイトルと概要を部分一致で検索する
+
+    PostgreSQLではpg_trgmのGINインデックスを使い、類似度の高い順に並べる。
+    3文字未満の検索語は、1文字と2文字の並び（search_ngrams）のGINインデックスで探し、新しい順に並べる。
+    それ以外のデータベースでは新しい順に並べる。
+    """
+    query = normalize_search_text(query).strip()
+    if not query:
+        return queryset.none()
+    if len(query) < SHORT_QUERY_LENGTH:
+        return _filter_short_query(queryset, query).order_by('-created_at')
+    queryset = queryset.filter(search_text__contains=query)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        return queryset.annotate(
+            rank=TrigramSimilarity('search_text', query)).order_by('-rank', '-created_at')
+    return queryset.order_by('-created_at')
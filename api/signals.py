@@ -0,0 +1,149 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_init, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+from graphql_jwt.refresh_token.signals import refresh_token_revoked
+
+from . import catalog, digest, feed_cache, jwt_users, news_events
+from .models import Category, News, Tag, User
+
+
+# コミット後に作り直す日付（接続と同じく、スレッドごとに持つ）
+_pending = threading.local()
+
+
+def _get_pending_days():
+    if not hasattr(_pending, 'days'):
+        _pending.days = set()
+    return _pending.days
+
+
+def _refresh_pending_days():
+    days = _get_pending_days()
+    if not days:
+        return
+    days, _pending.days = sorted(days), set()
+    digest.refresh_days(days)
+    feed_cache.invalidate_days(days)
+
+
+def invalidate_days_on_commit(days):
+    """コミット後に、指定された日付のダイジェストを作り直し、キャッシュを無効にする
+
+    同じトランザクションで何件変更されても、日付ごとに1回だけ作り直す。
+    """
+    _get_pending_days().update(day for day in days if day is not None)
+    # ロールバックされた場合も日付が漏れないよう毎回登録し、最初に実行されたものがまとめて処理する
+    # （コミット前に無効にすると、古い内容が再びキャッシュされることがある）
+    transaction.on_commit(_refresh_pending_days)
+
+
+def local_day(value):
+    if value is None:
+        return None
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localdate(value)
+
+
+@receiver(post_init, sender=News)
+def remember_created_at(sender, instance, **kwargs):
+    # 日付が変更された場合に、変更前の日付のキャッシュも消せるように覚えておく
+    instance._loaded_created_at = instance.created_at
+
+
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def invalidate_news_days(sender, instance, **kwargs):
+    invalidate_days_on_commit([
+        local_day(instance._loaded_created_at), local_day(instance.created_at)])
+    instance._loaded_created_at = instance.created_at
+
+
+@receiver(post_save, sender=News)
+def publish_saved_news(sender, instance, created, **kwargs):
+    # 作成・変更・OGPの取得のどれで保存された場合も、購読中のクライアントに知らせる
+    news_events.publish_on_commit(instance, 'created' if created else 'updated')
+
+
+@receiver(post_delete, sender=News)
+def publish_deleted_news(sender, instance, **kwargs):
+    news_events.publish_on_commit(instance, 'deleted')
+
+
+@receiver(m2m_changed, sender=News.tags.through)
+def invalidate_tagged_news_days(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_days_on_commit([local_day(instance.created_at)])
+        return
+    if action in ('post_add', 'post_remove'):
+        news = News.objects.filter(pk__in=pk_set)
+    elif action == 'pre_clear':
+        news = News.objects.filter(tags=instance)
+    else:
+        return
+    invalidate_days_on_commit(local_day(created_at)
+                              for created_at in news.values_list('created_at', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_all_days(sender, **kwargs):
+    # タグやカテゴリーの名前はすべての日付のレスポンスに含まれうる
+    transaction.on_commit(feed_cache.invalidate_all)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    catalog.bump_version()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def refresh_tagged_digests(sender, instance, **kwargs):
+    # ダイジェストにはタグ名が含まれるため、そのタグが付いたニュースの日付を作り直す
+    # 削除の場合は関連が消える前に日付を集める
+    if kwargs.get('created'):
+        return
+    news = News.objects.filter(tags=instance)
+    days = [local_day(created_at) for created_at in news.values_list('created_at', flat=True)]
+    transaction.on_commit(lambda: digest.refresh_days(days))
+
+
+@receiver(post_save, sender=Category)
+def refresh_categorized_digests(sender, instance, created, **kwargs):
+    if created:
+        return
+    news = News.objects.filter(select_category=instance)
+    days = [local_day(created_at) for created_at in news.values_list('created_at', flat=True)]
+    transaction.on_commit(lambda: digest.refresh_days(days))
+
+
+@receiver(post_init, sender=User)
+def remember_email(sender, instance, **kwargs):
+    # メールアドレスが変更された場合に、変更前のトークンのキャッシュも消せるように覚えておく
+    instance._loaded_email = instance.email
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_jwt_user(sender, instance, **kwargs):
+    # パスワードや有効・無効の変更も含め、保存されたらキャッシュを消す
+    emails = [instance._loaded_email, instance.email]
+    transaction.on_commit(lambda: jwt_users.invalidate(*emails))
+    instance._loaded_email = instance.email
+
+
+@receiver(refresh_token_revoked)
+def invalidate_revoked_jwt_user(sender, refresh_token, **kwargs):
+    email = refresh_token.user.get_username()
+    transaction.on_commit(lambda: jwt_users.invalidate(email))
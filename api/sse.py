@@ -0,0 +1,87 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from . import news_events
+
+
+def format_event(event):
+    return ('id: %d\nevent: %s\ndata: %s\n\n' % (
+        event['id'], event['type'], json.dumps(event['data'], separators=(',', ':')))).encode('utf-8')
+
+
+def _get_last_event_id(scope, headers):
+    # ブラウザは再接続時にLast-Event-IDヘッダーを送る。初回はクエリパラメータで指定できる
+    value = headers.get(b'last-event-id', b'').decode('latin-1')
+    if not value:
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        value = query.get('lastEventId', [''])[0]
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _get_response_headers(headers):
+    response_headers = [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        # nginxなどのプロキシでバッファリングしない
+        (b'x-accel-buffering', b'no'),
+    ]
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if origin in settings.CORS_ALLOWED_ORIGINS:
+        response_headers += [(b'access-control-allow-origin', origin.encode('latin-1')),
+                             (b'vary', b'Origin')]
+    return response_headers
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def news_events_app(scope, receive, send):
+    """ニュースの作成・更新・削除をServer-Sent Eventsで送り続けるASGIアプリ
+
+    Django 3.2のASGIではレスポンスを非同期に送り続けられないため、project/asgi.pyで
+    このパスだけを直接処理する。
+    """
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405,
+                    'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    options = settings.NEWS_EVENTS
+    headers = dict(scope['headers'])
+    subscription, missed = news_events.subscribe(_get_last_event_id(scope, headers))
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': _get_response_headers(headers)})
+        # 再開できない場合は、resetのイベントで一覧を取得し直してもらう
+        body = b'retry: %d\n\n' % options['RETRY']
+        body += b''.join(format_event(event) for event in missed)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        while not subscription.overflowed:
+            next_event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=options['KEEPALIVE'],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_event.cancel()
+                return
+            if next_event in done:
+                body = format_event(next_event.result())
+            else:
+                # 接続を切られないよう、コメントを送る
+                next_event.cancel()
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        news_events.unsubscribe(subscription)
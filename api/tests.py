@@ -1,3 +1,1161 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+import requests
+from graphql import parse
+from graphql_jwt.shortcuts import get_token
+from graphql_relay import to_global_id
+from urllib3.response import HTTPResponse
+
+from project.schema import schema
+
+from . import (catalog, complexity, db_connections, digest, feed_cache, http_client, importer, instrumentation,
+               jwt_users, metadata_cache, news_events, ogp, persisted_queries, ratelimit, scraper, search, signals,
+               thumbnails, workers)
+from .benchmark import FEED_FULL_QUERY, TODAY_QUERY
+from .backend import CachedDocumentBackend
+from .management.commands.benchmark_ogp import FIXTURES_DIR
+from .management.commands.benchmark_thumbnails import make_image
+from .models import Category, News, Tag, User
+from .schema import NewsConnectionField
+from .sse import news_events_app
+from .url_utils import canonicalize_url
+
+TOKYO = timezone.get_fixed_timezone(9 * 60)
+
+
+def _explain(queryset):
+    # 件数が少ないとPostgresはインデックスを使わないため、シーケンシャルスキャンを無効にして確認する
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+    return queryset.explain()
+
+
+class NewsOnDayTests(TestCase):
+    def _create(self, url, *args):
+        return News.objects.create(
+            url=url, created_at=datetime.datetime(*args, tzinfo=TOKYO))
+
+    def test_uses_created_at_index(self):
+        self._create('https://example.com/1', 2021, 8, 2, 12, 0)
+        plan = _explain(News.objects.on_day(datetime.date(2021, 8, 2)))
+        self.assertIn('api_news_created_3389d1_idx', plan)
+
+    def test_day_boundaries_in_tokyo(self):
+        self._create('https://example.com/before', 2021, 8, 1, 23, 59)
+        self._create('https://example.com/start', 2021, 8, 2, 0, 0)
+        self._create('https://example.com/end', 2021, 8, 2, 23, 59)
+        self._create('https://example.com/after', 2021, 8, 3, 0, 0)
+
+        with timezone.override('Asia/Tokyo'):
+            urls = set(News.objects.on_day(datetime.date(2021, 8, 2)).values_list('url', flat=True))
+        self.assertEqual(urls, {'https://example.com/start', 'https://example.com/end'})
+
+
+NEWS_FIELDS = '''
+    edges { node { title selectCategory { categoryName } tags { edges { node { tagName } } } } }
+'''
+
+
+class NewsQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(category_name='category%d' % i) for i in range(3)]
+        tags = [Tag.objects.create(tag_name='tag%d' % i) for i in range(4)]
+        # 今日の正午（日付をまたいで実行しても、todayNewsに含まれるように）
+        now = timezone.make_aware(datetime.datetime.combine(timezone.localdate(), datetime.time(12)))
+        for i in range(60):
+            news = News.objects.create(url='https://example.com/%d' % i, title='news%d' % i,
+                                       created_at=now, select_category=categories[i % 3])
+            news.tags.set(tags[:i % 4 + 1])
+
+    def _assert_constant(self, field, arguments=''):
+        # ロールバックで版が戻るため、他のテストで読み込んだカタログを使わないようにする
+        catalog._catalog = None
+        catalog.load()
+        # カタログの版の確認、ページのニュース、タグの中間テーブルの3回（件数によらない）
+        # カテゴリーとタグの内容はカタログから返す
+        for first in (5, 50):
+            query = '{ %s(first: %d%s) { %s } }' % (field, first, arguments, NEWS_FIELDS)
+            with self.assertNumQueries(3):
+                result = schema.execute(query, context_value=RequestFactory().get('/'))
+            self.assertIsNone(result.errors)
+            self.assertEqual(len(result.data[field]['edges']), first)
+
+    def test_all_news(self):
+        self._assert_constant('allNews')
+
+    def test_today_news(self):
+        self._assert_constant('todayNews')
+
+    def test_specific_day_news(self):
+        today = timezone.localdate()
+        self._assert_constant('specificDayNews', ', year: %d, month: %d, day: %d' % (
+            today.year, today.month, today.day))
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        # ロールバックで版が戻るため、他のテストで読み込んだカタログを使わないようにする
+        catalog._catalog = None
+        self.tag = Tag.objects.create(tag_name='python')
+        self.category = Category.objects.create(category_name='技術')
+
+    def test_reloads_when_version_changes(self):
+        loaded = catalog.load()
+        # 版が変わらなければ、版の確認だけで同じものを使う
+        with self.assertNumQueries(1):
+            self.assertIs(catalog.load(), loaded)
+
+        # タグを変更すると版が上がり、読み直す
+        tag = Tag.objects.create(tag_name='django')
+        self.assertNotIn(tag.pk, loaded.tag_rows)
+        self.assertEqual(catalog.get_catalog().tags[tag.pk].tag_name, 'django')
+
+    def test_copies_instances_per_request(self):
+        first = catalog.get_catalog(RequestFactory().get('/'))
+        tag = first.tags[self.tag.pk]
+        self.assertIs(first.tags[self.tag.pk], tag)
+        tag.tag_name = 'changed'
+        other = catalog.get_catalog(RequestFactory().get('/'))
+        self.assertEqual(other.tags[self.tag.pk].tag_name, 'python')
+
+    def test_serves_feed_tags_and_categories(self):
+        news = News.objects.create(url='https://example.com/1', created_at=timezone.now(),
+                                   select_category=self.category)
+        catalog.load()
+        # カタログを読み込んだ後に作られたタグ（bulk_createでは版が上がらない）
+        late_tag = Tag.objects.bulk_create([Tag(tag_name='late')])[0]
+        if late_tag.pk is None:
+            late_tag = Tag.objects.get(tag_name='late')
+        news.tags.set([self.tag, late_tag])
+
+        result = schema.execute('{ allNews(first: 1) { %s } }' % NEWS_FIELDS,
+                                context_value=RequestFactory().get('/'))
+        self.assertIsNone(result.errors)
+        node = result.data['allNews']['edges'][0]['node']
+        self.assertEqual(node['selectCategory'], {'categoryName': '技術'})
+        self.assertEqual([edge['node']['tagName'] for edge in node['tags']['edges']], ['python', 'late'])
+
+    def test_create_news_accepts_global_ids(self):
+        with mock.patch('api.workers.enqueue'):
+            result = schema.execute(
+                'mutation ($tagIds: [ID], $categoryId: ID, $createdAt: Int!) { createNews(input: '
+                '{url: "https://example.com/2", createdAt: $createdAt, tagIds: $tagIds, '
+                'selectCategoryId: $categoryId}) { news { url } } }',
+                variables={'createdAt': int(timezone.now().timestamp()),
+                           'tagIds': [to_global_id('TagNode', self.tag.pk)],
+                           'categoryId': to_global_id('CategoryNode', self.category.pk)},
+                context_value=RequestFactory().post('/'))
+        self.assertIsNone(result.errors)
+        news = News.objects.get(url='https://example.com/2')
+        self.assertEqual((list(news.tags.all()), news.select_category), ([self.tag], self.category))
+
+
+class KeysetPaginationTests(TestCase):
+    PAGE_QUERY = '''
+    query Page($first: Int, $last: Int, $after: String, $before: String, $offset: Int) {
+      allNews(first: $first, last: $last, after: $after, before: $before, offset: $offset) {
+        edges { cursor node { url } }
+        pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+      }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        base = datetime.datetime(2021, 8, 2, 12, 0, 0, 123456, tzinfo=TOKYO)
+        # 同じ作成日時のものを含め、idとは逆の順に作成日時を付ける
+        for i in range(10):
+            News.objects.create(url='https://example.com/%d' % i,
+                                created_at=base - datetime.timedelta(minutes=i // 2))
+        cls.urls = list(News.objects.order_by('-created_at', '-id').values_list('url', flat=True))
+
+    def _page(self, **variables):
+        result = schema.execute(self.PAGE_QUERY, variables=variables)
+        self.assertIsNone(result.errors)
+        return result.data['allNews']
+
+    def _urls(self, page):
+        return [edge['node']['url'] for edge in page['edges']]
+
+    def test_cursor_round_trip(self):
+        news = News.objects.order_by('id').first()
+        cursor = NewsConnectionField.encode_cursor(news)
+        self.assertEqual(NewsConnectionField.decode_cursor(News, cursor), [news.created_at, news.id])
+
+    def test_newest_first_pages(self):
+        self.assertEqual(self.urls[0], 'https://example.com/1')
+        urls, after = [], None
+        while True:
+            page = self._page(first=3, after=after)
+            urls += self._urls(page)
+            self.assertEqual(page['pageInfo']['hasPreviousPage'], after is not None)
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+        self.assertEqual(urls, self.urls)
+
+    def test_last_and_before(self):
+        page = self._page(last=3)
+        self.assertEqual(self._urls(page), self.urls[-3:])
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+
+        page = self._page(last=3, before=page['pageInfo']['startCursor'])
+        self.assertEqual(self._urls(page), self.urls[-6:-3])
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+    def test_offset_fallback_uses_same_order(self):
+        self.assertEqual(self._urls(self._page(first=3, offset=4)), self.urls[4:7])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-a-cursor', to_global_id('NewsNode', 1)):
+            result = schema.execute(self.PAGE_QUERY, variables={'first': 3, 'after': cursor})
+            self.assertEqual(result.errors[0].message, 'Invalid cursor: %s' % cursor)
+
+
+@skipUnless('replica1' in settings.DATABASES,
+            'DATABASE_REPLICA_URLSにレプリカ（別のSQLiteのファイル）を指定した場合に実行する')
+class ReplicaRoutingTests(TestCase):
+    # レプリカには別のテスト用データベースを作り、どちらから読んだかをデータで見分ける
+    # （スキップする場合も、テストの実行前にデータベースが確認されるため、指定があるものだけにする）
+    databases = {'default', 'replica1'}.intersection(settings.DATABASES)
+
+    def setUp(self):
+        caches[settings.DB_REPLICAS['CACHE_ALIAS']].clear()
+        caches[settings.FEED_CACHE['CACHE_ALIAS']].clear()
+        created_at = timezone.now()
+        News.objects.using('default').create(url='https://example.com/primary', created_at=created_at)
+        News.objects.using('replica1').create(url='https://example.com/replica', created_at=created_at)
+
+    def _post(self, query):
+        response = self.client.post('/graphql/', json.dumps({'query': query}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _all_news_urls(self):
+        result = self._post('{ allNews { edges { node { url } } } }')
+        return {edge['node']['url'] for edge in result['data']['allNews']['edges']}
+
+    def _create_news(self, url):
+        return self._post('mutation { createNews(input: {url: "%s", createdAt: 1627873200}) '
+                          '{ news { url } } }' % url)
+
+    def test_query_reads_from_replica(self):
+        self.assertEqual(self._all_news_urls(), {'https://example.com/replica'})
+
+    def test_mutation_uses_primary(self):
+        # 重複の確認もプライマリで行う
+        result = self._create_news('https://example.com/primary')
+        self.assertEqual(result['errors'][0]['extensions']['code'], 'DUPLICATE_URL')
+
+        result = self._create_news('https://example.com/new')
+        self.assertNotIn('errors', result)
+        self.assertTrue(News.objects.using('default').filter(url='https://example.com/new').exists())
+        self.assertFalse(News.objects.using('replica1').filter(url='https://example.com/new').exists())
+
+    def test_cached_feed_reads_from_primary(self):
+        # レスポンス全体をキャッシュするクエリは、レプリカの遅れを保存しないようプライマリから読む
+        for _ in range(2):
+            result = self._post('{ todayNews { edges { node { url } } } }')
+            urls = {edge['node']['url'] for edge in result['data']['todayNews']['edges']}
+            self.assertEqual(urls, {'https://example.com/primary'})
+
+    def test_reads_primary_after_mutation(self):
+        self._create_news('https://example.com/new')
+        self.assertEqual(self._all_news_urls(), {'https://example.com/primary', 'https://example.com/new'})
+
+        # STICKY_SECONDSが過ぎたら、レプリカから読む
+        caches[settings.DB_REPLICAS['CACHE_ALIAS']].clear()
+        self.assertEqual(self._all_news_urls(), {'https://example.com/replica'})
+
+
+class DbConnectionCheckTests(TestCase):
+    def setUp(self):
+        # テストのトランザクションの接続は閉じられないため、確認と閉じる処理はモックにする
+        patchers = [mock.patch.object(connection, 'is_usable', return_value=True),
+                    mock.patch.object(connection, 'close')]
+        self.is_usable, self.close = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, connection, 'errors_occurred', False)
+        connection.ensure_connection()
+        db_connections.mark_connections_used()
+
+    def test_skips_check_for_recently_used_connection(self):
+        with self.assertNumQueries(0):
+            db_connections.check_connections()
+        self.is_usable.assert_not_called()
+
+    def test_checks_idle_connection(self):
+        connection.last_used_at = time.monotonic() - settings.DB_CONNECTIONS['HEALTH_CHECK_IDLE']
+        db_connections.check_connections()
+        self.is_usable.assert_called_once_with()
+        self.close.assert_not_called()
+
+    def test_checks_connection_after_error(self):
+        connection.errors_occurred = True
+        db_connections.check_connections()
+        self.is_usable.assert_called_once_with()
+
+    def test_checks_connection_not_yet_used_by_request(self):
+        del connection.last_used_at
+        db_connections.check_connections()
+        self.is_usable.assert_called_once_with()
+
+    def test_closes_unusable_connection(self):
+        self.is_usable.return_value = False
+        connection.errors_occurred = True
+        before = db_connections.get_stats()
+        db_connections.check_connections()
+        self.close.assert_called_once_with()
+        after = db_connections.get_stats()
+        self.assertEqual(after['failed'] - before['failed'], 1)
+        self.assertEqual(after['reused'], before['reused'])
+
+    def test_health_checks_disabled(self):
+        connection.errors_occurred = True
+        with self.settings(DB_CONNECTIONS=dict(settings.DB_CONNECTIONS, HEALTH_CHECKS=False)):
+            db_connections.check_connections()
+        self.is_usable.assert_not_called()
+
+
+class SearchNewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created_at = timezone.now()
+        for i, title in enumerate(['速報 新しいリリース', 'ＡＩの記事のまとめ', 'Python 入門']):
+            News.objects.create(url='https://example.com/%d' % i, title=title, created_at=created_at)
+
+    def _titles(self, query):
+        return {news.title for news in search.search_news(News.objects.all(), query)}
+
+    def test_short_queries(self):
+        self.assertEqual(self._titles('記事'), {'ＡＩの記事のまとめ'})
+        self.assertEqual(self._titles('速報'), {'速報 新しいリリース'})
+        self.assertEqual(self._titles('ai'), {'ＡＩの記事のまとめ'})
+        self.assertEqual(self._titles('の'), {'ＡＩの記事のまとめ'})
+        # 空白をまたぐ並びは含めない
+        self.assertEqual(self._titles('報新'), set())
+
+    def test_long_query(self):
+        self.assertEqual(self._titles('リリース'), {'速報 新しいリリース'})
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQLのGINインデックスを確認する')
+    def test_short_query_uses_ngram_index(self):
+        plan = _explain(search.search_news(News.objects.all(), '記事'))
+        self.assertIn('api_news_search_ngrams_gin', plan)
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = '{ allCategories { edges { node { id } } } }'
+
+    def setUp(self):
+        caches[settings.GRAPHQL_PERSISTED_QUERIES['CACHE_ALIAS']].clear()
+        persisted_queries._allowlist = None
+        self.addCleanup(setattr, persisted_queries, '_allowlist', None)
+
+    def _post(self, query=None, query_hash=None):
+        data = {}
+        if query is not None:
+            data['query'] = query
+        if query_hash is not None:
+            data['extensions'] = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash}}
+        return self.client.post('/graphql/', json.dumps(data), content_type='application/json')
+
+    def _error_code(self, response):
+        return response.json()['errors'][0]['extensions']['code']
+
+    def test_unknown_hash_asks_client_to_retry(self):
+        # Apolloのクライアントは、200のerrorsを見てクエリ全体を付けて送り直す
+        response = self._post(query_hash=persisted_queries.get_hash(self.QUERY))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+        self.assertEqual(self._error_code(response), 'PERSISTED_QUERY_NOT_FOUND')
+
+    def test_registers_query_with_hash(self):
+        query_hash = persisted_queries.get_hash(self.QUERY)
+        response = self._post(self.QUERY, query_hash)
+        self.assertEqual(response.json()['data'], {'allCategories': {'edges': []}})
+
+        response = self._post(query_hash=query_hash)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], {'allCategories': {'edges': []}})
+
+    def test_rejects_hash_mismatch(self):
+        response = self._post(self.QUERY, persisted_queries.get_hash('{ allTags { edges { node { id } } } }'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._error_code(response), 'INVALID_PERSISTED_QUERY')
+
+    def test_allowlist(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump([self.QUERY], f)
+        self.addCleanup(os.remove, f.name)
+
+        with self.settings(GRAPHQL_PERSISTED_QUERIES=dict(settings.GRAPHQL_PERSISTED_QUERIES,
+                                                          ALLOWLIST_PATH=f.name)):
+            self.assertEqual(self._post(self.QUERY).status_code, 200)
+            response = self._post(query_hash=persisted_queries.get_hash(self.QUERY))
+            self.assertEqual(response.json()['data'], {'allCategories': {'edges': []}})
+
+            response = self._post('{ allTags { edges { node { id } } } }')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self._error_code(response), 'PERSISTED_QUERY_NOT_ALLOWED')
+
+
+class CachedDocumentBackendTests(SimpleTestCase):
+    def test_keeps_recent_documents(self):
+        backend = CachedDocumentBackend(max_size=2)
+        queries = ['{ allTags { totalCount } }', '{ allCategories { totalCount } }',
+                   '{ allNews { totalCount } }']
+        first = backend.document_from_string(schema, queries[0])
+        self.assertIs(backend.document_from_string(schema, queries[0]), first)
+
+        backend.document_from_string(schema, queries[1])
+        backend.document_from_string(schema, queries[2])
+        # 最も長く使われていないものから捨てる
+        self.assertIsNot(backend.document_from_string(schema, queries[0]), first)
+
+    def test_caches_validation_errors(self):
+        backend = CachedDocumentBackend()
+        result = backend.document_from_string(schema, '{ unknownField }').execute()
+        self.assertTrue(result.invalid)
+
+
+class QueryCostTests(TestCase):
+    FAN_OUT_QUERY = ('{ allNews(first: 100) { edges { node { id '
+                     'tags(first: 100) { edges { node { id } } } } } } }')
+
+    def _post(self, query, variables=None):
+        return self.client.post('/graphql/', json.dumps({'query': query, 'variables': variables or {}}),
+                                content_type='application/json')
+
+    def test_multiplies_connection_counts(self):
+        query = ('{ allNews(first: 2) { edges { node { id selectCategory { id } '
+                 'tags(first: 3) { edges { node { id } } } } } } }')
+        # allNews 1 + 2 × (edges 1 + node 1 + selectCategory 1 + tags (1 + 3 × (edges 1 + node 1)))
+        self.assertEqual(complexity.calculate_cost(schema, parse(query)), {'cost': 21, 'depth': 7})
+
+    def test_counts_from_variables_and_defaults(self):
+        query = ('query ($first: Int) { allNews(first: $first) { edges { node { '
+                 'tags { edges { node { id } } } } } } }')
+        # 件数の指定がないtagsは、DEFAULT_COUNTSの10件として数える
+        cost = complexity.calculate_cost(schema, parse(query), {'first': 5})
+        self.assertEqual(cost['cost'], 1 + 5 * (1 + 1 + 1 + 10 * 2))
+
+    def test_accepts_feed_queries(self):
+        for query, variables in ((FEED_FULL_QUERY, {'first': 20}), (TODAY_QUERY, {})):
+            response = self._post(query, variables)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('errors', response.json())
+
+    def test_rejects_nested_fan_out(self):
+        response = self._post(self.FAN_OUT_QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['message'],
+                         'Query cost 20301 exceeds the maximum of %d.' % settings.GRAPHQL_QUERY_COST['MAX_COST'])
+
+    def test_rejects_deep_query(self):
+        with self.settings(GRAPHQL_QUERY_COST=dict(settings.GRAPHQL_QUERY_COST, MAX_DEPTH=4)):
+            self.assertEqual(self._post('{ allNews(first: 1) { edges { node { id } } } }').status_code, 200)
+            response = self._post('{ allNews(first: 1) { edges { node { selectCategory { id } } } } }')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['message'], 'Query depth 5 exceeds the maximum of 4.')
+
+
+class RequestTimingTests(TestCase):
+    QUERY = 'query Feed { allNews(first: 5) { edges { node { url tags { edges { node { tagName } } } } } } }'
+
+    def setUp(self):
+        caches[settings.FEED_CACHE['CACHE_ALIAS']].clear()
+        catalog._catalog = None
+        News.objects.create(url='https://example.com/1', created_at=timezone.now())
+
+    def _post(self, **performance):
+        with self.settings(PERFORMANCE=dict(settings.PERFORMANCE, **performance)):
+            return self.client.post('/graphql/', json.dumps({'query': self.QUERY}),
+                                    content_type='application/json')
+
+    def test_logs_one_line_per_request(self):
+        with self.assertLogs('api.performance', 'INFO') as logs:
+            self._post(ENABLED=True, SLOW_REQUEST_THRESHOLD=0)
+        self.assertEqual(len(logs.records), 1)
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(sorted(data), ['db_ms', 'db_queries', 'method', 'operation', 'path', 'resolvers',
+                                        'status', 'total_ms'])
+        self.assertEqual((data['method'], data['path'], data['status'], data['operation']),
+                         ('POST', '/graphql/', 200, 'Feed'))
+        self.assertGreater(data['db_queries'], 0)
+        # 遅いリクエストでなければ、ルートのフィールドだけ記録する
+        self.assertEqual(list(data['resolvers']), ['allNews'])
+
+    def test_sets_server_timing_header(self):
+        with self.assertLogs('api.performance', 'INFO'):
+            response = self._post(ENABLED=True)
+        metrics = [metric.split(';') for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual([metric[0] for metric in metrics], ['total', 'db', 'allNews'])
+        self.assertRegex(metrics[1][2], r'^desc="[1-9]\d* queries"$')
+        for metric in metrics:
+            self.assertRegex(metric[1], r'^dur=\d+\.\d$')
+
+    def test_logs_resolver_tree_for_slow_request(self):
+        with mock.patch.object(instrumentation.RequestTiming, 'elapsed', new_callable=mock.PropertyMock,
+                               return_value=1.0), \
+                self.assertLogs('api.performance', 'INFO') as logs:
+            self._post(ENABLED=True, SLOW_REQUEST_THRESHOLD=500)
+        self.assertEqual(logs.records[1].levelname, 'WARNING')
+        data = json.loads(logs.records[1].getMessage().partition(': ')[2])
+        self.assertIn('allNews.edges.0.node.tags', [node['path'] for node in data['resolver_tree']])
+
+    def test_disabled(self):
+        with mock.patch.object(instrumentation.logger, 'info') as log:
+            response = self._post(ENABLED=False)
+        log.assert_not_called()
+        self.assertNotIn('Server-Timing', response)
+
+
+class CanonicalizeUrlTests(SimpleTestCase):
+    def test_keeps_query_encoding(self):
+        url = 'https://news.example.jp/記事?q=日本語のニュース&utm_source=x&page=2'
+        self.assertEqual(canonicalize_url(url), 'https://news.example.jp/記事?page=2&q=日本語のニュース')
+        url = 'https://www.example.jp/search?q=%E8%A8%98%E4%BA%8B'
+        self.assertEqual(canonicalize_url(url), 'https://example.jp/search?q=%E8%A8%98%E4%BA%8B')
+
+    def test_accepts_any_valid_port_and_ipv6(self):
+        self.assertEqual(canonicalize_url('http://example.com:99999/a/'), 'https://example.com:99999/a')
+        self.assertEqual(canonicalize_url('http://[::1]:8000/a?amp=1'), 'https://[::1]:8000/a')
+        self.assertEqual(canonicalize_url('https://example.com:443/a'), 'https://example.com/a')
+
+
+class FeedCacheTtlTests(SimpleTestCase):
+    def _timeout(self):
+        document = parse('{ specificDayNews(year: 2021, month: 8, day: 2) { totalCount } }')
+        return feed_cache.make_key(document, {}, None)[1]
+
+    @override_settings(CACHES={'feed': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_uses_short_ttl(self):
+        # 他のワーカーの無効化が届かないため、過去の日付も短い有効期限にする
+        self.assertEqual(self._timeout(), settings.FEED_CACHE['TTL'])
+
+    @override_settings(CACHES={'feed': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                        'LOCATION': os.path.join(tempfile.gettempdir(), 'feed-cache-test')}})
+    def test_shared_cache_uses_historical_ttl(self):
+        self.assertEqual(self._timeout(), settings.FEED_CACHE['HISTORICAL_TTL'])
+
+
+class FeedCacheInvalidationTests(TestCase):
+    TODAY_QUERY = '{ todayNews { edges { node { url } } } }'
+
+    def setUp(self):
+        caches[settings.FEED_CACHE['CACHE_ALIAS']].clear()
+        signals._get_pending_days().clear()
+        self.noon = timezone.make_aware(datetime.datetime.combine(timezone.localdate(), datetime.time(12)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.news = News.objects.create(url='https://example.com/1', created_at=self.noon)
+
+    def _post(self, query):
+        response = self.client.post('/graphql/', json.dumps({'query': query}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _today_urls(self):
+        result = self._post(self.TODAY_QUERY)
+        return {edge['node']['url'] for edge in result['data']['todayNews']['edges']}
+
+    def test_serves_cached_result(self):
+        self.assertEqual(self._today_urls(), {'https://example.com/1'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self._today_urls(), {'https://example.com/1'})
+
+    def test_create_invalidates_day(self):
+        self.assertEqual(self._today_urls(), {'https://example.com/1'})
+        with mock.patch('api.workers.enqueue'), self.captureOnCommitCallbacks(execute=True):
+            result = self._post('mutation { createNews(input: {url: "https://example.com/2", '
+                                'createdAt: %d}) { news { url } } }' % self.noon.timestamp())
+        self.assertNotIn('errors', result)
+        self.assertEqual(self._today_urls(), {'https://example.com/1', 'https://example.com/2'})
+
+    def test_update_moves_news_out_of_day(self):
+        self.assertEqual(self._today_urls(), {'https://example.com/1'})
+        tomorrow = self.noon + datetime.timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self._post('mutation { updateNews(input: {id: "%s", createdAt: %d}) '
+                                '{ news { url } } }' % (to_global_id('NewsNode', self.news.pk),
+                                                        tomorrow.timestamp()))
+        self.assertNotIn('errors', result)
+        self.assertEqual(self._today_urls(), set())
+
+    def test_delete_invalidates_day(self):
+        self.assertEqual(self._today_urls(), {'https://example.com/1'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.news.delete()
+        self.assertEqual(self._today_urls(), set())
+
+
+@override_settings(CACHES={'jwt_users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                         'LOCATION': 'jwt-users-test'}})
+class JwtUserCacheTests(TestCase):
+    def test_caches_only_pk_and_is_active(self):
+        user = User.objects.create_user('user@example.com', 'password')
+        jwt_users.get_user_by_natural_key('user@example.com')
+        entry = caches['jwt_users'].get(jwt_users._make_key('user@example.com'),
+                                        version=jwt_users.ENTRY_VERSION)
+        self.assertEqual(entry, {'pk': user.pk, 'is_active': True})
+
+        with self.assertNumQueries(0):
+            cached = jwt_users.get_user_by_natural_key('user@example.com')
+        self.assertEqual((cached.pk, cached.email, cached.is_active), (user.pk, user.email, True))
+        # キャッシュしていないフィールドは、データベースから読む
+        self.assertTrue(cached.check_password('password'))
+
+    def test_deactivated_user_is_invalidated(self):
+        user = User.objects.create_user('user@example.com', 'password')
+        jwt_users.get_user_by_natural_key('user@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_active = False
+            user.save()
+        self.assertFalse(jwt_users.get_user_by_natural_key('user@example.com').is_active)
+
+
+class ClientIpTests(SimpleTestCase):
+    def _request(self):
+        # Herokuのルーターは、クライアントのアドレスをX-Forwarded-Forの末尾に追加する
+        return RequestFactory().get('/', REMOTE_ADDR='10.1.2.3',
+                                    HTTP_X_FORWARDED_FOR='1.1.1.1, 203.0.113.5')
+
+    def test_uses_address_added_by_trusted_proxy(self):
+        with self.settings(RATE_LIMIT=dict(settings.RATE_LIMIT, PROXY_COUNT=1)):
+            self.assertEqual(ratelimit.get_client_ip(self._request()), '203.0.113.5')
+
+    def test_uses_remote_addr_without_proxy(self):
+        with self.settings(RATE_LIMIT=dict(settings.RATE_LIMIT, PROXY_COUNT=0)):
+            self.assertEqual(ratelimit.get_client_ip(self._request()), '10.1.2.3')
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        caches[settings.RATE_LIMIT['CACHE_ALIAS']].clear()
+
+    def test_exhausts_bucket_and_returns_retry_after(self):
+        self.assertEqual([ratelimit.take('k', '3/m', now=100) for _ in range(3)], [0, 0, 0])
+        # 1分に3つ補充されるため、次の1つは20秒後
+        self.assertAlmostEqual(ratelimit.take('k', '3/m', now=100), 20)
+        self.assertAlmostEqual(ratelimit.take('k', '3/m', now=110), 10)
+
+    def test_refills_over_time_up_to_capacity(self):
+        for _ in range(2):
+            ratelimit.take('k', '2/s', now=100)
+        self.assertAlmostEqual(ratelimit.take('k', '2/s', now=100), 0.5)
+        self.assertEqual(ratelimit.take('k', '2/s', now=100.5), 0)
+        self.assertGreater(ratelimit.take('k', '2/s', now=100.5), 0)
+        # 長く空いても、容量（2つ）より多くは貯まらない
+        self.assertEqual([ratelimit.take('k', '2/s', now=200) for _ in range(3)][-1], 0.5)
+
+    def test_keys_are_independent(self):
+        ratelimit.take('a', '1/h', now=100)
+        self.assertGreater(ratelimit.take('a', '1/h', now=100), 0)
+        self.assertEqual(ratelimit.take('b', '1/h', now=100), 0)
+
+    def test_threads_in_a_worker_do_not_exceed_rate(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ratelimit.take('k', '5/m', now=100)))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(0), 5)
+
+    def test_workers_sharing_cache_may_exceed_rate(self):
+        # 読み書きはワーカー内のロックでしか守られないため、別のワーカーが書き込む前の状態を読むと、
+        # どちらも取り出せてしまう（おおよその制限になる）
+        cache = caches[settings.RATE_LIMIT['CACHE_ALIAS']]
+        with mock.patch.object(cache, 'get', return_value=None):
+            self.assertEqual([ratelimit.take('k', '1/h', now=100) for _ in range(2)], [0, 0])
+
+
+class RateLimitMiddlewareTests(TestCase):
+    MUTATION = 'mutation { createNews(input: {url: "%s", createdAt: 1627873200}) { news { url } } }'
+
+    def setUp(self):
+        caches[settings.RATE_LIMIT['CACHE_ALIAS']].clear()
+        self.user = User.objects.create_user('user@example.com', 'password')
+
+    def _create_news(self, url, **extra):
+        with mock.patch('api.workers.enqueue'), \
+                self.settings(RATE_LIMIT=dict(settings.RATE_LIMIT, ENABLED=True, PROXY_COUNT=0,
+                                              RATES=dict(settings.RATE_LIMIT['RATES'], createNews='1/m'))):
+            response = self.client.post('/graphql/', json.dumps({'query': self.MUTATION % url}),
+                                        content_type='application/json', **extra)
+        return response.json()
+
+    def test_rejects_mutation_without_running_it(self):
+        self.assertNotIn('errors', self._create_news('https://example.com/1', REMOTE_ADDR='10.0.0.1'))
+        result = self._create_news('https://example.com/2', REMOTE_ADDR='10.0.0.1')
+        self.assertIsNone(result['data']['createNews'])
+        self.assertEqual(result['errors'][0]['extensions'], {'code': 'RATE_LIMITED', 'retryAfter': 60})
+        self.assertFalse(News.objects.filter(url='https://example.com/2').exists())
+
+    def test_limits_anonymous_clients_per_ip(self):
+        self._create_news('https://example.com/1', REMOTE_ADDR='10.0.0.1')
+        self.assertNotIn('errors', self._create_news('https://example.com/2', REMOTE_ADDR='10.0.0.2'))
+
+    def test_limits_logged_in_users_per_user(self):
+        headers = {'HTTP_AUTHORIZATION': 'JWT ' + get_token(self.user)}
+        self.assertNotIn('errors', self._create_news('https://example.com/1', REMOTE_ADDR='10.0.0.1', **headers))
+        # 同じIPアドレスでも、ログインしていなければ別に数える
+        self.assertNotIn('errors', self._create_news('https://example.com/2', REMOTE_ADDR='10.0.0.1'))
+        # 別のIPアドレスからでも、同じユーザーなら同じ制限を使う
+        result = self._create_news('https://example.com/3', REMOTE_ADDR='10.0.0.2', **headers)
+        self.assertEqual(result['errors'][0]['extensions']['code'], 'RATE_LIMITED')
+
+
+class DigestRefreshTests(TestCase):
+    def setUp(self):
+        # TestCaseはコミットしないため、他のテストで変更された日付が残っている
+        signals._get_pending_days().clear()
+
+    def test_refreshes_each_day_once_per_transaction(self):
+        day = datetime.date(2021, 8, 2)
+        for i in range(10):
+            News.objects.create(url='https://example.com/%d' % i,
+                                created_at=datetime.datetime(2021, 8, 2, i, tzinfo=TOKYO))
+
+        with mock.patch.object(digest, 'refresh_days') as refresh_days:
+            with self.captureOnCommitCallbacks(execute=True):
+                News.objects.all().delete()
+        refresh_days.assert_called_once_with([day])
+
+
+class BulkCreateNewsTests(TestCase):
+    MUTATION = '''
+    mutation ($news: [NewsInput!]!) {
+      bulkCreateNews(input: {news: $news}) { results { url error news { url } } }
+    }'''
+
+    def setUp(self):
+        caches[settings.RATE_LIMIT['CACHE_ALIAS']].clear()
+        signals._get_pending_days().clear()
+        self.tag = Tag.objects.create(tag_name='python')
+        News.objects.create(url='https://example.com/existing', created_at=timezone.now())
+
+    def _post(self, news):
+        with mock.patch('api.workers.enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/graphql/', json.dumps({'query': self.MUTATION,
+                                                                 'variables': {'news': news}}),
+                                        content_type='application/json')
+        return response.json(), enqueue
+
+    def test_reports_errors_per_item(self):
+        created_at = int(timezone.now().timestamp())
+        result, enqueue = self._post([
+            {'url': 'https://example.com/1', 'createdAt': created_at, 'tagIds': [str(self.tag.pk)]},
+            {'url': 'https://EXAMPLE.com/existing', 'createdAt': created_at},
+            {'url': 'https://example.com/2', 'createdAt': created_at, 'tagIds': ['0']},
+        ])
+        results = result['data']['bulkCreateNews']['results']
+        self.assertEqual([(item['url'], item['error']) for item in results], [
+            ('https://example.com/1', None),
+            ('https://EXAMPLE.com/existing', 'already exists'),
+            ('https://example.com/2', 'tags do not exist: 0'),
+        ])
+        news = News.objects.get(url='https://example.com/1')
+        self.assertEqual(list(news.tags.all()), [self.tag])
+        enqueue.assert_called_once_with(news.id)
+
+    def test_limits_items(self):
+        with self.settings(BULK_CREATE_NEWS={'MAX_ITEMS': 1}):
+            result, _ = self._post([{'url': 'https://example.com/%d' % i, 'createdAt': 0} for i in range(2)])
+        self.assertEqual(result['errors'][0]['message'], 'Too many news: 2 (max 1).')
+        self.assertFalse(News.objects.filter(url__startswith='https://example.com/0').exists())
+
+    def test_falls_back_to_single_inserts_on_conflict(self):
+        # 重複の確認の後に、他のリクエストが同じURLを登録した場合を再現する
+        News.objects.filter(url='https://example.com/existing').update(normalized_url='')
+        created_at = timezone.now()
+        results = importer.import_news([{'url': 'https://example.com/existing', 'created_at': created_at},
+                                        {'url': 'https://example.com/1', 'created_at': created_at}])
+        self.assertEqual([result['error'] for result in results], ['already exists', None])
+        self.assertEqual(News.objects.get(url='https://example.com/1'), results[1]['news'])
+
+    def test_import_news_command(self):
+        rows = [{'url': 'https://example.com/1', 'category': '技術', 'tags': ['python', 'django'],
+                 'created_at': '2021-08-02T10:00:00+09:00'},
+                {'url': 'https://example.com/existing'}]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+            f.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        self.addCleanup(os.remove, f.name)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_news', f.name, '--skip-metadata', stdout=stdout, stderr=stderr)
+        self.assertIn('1件のニュースを登録しました（失敗: 1件）', stdout.getvalue())
+        self.assertIn('https://example.com/existing: already exists', stderr.getvalue())
+        news = News.objects.get(url='https://example.com/1')
+        self.assertEqual(news.select_category.category_name, '技術')
+        self.assertEqual(sorted(tag.tag_name for tag in news.tags.all()), ['django', 'python'])
+        self.assertEqual(news.created_at, datetime.datetime(2021, 8, 2, 10, tzinfo=TOKYO))
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    # /trickle は本文を0.05秒ごとに1バイトずつ送り、/gzip は求められなくても圧縮して返す
+    body = b'<html><head><title>x</title></head></html>'
+
+    def do_GET(self):
+        body = gzip.compress(self.body) if self.path == '/gzip' else self.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/gzip':
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        try:
+            if self.path != '/trickle':
+                self.wfile.write(body)
+                return
+            for byte in body:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def _read(self, path, timeout=None):
+        with http_client.open_url(self.base_url + path, http_client.HTML_CONTENT_TYPES, timeout) as response:
+            return b''.join(http_client.iter_content(response, 16 * 1024))
+
+    def test_reads_body(self):
+        self.assertEqual(self._read('/'), _SlowHandler.body)
+
+    def test_decodes_compressed_body(self):
+        self.assertEqual(self._read('/gzip'), _SlowHandler.body)
+
+    def test_deadline_stops_trickling_body(self):
+        # 1バイトずつでも受信は続くため、受信のタイムアウトだけでは打ち切れない
+        started_at = time.monotonic()
+        with self.assertRaises(http_client.DeadlineExceeded):
+            self._read('/trickle', timeout=0.5)
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    def _with_deadline(self, seconds):
+        token = http_client._deadline.set(time.monotonic() + seconds)
+        self.addCleanup(http_client._deadline.reset, token)
+
+    def test_jitter_backoff_within_deadline(self):
+        retry = http_client.JitterRetry(total=3, backoff_factor=1)
+        with mock.patch('urllib3.util.retry.Retry.get_backoff_time', return_value=4):
+            self.assertTrue(all(0 <= retry.get_backoff_time() <= 4 for _ in range(20)))
+            self._with_deadline(1)
+            self.assertTrue(all(retry.get_backoff_time() <= 1 for _ in range(20)))
+
+    def test_caps_retry_after(self):
+        retry = http_client.JitterRetry(total=3)
+        response = HTTPResponse(headers={'Retry-After': '120'})
+        with self.settings(NEWS_METADATA=dict(settings.NEWS_METADATA, RETRY_AFTER_MAX=5)):
+            self.assertEqual(retry.get_retry_after(response), 5)
+
+    def test_stops_retrying_after_deadline(self):
+        retry = http_client.JitterRetry(total=3)
+        self.assertFalse(retry.is_exhausted())
+        self._with_deadline(-1)
+        self.assertTrue(retry.is_exhausted())
+
+    def test_keeps_stats_for_recent_hosts(self):
+        with mock.patch.object(http_client, '_stats', type(http_client._stats)()), \
+                mock.patch.object(http_client, 'STATS_MAX_HOSTS', 2):
+            for host in ('a.example.com', 'b.example.com', 'a.example.com', 'c.example.com'):
+                http_client._record('https://%s/' % host, 0.1, False)
+            self.assertEqual(sorted(http_client.get_stats()), ['a.example.com', 'c.example.com'])
+
+
+class MetadataCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches[settings.NEWS_METADATA['CACHE_ALIAS']]
+        self.cache.clear()
+
+    def _stats_delta(self, before):
+        after = metadata_cache.get_stats()
+        return {name: after[name] - before[name] for name in after}
+
+    def test_keys_by_normalized_url(self):
+        metadata_cache.set('https://Example.com/a?id=1&utm_source=feed#top', {'title': 'a'})
+        self.assertEqual(metadata_cache.get('https://example.com/a?id=1')['title'], 'a')
+        self.assertIsNone(metadata_cache.get('https://example.com/a?id=2'))
+        self.assertIsNone(metadata_cache.get('http://example.com/a?id=1'))
+
+    def test_counts_hits_negative_hits_and_misses(self):
+        before = metadata_cache.get_stats()
+        metadata_cache.get('https://example.com/a')
+        metadata_cache.set('https://example.com/a', {'title': 'a'})
+        metadata_cache.get('https://example.com/a')
+        metadata_cache.get('https://example.com/a')
+        metadata_cache.set_failed('https://example.com/b')
+        metadata_cache.get('https://example.com/b')
+        self.assertEqual(self._stats_delta(before), {'hits': 2, 'negative_hits': 1, 'misses': 1})
+
+    def test_uses_ttl_for_each_kind(self):
+        with mock.patch.object(self.cache, 'set') as cache_set:
+            metadata_cache.set('https://example.com/a', {'title': 'a'})
+            metadata_cache.set_failed('https://example.com/b')
+        self.assertEqual([call.args[2] for call in cache_set.call_args_list],
+                         [settings.NEWS_METADATA['CACHE_TTL'], settings.NEWS_METADATA['NEGATIVE_CACHE_TTL']])
+
+    def test_fetches_each_url_once(self):
+        with mock.patch.object(scraper, '_fetch', return_value={'title': 'a'}) as fetch:
+            scraper.fetch_metadata('https://example.com/a?utm_medium=social')
+            metadata = scraper.fetch_metadata('https://example.com/a')
+        fetch.assert_called_once_with('https://example.com/a?utm_medium=social')
+        self.assertEqual(metadata['title'], 'a')
+
+    def test_remembers_failed_fetch(self):
+        # 落ちているサイトには、NEGATIVE_CACHE_TTLの間は取得しに行かない
+        with mock.patch.object(scraper, '_fetch', side_effect=requests.ConnectionError) as fetch:
+            with self.assertRaises(requests.ConnectionError):
+                scraper.fetch_metadata('https://example.com/down')
+            with self.assertRaises(scraper.MetadataUnavailable):
+                scraper.fetch_metadata('https://example.com/down#retry')
+        fetch.assert_called_once_with('https://example.com/down')
+
+        # 期限が切れたら取得し直す
+        self.cache.clear()
+        with mock.patch.object(scraper, '_fetch', return_value={'title': 'up'}) as fetch:
+            self.assertEqual(scraper.fetch_metadata('https://example.com/down')['title'], 'up')
+        fetch.assert_called_once_with('https://example.com/down')
+
+
+class ExtractMetadataTests(SimpleTestCase):
+    def _extract(self, name, chunk_size=512):
+        with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+            data = f.read()
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        return ogp.extract_metadata(chunks, content_type='text/html')
+
+    def test_guesses_undeclared_charset(self):
+        metadata = self._extract('undeclared_shift_jis.html')
+        self.assertEqual(metadata['title'], '地域のニュースのまとめ')
+        self.assertEqual(metadata['summary'], '今週の地域のニュースから、注目の記事を選んで紹介します。')
+
+    def test_finds_charset_after_long_script(self):
+        # <meta charset>が先頭の2KBより後にある
+        metadata = self._extract('meta_after_script_utf8.html')
+        self.assertEqual(metadata['title'], 'セキュリティの更新')
+
+    def test_twitter_and_canonical_fallbacks(self):
+        metadata = self._extract('twitter_canonical_euc_jp.html')
+        self.assertEqual(metadata['title'], 'GraphQLの入門記事')
+        self.assertEqual(metadata['url'], 'https://blog.example.jp/entry/graphql')
+
+
+class ResizeTests(SimpleTestCase):
+    def test_does_not_upscale(self):
+        resized = thumbnails.resize(make_image(400, 200, 'PNG', 0), [160, 320, 640], 'jpeg', 80)
+        self.assertEqual([(width, height) for width, height, _ in resized],
+                         [(160, 80), (320, 160), (400, 200)])
+
+    def test_runs_in_process_pool(self):
+        # THUMBNAIL_POOL=processでは、引数と結果をプロセス間で受け渡す
+        args = (make_image(400, 200, 'JPEG', 1), [160], 'jpeg', 80, None)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            resized = pool.submit(thumbnails.resize, *args).result()
+        self.assertEqual(resized[0][:2], (160, 80))
+
+
+# ワーカーのスレッドから読み書きするため、コミットするTransactionTestCaseを使う
+class NewsWorkerTests(TransactionTestCase):
+    def _create_news(self, **kwargs):
+        kwargs.setdefault('metadata_status', News.MetadataStatus.PENDING)
+        return News.objects.create(url='https://example.com/%d' % News.objects.count(),
+                                   created_at=timezone.now(), **kwargs)
+
+    def test_saves_metadata(self):
+        news = self._create_news()
+        with mock.patch('api.workers.fetch_metadata', return_value={'title': 'タイトル'}):
+            asyncio.run(workers.enrich_news(news.id))
+        news.refresh_from_db()
+        self.assertEqual((news.metadata_status, news.title), (News.MetadataStatus.DONE, 'タイトル'))
+
+    def test_marks_fetch_failures(self):
+        news = self._create_news()
+        with mock.patch('api.workers.fetch_metadata', side_effect=OSError), \
+                self.assertLogs('api.workers', 'WARNING'):
+            asyncio.run(workers.enrich_news(news.id))
+        news.refresh_from_db()
+        self.assertEqual(news.metadata_status, News.MetadataStatus.FAILED)
+
+    def test_limits_and_releases_host_slots(self):
+        running = []
+        max_running = []
+
+        async def fetch(url):
+            async with workers._host_slot(url):
+                running.append(url)
+                max_running.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(url)
+
+        async def fetch_all():
+            await asyncio.gather(*(fetch('https://example.com/%d' % i) for i in range(3)),
+                                 fetch('https://example.org/'))
+
+        with self.settings(NEWS_METADATA=dict(settings.NEWS_METADATA, PER_HOST_LIMIT=1)):
+            asyncio.run(fetch_all())
+        # 別のサイトの1件だけが同時に動く
+        self.assertEqual(max(max_running), 2)
+        # 使い終わったサイトの枠は残さない（バックグラウンドで動いている他のテストの取得は除く）
+        self.assertEqual([host for _, host in workers._host_semaphores
+                          if host in ('example.com', 'example.org')], [])
+
+    def test_logs_failures_in_background(self):
+        news = self._create_news()
+        with mock.patch('api.workers.fetch_metadata', return_value={}), \
+                mock.patch('api.workers._save_metadata', side_effect=DatabaseError('deleted')), \
+                self.assertLogs('api.workers', 'ERROR') as logs:
+            future = workers.enqueue(news.id)
+            self.assertIsInstance(future.exception(timeout=5), DatabaseError)
+            # コールバックは結果を待つスレッドとは別に呼ばれる
+            for _ in range(100):
+                if logs.records:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(logs.records[0].getMessage(), 'failed to enrich news %d' % news.id)
+
+    def test_claims_stale_pending_news_once(self):
+        stale = self._create_news()
+        self._create_news()
+        done = self._create_news(metadata_status=News.MetadataStatus.DONE)
+        News.objects.filter(id__in=[stale.id, done.id]).update(
+            metadata_requested_at=timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertEqual(News.objects.claim_stale_pending(600), [stale.id])
+        # 他のワーカーは、取得し直すものとして受け取らない
+        self.assertEqual(News.objects.claim_stale_pending(600), [])
+
+
+class NewsEventsTests(SimpleTestCase):
+    def setUp(self):
+        news_events._backend = news_events._broadcaster = None
+        self.addCleanup(setattr, news_events, '_backend', None)
+        self.addCleanup(setattr, news_events, '_broadcaster', None)
+
+    def _publish(self, count):
+        for i in range(count):
+            news_events.publish('created', {'id': str(i)})
+        return [event['id'] for event in news_events._broadcaster._history]
+
+    def test_publishes_to_subscribers(self):
+        async def subscribe_and_publish():
+            subscription, missed = news_events.subscribe()
+            news_events.publish('created', {'id': 'a'})
+            return missed, await asyncio.wait_for(subscription.get(), 1)
+
+        missed, event = asyncio.run(subscribe_and_publish())
+        self.assertEqual(missed, [])
+        self.assertEqual((event['type'], event['data']), ('created', {'id': 'a'}))
+
+    def test_replays_events_after_last_event_id(self):
+        event_ids = self._publish(3)
+        self.assertEqual(event_ids, sorted(set(event_ids)))
+
+        async def subscribe():
+            return news_events.subscribe(event_ids[0])[1]
+
+        missed = asyncio.run(subscribe())
+        self.assertEqual([(event['id'], event['data']) for event in missed],
+                         [(event_ids[1], {'id': '1'}), (event_ids[2], {'id': '2'})])
+
+    def test_resets_when_history_is_gone(self):
+        with self.settings(NEWS_EVENTS=dict(settings.NEWS_EVENTS, HISTORY_SIZE=2)):
+            first_id = self._publish(2)[0]
+            event_ids = self._publish(2)
+
+        async def subscribe(last_event_id):
+            return news_events.subscribe(last_event_id)[1]
+
+        missed = asyncio.run(subscribe(first_id))
+        self.assertEqual([event['type'] for event in missed], ['reset'])
+        # resetのIDから再開すると、残っているイベントを受け取れる
+        missed = asyncio.run(subscribe(missed[0]['id']))
+        self.assertEqual([event['id'] for event in missed], event_ids)
+
+    def test_stream_resumes_from_last_event_id(self):
+        event_ids = self._publish(2)
+        sent = []
+
+        async def stream():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message.get('body'):
+                    disconnect.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'query_string': b'',
+                     'headers': [(b'last-event-id', str(event_ids[0]).encode())]}
+            await asyncio.wait_for(news_events_app(scope, receive, send), 1)
+
+        asyncio.run(stream())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[1]['body'].decode(),
+                         'retry: %d\n\nid: %d\nevent: created\ndata: {"id":"1"}\n\n' % (
+                             settings.NEWS_EVENTS['RETRY'], event_ids[1]))
+
+
+# 通知はコミットしないと届かないため、TransactionTestCaseを使う
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQLのLISTEN/NOTIFYを使う')
+class PostgresNewsEventsTests(TransactionTestCase):
+    def test_processes_share_event_ids(self):
+        options = dict(settings.NEWS_EVENTS)
+        broadcaster = mock.Mock()
+        listener, last_id = news_events.PostgresBackend(broadcaster, options)._connect()
+        self.addCleanup(listener.close)
+
+        # 別々のプロセスのバックエンドから送っても、IDは続き番号で、届く順もIDの順になる
+        for backend in (news_events.PostgresBackend(broadcaster, options),
+                        news_events.PostgresBackend(broadcaster, options)):
+            backend.publish('created', {'id': 'a'})
+        time.sleep(0.1)
+        listener.poll()
+        self.assertEqual([json.loads(notify.payload)['id'] for notify in listener.notifies],
+                         [last_id + 1, last_id + 2])
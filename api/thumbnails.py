@@ -0,0 +1,84 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from . import http_client
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+}
+
+
+def get_format():
+    # PillowがWebPなしでビルドされている場合はJPEGにする
+    name = settings.THUMBNAILS['FORMAT']
+    if name == 'webp' and not features.check('webp'):
+        name = 'jpeg'
+    return name
+
+
+def _to_rgb(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # 透過部分は白にする
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+class ImageTooLarge(Exception):
+    """画素数が上限を超える画像"""
+
+
+def resize(data, widths, format_name, quality, max_pixels=None):
+    """画像を指定された幅に縮小し、(幅, 高さ, バイト列)のリストを返す
+
+    元の画像より大きい幅には拡大せず、元の幅のものを1つだけ作る。
+    """
+    pillow_format, _, options = FORMATS[format_name]
+    image = Image.open(io.BytesIO(data))
+    if max_pixels is not None and image.width * image.height > max_pixels:
+        raise ImageTooLarge('%dx%d' % image.size)
+    # JPEGは必要な大きさまで縮小しながら読み込む（EXIFで回転しても足りるよう縦横とも確保する）
+    image.draft('RGB', (max(widths), max(widths)))
+    image = _to_rgb(ImageOps.exif_transpose(image))
+
+    thumbnails = []
+    for width in sorted(set(min(width, image.width) for width in widths)):
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+        output = io.BytesIO()
+        resized.save(output, pillow_format, quality=quality, **options)
+        thumbnails.append((width, height, output.getvalue()))
+    return thumbnails
+
+
+def fetch_image(image_url):
+    with http_client.open_url(image_url, http_client.IMAGE_CONTENT_TYPES) as response:
+        return http_client.read_limited(response, settings.THUMBNAILS['MAX_BYTES'])
+
+
+def get_resize_args(data):
+    """設定に合わせたresizeの引数（プロセスプールにも渡せるよう、設定は読み出しておく）"""
+    options = settings.THUMBNAILS
+    return (data, options['WIDTHS'], get_format(), options['QUALITY'], options['MAX_PIXELS'])
+
+
+def save_thumbnails(image_url, format_name, resized):
+    """resizeで作ったサムネイルをストレージに保存し、保存したものの一覧を返す"""
+    extension = FORMATS[format_name][1]
+    # 同じ画像を使うニュースではサムネイルを共有する
+    digest = hashlib.sha256(image_url.encode('utf-8')).hexdigest()[:32]
+    thumbnails = []
+    for width, height, content in resized:
+        name = 'thumbnails/%s/%d.%s' % (digest, width, extension)
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(content))
+        thumbnails.append({'name': name, 'width': width, 'height': height, 'format': format_name})
+    return thumbnails
@@ -0,0 +1,84 @@
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+# 記事の内容に関係しないトラッキング用のクエリパラメータ
+TRACKING_PARAM_PREFIXES = ('utm_',)
+TRACKING_PARAMS = {'fbclid', 'gclid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+                   'ref', 'ref_src', 'ref_url'}
+# AMP版のページを示すクエリパラメータ
+AMP_PARAMS = {'amp', 'outputtype'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def is_tracking_param(key):
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PARAM_PREFIXES)
+
+
+def _split_netloc(parts):
+    """ホスト名（IPv6アドレスは[]で囲む）と、ポート番号の文字列を返す
+
+    SplitResult.portと違い、範囲外のポート番号でもValueErrorを送出しない。
+    """
+    host = parts.hostname or ''
+    if ':' in host:
+        host = '[%s]' % host
+    hostport = parts.netloc.rpartition('@')[2]
+    if hostport.startswith('['):
+        hostport = hostport.rpartition(']')[2]
+    port = hostport.partition(':')[2]
+    return host, str(int(port)) if port.isdigit() else port
+
+
+def _split_query(query):
+    """クエリ文字列を、(デコードしたキー, エンコードされたままの項目)のリストにする
+
+    デコードして組み立て直すと、日本語などが長いパーセントエンコードになるため、項目はそのまま使う。
+    """
+    return [(unquote_plus(item.partition('=')[0]), item) for item in query.split('&') if item]
+
+
+def normalize_url(url):
+    """トラッキングパラメータやフラグメントを除き、同じ記事のURLを同じ文字列にそろえる"""
+    parts = urlsplit(url.strip())
+    host, port = _split_netloc(parts)
+    netloc = host + ':' + port if port else host
+    query = '&'.join(item for key, item in _split_query(parts.query) if not is_tracking_param(key))
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', query, ''))
+
+
+def _strip_amp_path(path):
+    segments = [segment for segment in path.split('/') if segment]
+    if segments and segments[-1].lower() == 'amp':
+        segments = segments[:-1]
+    elif segments and segments[0].lower() == 'amp':
+        segments = segments[1:]
+    return '/' + '/'.join(segments)
+
+
+def canonicalize_url(url):
+    """重複の判定に使う、同じ記事のURLを同じ文字列にそろえたもの
+
+    normalize_urlに加えて、http/https、www.やamp.のホスト、AMP版のパス、末尾のスラッシュ、
+    クエリパラメータの順番の違いを無視する。実際にアクセスするURLではない。
+    """
+    parts = urlsplit(normalize_url(url))
+    host, port = _split_netloc(parts)
+    for prefix in ('www.', 'amp.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if port and port != str(DEFAULT_PORTS.get(parts.scheme)):
+        host += ':' + port
+    query = '&'.join(sorted(item for key, item in _split_query(parts.query)
+                            if key.lower() not in AMP_PARAMS))
+    return urlunsplit(('https', host, _strip_amp_path(parts.path), query, ''))
+
+
+def get_duplicate_key(url):
+    """ニュースの重複の判定に保存する文字列
+
+    canonicalize_urlで正規化できないURLは、保存できるよう前後の空白を除いたそのままのURLにする。
+    """
+    try:
+        return canonicalize_url(url)
+    except ValueError:
+        return url.strip()
@@ -1,3 +1,79 @@
-from django.shortcuts import render
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import close_old_connections
+from django.http import JsonResponse
+from graphene_file_upload.django import FileUploadGraphQLView
+
+from . import db_connections, feed_cache, metadata_cache, news_events, persisted_queries
+
+
+class NewsGraphQLView(FileUploadGraphQLView):
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        query = persisted_queries.resolve_query(request, data, query)
+        return query, variables, operation_name, id
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name,
+                                show_graphiql=False):
+        result = super().execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql)
+        request._graphql_extensions = result.extensions if result is not None else None
+        return result
+
+    @staticmethod
+    def format_error(error):
+        if isinstance(error, persisted_queries.PersistedQueryError):
+            return {'message': error.message, 'extensions': {'code': error.code}}
+        return FileUploadGraphQLView.format_error(error)
+
+    def json_encode(self, request, d, pretty=False):
+        # 見積もったコストなどを、レスポンスのextensionsに含める
+        extensions = getattr(request, '_graphql_extensions', None)
+        if extensions and ('data' in d or 'errors' in d):
+            d = dict(d, extensions=extensions)
+        return super().json_encode(request, d, pretty)
+
+
+def as_async_view(view, max_threads):
+    """同期のビューを、スレッド数に上限のあるスレッドプールで実行する非同期ビューにする
+
+    graphene 2のクエリ実行とORMは同期処理のため、ASGIではイベントループを止めないよう
+    別スレッドで実行する。
+    """
+    executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='graphql')
+
+    def run_view(request, *args, **kwargs):
+        # このスレッドの接続はrequest_started・request_finishedでは整理されないため、ここで行う
+        close_old_connections()
+        db_connections.check_connections()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+            db_connections.mark_connections_used()
+
+    run_view = sync_to_async(run_view, thread_sensitive=False, executor=executor)
+
+    async def async_view(request, *args, **kwargs):
+        return await run_view(request, *args, **kwargs)
+
+    async_view.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return async_view
+
+
+@staff_member_required
+def stats(request):
+    """このワーカープロセスのDB接続・キャッシュ・外部HTTP・イベント配信の統計を返す"""
+    # requestsを起動時に読み込まないよう、ここでimportする
+    from . import http_client
+    return JsonResponse({
+        'pid': os.getpid(),
+        'db_connections': db_connections.get_stats(),
+        'feed_cache': feed_cache.get_stats(),
+        'metadata_cache': metadata_cache.get_stats(),
+        'http': http_client.get_stats(),
+        'news_events': news_events.get_stats(),
+    })
@@ -0,0 +1,49 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from graphql.utils.introspection_query import introspection_query
+
+logger = logging.getLogger(__name__)
+
+
+def get_queries():
+    options = settings.GRAPHQL_WARM_UP
+    path = options['QUERIES_PATH'] or settings.GRAPHQL_PERSISTED_QUERIES['ALLOWLIST_PATH']
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def warm_up():
+    """最初のリクエストの前に、URLとスキーマの読み込み、イントロスペクション、
+    よく使うクエリのパース・検証を済ませる
+
+    gunicornのpreload_appでは、フォーク前のマスタープロセスで1回だけ呼ばれる。
+    """
+    started_at = time.perf_counter()
+    # URLの読み込みでスキーマが作られる
+    get_resolver().url_patterns
+    from project.schema import schema
+    from project.urls import graphql_backend
+
+    # スキーマ全体をたどり、GraphiQLなどが送るイントロスペクションもキャッシュしておく
+    result = graphql_backend.document_from_string(schema, introspection_query).execute()
+    if result.errors:
+        logger.warning('introspection failed during warm-up: %s', result.errors)
+
+    queries = get_queries()
+    for query in queries:
+        try:
+            graphql_backend.document_from_string(schema, query)
+        except Exception:
+            logger.warning('failed to parse a warm-up query', exc_info=True)
+
+    # フォーク前に開いた接続は、ワーカー間で共有されないよう閉じる
+    connections.close_all()
+    logger.info('warmed up in %.1f ms (%d queries)',
+                (time.perf_counter() - started_at) * 1000, len(queries))
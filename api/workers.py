@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import thumbnails
+from .models import News
+from .scraper import fetch_metadata
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+_executor = None
+_thumbnail_executor = None
+# (イベントループ, ホスト名) ごとの [セマフォ, 使っている数]
+_host_semaphores = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.NEWS_METADATA['WORKERS'],
+            thread_name_prefix='news-metadata')
+    return _executor
+
+
+def _get_thumbnail_executor():
+    # 画像の縮小はCPUを使うため、ページの取得とは別の、数を制限したプールで行う
+    global _thumbnail_executor
+    if _thumbnail_executor is None:
+        options = settings.THUMBNAILS
+        if options['POOL'] == 'process':
+            # スレッドを動かしているプロセスからforkしないよう、spawnで起動する
+            _thumbnail_executor = ProcessPoolExecutor(
+                max_workers=options['WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _thumbnail_executor = ThreadPoolExecutor(
+                max_workers=options['WORKERS'], thread_name_prefix='thumbnails')
+    return _thumbnail_executor
+
+
+@contextlib.asynccontextmanager
+async def _host_slot(url):
+    # 同じサイトへの同時アクセス数を制限する。サイトの数だけ増え続けないよう、
+    # 使っている（待っている）ものがなくなったら消す
+    key = (asyncio.get_running_loop(), urlsplit(url).hostname or '')
+    entry = _host_semaphores.get(key)
+    if entry is None:
+        entry = _host_semaphores[key] = [asyncio.Semaphore(settings.NEWS_METADATA['PER_HOST_LIMIT']), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _host_semaphores[key]
+
+
+def _load_news(news_id):
+    try:
+        return News.objects.get(id=news_id)
+    except News.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+
+
+def _save_metadata(news, metadata, status):
+    try:
+        update_fields = ['metadata_status']
+        for field in ('title', 'summary', 'image_path'):
+            if metadata.get(field):
+                max_length = News._meta.get_field(field).max_length
+                setattr(news, field, metadata[field][:max_length])
+                update_fields.append(field)
+        news.metadata_status = status
+        news.save(update_fields=update_fields)
+    finally:
+        close_old_connections()
+
+
+def _save_thumbnails(news, created):
+    try:
+        news.thumbnails = created
+        news.save(update_fields=['thumbnails'])
+    finally:
+        close_old_connections()
+
+
+async def enrich_news(news_id):
+    """ニュースのOGPを取得して、タイトル・概要・画像を埋める"""
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    news = await loop.run_in_executor(executor, _load_news, news_id)
+    if news is None:
+        return None
+
+    metadata = {}
+    status = News.MetadataStatus.DONE
+    # asyncio.wait_forで待つのをやめても、スレッドの取得は続いて接続とスレッドを使い続ける。
+    # 取得時間の上限はhttp_clientで守り、スレッドが終わるまで同じサイトの枠を返さない
+    async with _host_slot(news.url):
+        try:
+            metadata = await loop.run_in_executor(executor, fetch_metadata, news.url)
+        except Exception:
+            logger.warning('failed to fetch metadata: %s', news.url, exc_info=True)
+            status = News.MetadataStatus.FAILED
+
+    await loop.run_in_executor(executor, _save_metadata, news, metadata, status)
+    if news.image_path:
+        await create_thumbnails(news)
+    return news
+
+
+async def create_thumbnails(news):
+    """ニュースのog:imageを取得して、サムネイルを作る。失敗した場合はNoneを返す"""
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    try:
+        async with _host_slot(news.image_path):
+            data = await loop.run_in_executor(executor, thumbnails.fetch_image, news.image_path)
+        args = thumbnails.get_resize_args(data)
+        resized = await loop.run_in_executor(_get_thumbnail_executor(), thumbnails.resize, *args)
+        created = await loop.run_in_executor(
+            executor, thumbnails.save_thumbnails, news.image_path, args[2], resized)
+    except Exception:
+        logger.warning('failed to create thumbnails: %s', news.image_path, exc_info=True)
+        return None
+
+    await loop.run_in_executor(executor, _save_thumbnails, news, created)
+    return news
+
+
+async def enrich_many(news_ids):
+    return await asyncio.gather(*(enrich_news(news_id) for news_id in news_ids))
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name='news-metadata-loop', daemon=True).start()
+        return _loop
+
+
+def _log_failure(news_id, future):
+    # 保存の失敗などで取得待ちのまま残ったものは、ワーカーの起動時に取得し直す（gunicorn.conf.py）
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('failed to enrich news %s', news_id, exc_info=future.exception())
+
+
+def enqueue(news_id):
+    """リクエストを待たせずに、バックグラウンドでOGPの取得を始める"""
+    future = asyncio.run_coroutine_threadsafe(enrich_news(news_id), _get_loop())
+    future.add_done_callback(lambda future: _log_failure(news_id, future))
+    return future
+
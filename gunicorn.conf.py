@@ -0,0 +1,52 @@
+# gunicornの起動時に、カレントディレクトリのこのファイルが読み込まれる
+# （モジュールの変数は設定として読まれるため、gunicornの設定名のconfigはimportしない）
+import decouple
+
+# フォーク前にアプリを読み込み、準備を済ませた状態をワーカーで共有する
+preload_app = decouple.config('GUNICORN_PRELOAD', default=True, cast=bool)
+
+
+def _prepare(cfg):
+    from django.conf import settings
+
+    from api import jwt_users
+
+    # ワーカーごとのメモリのキャッシュでは、ユーザーの無効化が他のワーカーに届かないため起動しない
+    jwt_users.check_cache(cfg.workers)
+    if settings.GRAPHQL_WARM_UP['ENABLED']:
+        from api.warmup import warm_up
+        warm_up()
+
+
+def _enqueue_stale_news():
+    # ワーカーの再起動や保存の失敗で、OGPの取得待ちのまま残ったニュースを取得し直す
+    # （複数のワーカーが同時に起動しても、1件は1つのワーカーだけが取得する）
+    from django.conf import settings
+    from django.db import close_old_connections
+
+    from api.models import News
+
+    if not settings.NEWS_METADATA['STALE_SECONDS']:
+        return
+    try:
+        news_ids = News.objects.claim_stale_pending(settings.NEWS_METADATA['STALE_SECONDS'])
+    finally:
+        close_old_connections()
+    if news_ids:
+        # 取り直すものがなければ、requestsやPillowは読み込まない
+        from api import workers
+        for news_id in news_ids:
+            workers.enqueue(news_id)
+
+
+def when_ready(server):
+    # preload_appでは、アプリを読み込んだ後、ワーカーを起動する前に呼ばれる
+    if server.cfg.preload_app:
+        _prepare(server.cfg)
+
+
+def post_worker_init(worker):
+    # preload_appでない場合は、ワーカーごとにアプリを読み込んだ後、リクエストを受ける前に準備する
+    if not worker.cfg.preload_app:
+        _prepare(worker.cfg)
+    _enqueue_stale_news()
@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
+from api.sse import news_events_app
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# ASGIで起動した場合は、/graphql/を非同期ビューで処理する
+os.environ.setdefault('ASYNC_GRAPHQL', 'True')
+
+django_application = get_asgi_application()
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    # ニュースのイベントは、Djangoのビューを通さずに送り続ける
+    if scope['type'] == 'http' and scope['path'] == settings.NEWS_EVENTS['PATH']:
+        return await news_events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
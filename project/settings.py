@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 
-from decouple import config
+from decouple import Csv, config
 from dj_database_url import parse as dburl
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -65,6 +66,46 @@ GRAPHQL_JWT = {
     'JWT_LONG_RUNNING_REFRESH_TOKEN': True,
     'JWT_EXPIRATION_DELTA': timedelta(minutes=5),
     'JWT_REFRESH_EXPIRATION_DELTA': timedelta(days=7),
+    # トークンのユーザーはキャッシュから取得する
+    'JWT_GET_USER_BY_NATURAL_KEY_HANDLER': 'api.jwt_users.get_user_by_natural_key',
+}
+
+# JWTで認証したユーザーの主キーと有効かどうかのキャッシュ（ユーザーの保存・削除、トークンの無効化で削除する）
+JWT_USER_CACHE = {
+    'CACHE_ALIAS': 'jwt_users',
+    # デフォルトはトークンの有効期間
+    'TTL': config('JWT_USER_CACHE_TTL',
+                  default=int(GRAPHQL_JWT['JWT_EXPIRATION_DELTA'].total_seconds()), cast=int),
+}
+
+# ニュースのOGP取得（バックグラウンド処理）の設定
+NEWS_METADATA = {
+    'WORKERS': config('NEWS_METADATA_WORKERS', default=4, cast=int),
+    'PER_HOST_LIMIT': config('NEWS_METADATA_PER_HOST_LIMIT', default=2, cast=int),
+    # 再試行の待ち時間と本文の読み込みを含めた、1件あたりの取得時間の上限
+    # （本文は受信のたびに確かめ、受信のタイムアウトも残り時間までに縮める。接続とヘッダーの受信は、
+    # 最大で1回分のCONNECT_TIMEOUT・READ_TIMEOUTだけ超えることがある）
+    'TIMEOUT': config('NEWS_METADATA_TIMEOUT', default=10, cast=float),
+    'CONNECT_TIMEOUT': config('NEWS_METADATA_CONNECT_TIMEOUT', default=3.05, cast=float),
+    'READ_TIMEOUT': config('NEWS_METADATA_READ_TIMEOUT', default=5, cast=float),
+    'RETRIES': config('NEWS_METADATA_RETRIES', default=2, cast=int),
+    'RETRY_BACKOFF': config('NEWS_METADATA_RETRY_BACKOFF', default=0.5, cast=float),
+    # Retry-Afterで指定された待ち時間（秒）の上限
+    'RETRY_AFTER_MAX': config('NEWS_METADATA_RETRY_AFTER_MAX', default=5, cast=float),
+    'MAX_REDIRECTS': config('NEWS_METADATA_MAX_REDIRECTS', default=5, cast=int),
+    # 接続をプールしておくホストの数
+    'POOL_HOSTS': config('NEWS_METADATA_POOL_HOSTS', default=32, cast=int),
+    'USER_AGENT': config('NEWS_METADATA_USER_AGENT',
+                         default='Mozilla/5.0 (compatible; NewsShareBot/1.0)'),
+    # </head>が見つからない場合でも、これ以上は読み込まない
+    'MAX_BYTES': config('NEWS_METADATA_MAX_BYTES', default=512 * 1024, cast=int),
+    # 同じURLのOGPはキャッシュから返す
+    'CACHE_ALIAS': 'news_metadata',
+    'CACHE_TTL': config('NEWS_METADATA_CACHE_TTL', default=60 * 60 * 24, cast=int),
+    'NEGATIVE_CACHE_TTL': config('NEWS_METADATA_NEGATIVE_CACHE_TTL', default=60 * 5, cast=int),
+    # 取得待ちのままこの秒数を過ぎたニュース（ワーカーの再起動や保存の失敗で残ったもの）を、
+    # ワーカーの起動時に取得し直す（0の場合は取得し直さない）
+    'STALE_SECONDS': config('NEWS_METADATA_STALE_SECONDS', default=60 * 10, cast=int),
 }
 
 
@@ -94,6 +135,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'project.wsgi.application'
 
+# ASGI（uvicorn）で起動した場合に、/graphql/を非同期ビューで処理する
+# project/asgi.pyで有効になる。同期処理は最大MAX_THREADSのスレッドで並行して実行する
+ASYNC_GRAPHQL = {
+    'ENABLED': config('ASYNC_GRAPHQL', default=False, cast=bool),
+    'MAX_THREADS': config('ASYNC_GRAPHQL_MAX_THREADS', default=8, cast=int),
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -113,14 +161,216 @@ default_dburl = "sqlite:///" + str(BASE_DIR / "db.sqlite3")
 DATABASES = {
     'default': config("DATABASE_URL", default=default_dburl, cast=dburl)
 }
+# 接続をリクエストをまたいで使い回す秒数（0の場合はリクエストごとに接続し直す）
+DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+# pgbouncerのtransaction poolingを経由する場合は、トランザクションをまたぐサーバーサイドカーソルを使わない
+# （Djangoはプリペアドステートメントを使わない。タイムゾーンはサーバー側をUTCにしておく）
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = config('DB_PGBOUNCER', default=False, cast=bool)
+
+DB_CONNECTIONS = {
+    # 使い回す接続が切れていないか、リクエストの最初に確認する
+    'HEALTH_CHECKS': config('DB_HEALTH_CHECKS', default=True, cast=bool),
+    # この秒数以上使われていなかった接続（とエラーが起きた接続）だけを確認する（0の場合は毎回確認する）
+    'HEALTH_CHECK_IDLE': config('DB_HEALTH_CHECK_IDLE', default=30, cast=float),
+}
+
+# 読み取り専用のレプリカ（DATABASE_REPLICA_URLSに、DATABASE_URLと同じ形式でカンマ区切りで指定する）
+DATABASES.update({
+    'replica%d' % index: dict(
+        dburl(url),
+        CONN_MAX_AGE=DATABASES['default']['CONN_MAX_AGE'],
+        DISABLE_SERVER_SIDE_CURSORS=DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'],
+    )
+    for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv()), 1)
+})
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+
+# GraphQLのqueryはレプリカから読み、mutationはプライマリで実行する
+DB_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    # mutationを実行したクライアントのqueryを、プライマリから読む秒数（レプリカの遅延より長くする）
+    'STICKY_SECONDS': config('DB_REPLICA_STICKY_SECONDS', default=5, cast=int),
+    'CACHE_ALIAS': 'db_replicas',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# 本番ではNEWS_METADATA_CACHE_BACKENDにファイルやDBのキャッシュを指定する
+# （DBキャッシュの場合は python manage.py createcachetable が必要）
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'news_metadata': {
+        'BACKEND': config('NEWS_METADATA_CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('NEWS_METADATA_CACHE_LOCATION', default='news-metadata'),
+        'OPTIONS': {
+            # 上限を超えたら、1/CULL_FREQUENCY（デフォルト: 1/3）の件数を削除する。
+            # 最近使われていないものから削除するのはLocMemCacheだけで、FileBasedCacheは無作為に、
+            # DatabaseCacheはキーの順に削除する（memcachedやRedisはこの値を使わず、サーバーの設定に従う）
+            'MAX_ENTRIES': config('NEWS_METADATA_CACHE_MAX_ENTRIES', default=5000, cast=int),
+        },
+    },
+    # 複数のワーカーで動かす場合は、無効化を共有できるようにDBやRedisなどのキャッシュを指定する
+    # （ワーカーごとのメモリの間は、他のワーカーの無効化が届かないため、どの日付もFEED_CACHE_TTLでキャッシュする）
+    'feed': {
+        'BACKEND': config('FEED_CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('FEED_CACHE_LOCATION', default='feed'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('FEED_CACHE_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+    # デフォルトはキャッシュしない。複数のワーカーで動かす場合は、削除を共有できるようにMemcachedなどの
+    # キャッシュを指定する（ワーカーごとのメモリのキャッシュでは、gunicornが起動しない）
+    'jwt_users': {
+        'BACKEND': config('JWT_USER_CACHE_BACKEND',
+                          default='django.core.cache.backends.dummy.DummyCache'),
+        'LOCATION': config('JWT_USER_CACHE_LOCATION', default='jwt-users'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('JWT_USER_CACHE_MAX_ENTRIES', default=5000, cast=int),
+        },
+    },
+    # mutationを実行したクライアントの記録。複数のワーカーで動かす場合は、
+    # どのワーカーでもプライマリから読めるようにDBやRedisなどのキャッシュを指定する
+    'db_replicas': {
+        'BACKEND': config('DB_REPLICA_CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('DB_REPLICA_CACHE_LOCATION', default='db-replicas'),
+    },
+    # 複数のワーカーで制限を共有する場合は、DBやRedisなどのキャッシュを指定する
+    'ratelimit': {
+        'BACKEND': config('RATE_LIMIT_CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('RATE_LIMIT_CACHE_LOCATION', default='ratelimit'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('RATE_LIMIT_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+}
+
+# ニュースの作成・更新・削除をServer-Sent Eventsで送る（ASGIで起動した場合のみ）
+NEWS_EVENTS = {
+    'PATH': '/events/news/',
+    # 複数のプロセスで動かす場合は、api.news_events.PostgresBackend（LISTEN/NOTIFY）にする
+    'BACKEND': config('NEWS_EVENTS_BACKEND', default='api.news_events.LocalBackend'),
+    'DATABASE': 'default',
+    'CHANNEL': 'news_events',
+    'RECONNECT_DELAY': 5,
+    # Last-Event-IDから再開できるよう、プロセスごとに残しておくイベントの件数
+    'HISTORY_SIZE': config('NEWS_EVENTS_HISTORY_SIZE', default=1000, cast=int),
+    # クライアントごとに送りきれていないイベントの上限（超えたら接続を切る）
+    'QUEUE_SIZE': 100,
+    # 接続を保つためにコメントを送る間隔（秒）
+    'KEEPALIVE': 15,
+    # 切断された場合に、ブラウザが再接続するまでの時間（ミリ秒）
+    'RETRY': 3000,
+}
+
+# 日付単位のニュース一覧の実行結果のキャッシュ
+FEED_CACHE = {
+    'CACHE_ALIAS': 'feed',
+    # 今日・昨日の一覧
+    'TTL': config('FEED_CACHE_TTL', default=60 * 5, cast=int),
+    # それより前の一覧（無効化を共有できるキャッシュの場合のみ）
+    'HISTORICAL_TTL': config('FEED_CACHE_HISTORICAL_TTL', default=60 * 60 * 24 * 7, cast=int),
+}
 
 
 GRAPHENE = {'SCHEMA': 'project.schema.schema',
+            # 後ろのものほど外側で実行される
             'MIDDLEWARE': [
+                'api.ratelimit.RateLimitMiddleware',
                 'graphql_jwt.middleware.JSONWebTokenMiddleware',
+                'api.instrumentation.ResolverTimingMiddleware',
             ],
+            # コネクションのfirst/lastの上限（指定がない場合もこの件数まで）
+            'RELAY_CONNECTION_MAX_LIMIT': config('GRAPHQL_MAX_FIRST', default=100, cast=int),
             }
 
+# 操作ごとの実行回数の制限（トークンバケット）。ログイン中はユーザー、それ以外はIPアドレスごと
+RATE_LIMIT = {
+    'ENABLED': config('RATE_LIMIT_ENABLED', default=True, cast=bool),
+    'CACHE_ALIAS': 'ratelimit',
+    # X-Forwarded-Forを追加する信頼できるプロキシの数。0の場合はREMOTE_ADDRを使う
+    # （HerokuではREMOTE_ADDRがルーターになり全員が同じ制限を共有してしまうため、DYNOがあれば1にする）
+    'PROXY_COUNT': config('RATE_LIMIT_PROXY_COUNT', default=1 if config('DYNO', default='') else 0,
+                          cast=int),
+    # '回数/期間（s, m, h, d）'
+    'RATES': {
+        'createNews': config('RATE_LIMIT_CREATE_NEWS', default='30/m'),
+        'bulkCreateNews': config('RATE_LIMIT_BULK_CREATE_NEWS', default='5/m'),
+        'tokenAuth': config('RATE_LIMIT_TOKEN_AUTH', default='10/m'),
+        'createUser': config('RATE_LIMIT_CREATE_USER', default='10/h'),
+    },
+}
+
+# bulkCreateNewsで1回に登録できるニュースの件数（0の場合は制限しない）
+BULK_CREATE_NEWS = {
+    'MAX_ITEMS': config('BULK_CREATE_NEWS_MAX_ITEMS', default=100, cast=int),
+}
+
+# 実行前に見積もるクエリのコストと深さの上限（0の場合は制限しない）
+# コストはフィールドの重み（オブジェクトは1、スカラーは0）に、コネクションの件数を掛けて合計したもの
+# 最も重い画面の日付単位の一覧（todayNews、100件・タグ付き）がコスト2401で、SQLite・ニュース10万件で約50 ms。
+# その2倍程度までを許し、allNews(first: 100)の中のtags(first: 100)のような100×100の展開（20301）は拒否する
+GRAPHQL_QUERY_COST = {
+    'MAX_COST': config('GRAPHQL_MAX_COST', default=5000, cast=int),
+    'MAX_DEPTH': config('GRAPHQL_MAX_DEPTH', default=12, cast=int),
+    # '型名.フィールド名'ごとの重み
+    'FIELD_WEIGHTS': {
+        'Query.searchNews': 10,
+        'NewsNodeConnection.totalCount': 10,
+    },
+    # first/lastの指定がないコネクションを、'型名.フィールド名'ごとに何件として数えるか（省略時はGRAPHQL_MAX_FIRST）
+    'DEFAULT_COUNTS': {
+        'NewsNode.tags': 10,
+    },
+}
+
+# リクエストごとの処理時間の計測
+PERFORMANCE = {
+    'ENABLED': config('PERFORMANCE_ENABLED', default=True, cast=bool),
+    # これ以上かかったリクエストは、リゾルバごとの処理時間もログに出す（ミリ秒、0で無効）
+    'SLOW_REQUEST_THRESHOLD': config('SLOW_REQUEST_THRESHOLD', default=0, cast=int),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': config('API_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+# Automatic Persisted Queriesとパース済みクエリのキャッシュ
+GRAPHQL_PERSISTED_QUERIES = {
+    'CACHE_ALIAS': 'default',
+    'TTL': config('GRAPHQL_PERSISTED_QUERIES_TTL', default=60 * 60 * 24, cast=int),
+    # パース・検証済みのクエリをワーカーごとに保持する件数
+    'DOCUMENT_CACHE_SIZE': config('GRAPHQL_DOCUMENT_CACHE_SIZE', default=500, cast=int),
+    # 指定した場合は、このファイル（クエリ文字列のJSON配列）にあるクエリだけを実行する
+    'ALLOWLIST_PATH': config('GRAPHQL_PERSISTED_QUERIES_ALLOWLIST', default=''),
+}
+
+# 起動時（gunicorn.conf.pyのフック）に、最初のリクエストの前に済ませておく準備
+GRAPHQL_WARM_UP = {
+    'ENABLED': config('GRAPHQL_WARM_UP', default=True, cast=bool),
+    # パース・検証しておくクエリのファイル（クエリ文字列のJSON配列）。省略時は許可リストを使う
+    'QUERIES_PATH': config('GRAPHQL_WARM_UP_QUERIES', default=''),
+}
+
 
 AUTHENTICATION_BACKENDS = [
     'graphql_jwt.backends.JSONWebTokenBackend',
@@ -172,6 +422,22 @@ STATIC_ROOT = str(BASE_DIR / 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = str(BASE_DIR / 'mediafiles')
 
+# og:imageから作るサムネイルの設定。保存先はDEFAULT_FILE_STORAGEのストレージ
+THUMBNAILS = {
+    'WIDTHS': config('THUMBNAIL_WIDTHS', default='160,320,640',
+                     cast=lambda value: [int(width) for width in value.split(',')]),
+    # webpまたはjpeg
+    'FORMAT': config('THUMBNAIL_FORMAT', default='webp'),
+    'QUALITY': config('THUMBNAIL_QUALITY', default=80, cast=int),
+    # 取得する画像のサイズと画素数の上限
+    'MAX_BYTES': config('THUMBNAIL_MAX_BYTES', default=10 * 1024 * 1024, cast=int),
+    'MAX_PIXELS': config('THUMBNAIL_MAX_PIXELS', default=40 * 1000 * 1000, cast=int),
+    # 縮小を行うプール（threadまたはprocess）と、同時に縮小する数（OGPの取得とは別に制限する）
+    # 比べる場合は python manage.py benchmark_thumbnails を使う
+    'POOL': config('THUMBNAIL_POOL', default='thread'),
+    'WORKERS': config('THUMBNAIL_WORKERS', default=2, cast=int),
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
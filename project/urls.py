@@ -3,13 +3,22 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
-from graphene_file_upload.django import FileUploadGraphQLView
 
+from api.backend import CachedDocumentBackend
+from api.views import NewsGraphQLView, as_async_view, stats
 from project.schema import schema
 
+# 起動時の準備（api.warmup）でも、パース・検証済みのクエリを追加する
+graphql_backend = CachedDocumentBackend(
+    max_size=settings.GRAPHQL_PERSISTED_QUERIES['DOCUMENT_CACHE_SIZE'])
+graphql_view = csrf_exempt(NewsGraphQLView.as_view(
+    graphiql=True, schema=schema, backend=graphql_backend))
+if settings.ASYNC_GRAPHQL['ENABLED']:
+    graphql_view = as_async_view(graphql_view, settings.ASYNC_GRAPHQL['MAX_THREADS'])
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql/', graphql_view),
+    path('stats/', stats),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
     + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)